@@ -0,0 +1,108 @@
+"""
+Synthetic notebooks for benchmarking, built with nbformat so no notebook files need to be kept.
+Everything is generated deterministically, so the same parameters always give the same notebook.
+"""
+
+import random
+import struct
+import zlib
+from base64 import b64encode
+
+import nbformat
+
+
+def dataframe_html(rows, cols, seed=0):
+    """
+    HTML for a table as pandas' DataFrame._repr_html_ writes it, with a numeric index and float values
+    """
+    rng = random.Random(seed)
+    html = ['<div>\n<style scoped>\n    .dataframe tbody tr th:only-of-type {\n        vertical-align: middle;\n    }\n'
+            '</style>\n<table border="1" class="dataframe">\n  <thead>\n    <tr style="text-align: right;">\n'
+            '      <th></th>\n']
+    html.extend('      <th>col{}</th>\n'.format(c) for c in range(cols))
+    html.append('    </tr>\n  </thead>\n  <tbody>\n')
+    for r in range(rows):
+        html.append('    <tr>\n      <th>{}</th>\n'.format(r))
+        html.extend('      <td>{:.6f}</td>\n'.format(rng.random()) for _ in range(cols))
+        html.append('    </tr>\n')
+    html.append('  </tbody>\n</table>\n<p>{} rows × {} columns</p>\n</div>'.format(rows, cols))
+    return ''.join(html)
+
+
+def png(width, height, seed=0):
+    """
+    A PNG image (RGB, noise on a gradient) as bytes, different for each seed
+    """
+    rng = random.Random(seed)
+    raw = bytearray()
+    for y in range(height):
+        raw.append(0)  # No filter
+        for x in range(width):
+            raw.extend(((x * 255) // width, (y * 255) // height, rng.randrange(256)))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) \
+        + chunk(b'IDAT', zlib.compress(bytes(raw))) + chunk(b'IEND', b'')
+
+
+def markdown_text(paragraphs, seed=0):
+    """
+    Markdown with headings, styled text, links and lists
+    """
+    rng = random.Random(seed)
+    words = ['export', 'notebook', 'table', 'cell', 'value', 'sheet', 'format', 'row', 'column', 'data']
+    md = []
+    for p in range(paragraphs):
+        if p % 5 == 0:
+            md.append('## Section {}'.format(p // 5))
+        sentence = ' '.join(rng.choice(words) for _ in range(12))
+        md.append('Some **bold {}** and *italic* text with `code` and a [link](https://example.com/{}).'.format(
+            sentence, p))
+        if p % 3 == 0:
+            md.append('\n'.join('- item {} with **emphasis**'.format(i) for i in range(4)))
+    return '\n\n'.join(md)
+
+
+def dataframe_notebook(tables=20, rows=200, cols=10):
+    nb = nbformat.v4.new_notebook()
+    for t in range(tables):
+        nb.cells.append(nbformat.v4.new_code_cell('df{}'.format(t), execution_count=t+1, outputs=[
+            nbformat.v4.new_output('execute_result', execution_count=t+1, data={
+                'text/html': dataframe_html(rows, cols, seed=t),
+                'text/plain': 'DataFrame {}'.format(t),
+            })]))
+    return nb
+
+
+def markdown_notebook(cells=200, paragraphs=10):
+    nb = nbformat.v4.new_notebook()
+    for c in range(cells):
+        nb.cells.append(nbformat.v4.new_markdown_cell(markdown_text(paragraphs, seed=c)))
+    return nb
+
+
+def image_notebook(images=100, width=320, height=240, distinct=50):
+    nb = nbformat.v4.new_notebook()
+    pngs = [b64encode(png(width, height, seed=i)).decode('ascii') for i in range(distinct)]
+    for i in range(images):
+        nb.cells.append(nbformat.v4.new_code_cell('plot({})'.format(i), outputs=[
+            nbformat.v4.new_output('display_data', data={'image/png': pngs[i % distinct],
+                                                         'text/plain': '<Figure>'})]))
+    return nb
+
+
+def stream_notebook(lines=200000, chunks=100):
+    """
+    One cell with a long training log, printed in chunks as separate stream outputs
+    """
+    nb = nbformat.v4.new_notebook()
+    per_chunk = lines // chunks
+    outputs = []
+    for c in range(chunks):
+        text = ''.join('epoch {} step {} loss={:.4f}\n'.format(c, s, 1.0 / (1 + c * per_chunk + s))
+                       for s in range(per_chunk))
+        outputs.append(nbformat.v4.new_output('stream', name='stdout', text=text))
+    nb.cells.append(nbformat.v4.new_code_cell('train()', outputs=outputs))
+    return nb
@@ -0,0 +1,176 @@
+"""
+Benchmark XLSExporter on synthetic notebooks, and compare against stored baselines.
+
+    python -m benchmarks.run                      # run all, fail if slower or bigger than benchmarks/baseline.json
+    python -m benchmarks.run tables markdown --scale 0.2
+    python -m benchmarks.run --save-baseline      # record this machine's results as the new baseline
+    python -m benchmarks.run --XLSExporter.html_parser=streaming
+
+Timings depend on the machine, so baselines should be saved on the machine the comparisons will run on.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+
+from traitlets.config.loader import KVArgParseConfigLoader
+
+from nb2xls import XLSExporter
+from nb2xls.__meta__ import __version__
+
+from . import generators
+
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def _scaled(n, scale):
+    return max(1, int(n * scale))
+
+
+# Each scenario makes a notebook at a given scale and says how many units of work it holds, for throughput
+def _tables(scale):
+    tables, rows, cols = _scaled(20, scale), 200, 10
+    return generators.dataframe_notebook(tables, rows, cols), {'table_cells': tables * (rows+1) * (cols+1)}
+
+
+def _markdown(scale):
+    return generators.markdown_notebook(_scaled(200, scale), 10), {}
+
+
+def _images(scale):
+    images = _scaled(100, scale)
+    return generators.image_notebook(images, distinct=max(1, images // 2)), {'images': images}
+
+
+def _streams(scale):
+    lines = _scaled(200000, scale)
+    return generators.stream_notebook(lines, chunks=min(100, lines)), {'lines': lines}
+
+
+SCENARIOS = {
+    'tables': _tables,
+    'markdown': _markdown,
+    'images': _images,
+    'streams': _streams,
+}
+
+# Measurements compared against the baseline, where bigger is worse
+COMPARED = ('seconds', 'peak_memory', 'output_bytes')
+
+
+def run_scenario(name, scale, repeat, config):
+    """
+    :return: dict of measurements: best seconds of repeat exports, peak traced memory, output size and throughputs
+    """
+    nb, units = SCENARIOS[name](scale)
+    units['cells'] = len(nb.cells)
+
+    exporter = XLSExporter(config=config)
+
+    seconds = None
+    for _ in range(repeat):
+        output = BytesIO()
+        start = time.perf_counter()
+        exporter.export_to_file(nb, output)
+        elapsed = time.perf_counter() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+
+    # Traced separately, as tracing slows everything down
+    tracemalloc.start()
+    try:
+        exporter.export_to_file(nb, BytesIO())
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    result = {'seconds': seconds, 'peak_memory': peak_memory, 'output_bytes': len(output.getvalue())}
+    for unit, n in units.items():
+        result[unit + '_per_second'] = n / seconds
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """
+    :return: list of messages, one for each measurement more than tolerance (a fraction) worse than the baseline
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for measure in COMPARED:
+            if measure in base and result[measure] > base[measure] * (1 + tolerance):
+                regressions.append('{} {}: {:.4g} is more than {:.0%} worse than the baseline {:.4g}'.format(
+                    name, measure, result[measure], tolerance, base[measure]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.run',
+        description='Benchmark XLSExporter on synthetic notebooks. Any --XLSExporter.<trait>=<value> arguments '
+                    'configure the exporter.')
+    parser.add_argument('scenarios', nargs='*',
+                        help='scenarios to run, from {} (default: all)'.format(', '.join(sorted(SCENARIOS))))
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply the size of every notebook')
+    parser.add_argument('--repeat', type=int, default=3, help='exports to time for each scenario; the best counts')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='baseline JSON file')
+    parser.add_argument('--save-baseline', action='store_true', help='save the results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='fraction by which a result may be worse than the baseline (default: 0.25)')
+
+    args, config_args = parser.parse_known_args(argv)
+    config = KVArgParseConfigLoader(argv=config_args).load_config()
+
+    names = args.scenarios or sorted(SCENARIOS)
+    for name in names:
+        if name not in SCENARIOS:
+            parser.error('unknown scenario {}'.format(name))
+
+    results = {}
+    for name in names:
+        result = results[name] = run_scenario(name, args.scale, max(1, args.repeat), config)
+        print('{:10} {:8.3f}s  {:7.1f} MB peak  {:9d} bytes  {}'.format(
+            name, result['seconds'], result['peak_memory'] / 1e6, result['output_bytes'],
+            '  '.join('{:.4g} {}'.format(v, k.replace('_', ' ')) for k, v in sorted(result.items())
+                      if k.endswith('_per_second'))))
+
+    if args.save_baseline:
+        baseline = {
+            'scale': args.scale,
+            'nb2xls': __version__,
+            'python': platform.python_version(),
+            'machine': platform.platform(),
+            'results': results,
+        }
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print('Saved baseline to {}'.format(args.baseline))
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('No baseline at {}; run with --save-baseline to create one'.format(args.baseline), file=sys.stderr)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    if baseline['scale'] != args.scale:
+        print('Baseline is at scale {}, not comparing'.format(baseline['scale']), file=sys.stderr)
+        return 0
+
+    regressions = compare(results, baseline['results'], args.tolerance)
+    for regression in regressions:
+        print('REGRESSION ' + regression, file=sys.stderr)
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+"""
+Run exports from asyncio code without blocking the event loop, see XLSExporter.export_async.
+
+Exports run in a thread pool shared by every exporter in the process, so however many requests arrive at once
+only a bounded number of workbooks are being rendered (and held in memory) at a time; the rest wait their turn.
+"""
+
+import asyncio
+import inspect
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ExportCancelled(Exception):
+    """
+    Raised in the export thread when the coroutine waiting for it has been cancelled.
+    """
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def export_executor(workers):
+    """
+    :param workers: number of exports that may run at once
+    :return: the process-wide ThreadPoolExecutor with that many threads, created on first use
+    """
+    with _executors_lock:
+        executor = _executors.get(workers)
+        if executor is None:
+            executor = _executors[workers] = ThreadPoolExecutor(workers, thread_name_prefix='nb2xls-export')
+        return executor
+
+
+async def write_chunks(source, writer, chunk_size, executor=None):
+    """
+    Copy a binary file to an asynchronous writer, one chunk at a time.
+    :param source: binary file object positioned at the start of the data
+    :param writer: object with a write(bytes) method, which may return an awaitable (as aiofiles and
+      starlette-style senders do); if it also has a drain() coroutine method (as asyncio.StreamWriter does),
+      that is awaited after each chunk
+    :param chunk_size: bytes per write
+    :param executor: executor to read the file in, or None for asyncio's default
+    :return: number of bytes written
+    """
+    loop = asyncio.get_running_loop()
+    drain = getattr(writer, 'drain', None)
+    written = 0
+    while True:
+        chunk = await loop.run_in_executor(executor, source.read, chunk_size)
+        if not chunk:
+            return written
+        result = writer.write(chunk)
+        if inspect.isawaitable(result):
+            await result
+        if drain is not None:
+            await drain()
+        written += len(chunk)
@@ -0,0 +1,175 @@
+"""
+Convert many notebooks to Excel spreadsheets at once, in parallel worker processes.
+
+Each worker keeps one warm XLSExporter for all the notebooks it converts, so the cost of starting Python and
+importing nbconvert is paid once per worker rather than once per notebook.
+
+    nb2xls reports/ 'archive/**/*.ipynb' --output-dir xlsx --workers 8 --XLSExporter.constant_memory=True
+"""
+
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+from multiprocessing import Pool
+
+import nbformat
+from traitlets.config.loader import KVArgParseConfigLoader
+
+from .exporter import XLSExporter
+
+
+# Configuration arguments passed on to the exporter, as --Class.trait=value
+config_arg_pat = re.compile(r'--[A-Za-z_]\w*(\.[A-Za-z_]\w*)+=')
+
+# The exporter for this worker process, created once by _init_worker
+_exporter = None
+
+
+def _init_worker(config):
+    global _exporter
+    _exporter = XLSExporter(config=config)
+    # Each notebook is read here and dropped after its export, so unless configured otherwise its images needn't be
+    # kept in base64 as well
+    if 'release_image_data' not in config.get('XLSExporter', {}):
+        _exporter.release_image_data = True
+
+
+def _export_one(job):
+    """
+    Convert one notebook with this worker's exporter.
+    :param job: (notebook filename, xlsx filename)
+    :return: (notebook filename, xlsx filename, seconds taken, error message or None)
+    """
+    ipynb_filename, xlsx_filename = job
+    start = time.perf_counter()
+    try:
+        nb = nbformat.read(ipynb_filename, as_version=4)
+
+        path, basename = os.path.split(ipynb_filename)
+        resources = {'metadata': {'name': os.path.splitext(basename)[0], 'path': path}}
+
+        _exporter.export_to_file(nb, xlsx_filename, resources)
+
+    except Exception as e:
+        return ipynb_filename, xlsx_filename, time.perf_counter() - start, '{}: {}'.format(type(e).__name__, e)
+
+    return ipynb_filename, xlsx_filename, time.perf_counter() - start, None
+
+
+def find_notebooks(patterns):
+    """
+    :param patterns: list of notebook filenames, glob patterns (** is recursive) and directories
+    :return: sorted list of notebook filenames, without duplicates; directories are searched recursively
+    """
+    return sorted(find_notebook_roots(patterns))
+
+
+def find_notebook_roots(patterns):
+    """
+    As find_notebooks, along with the directory each notebook was found under: the directory given, or the
+    part of the glob pattern before any wildcards, or the notebook's own directory if it was named
+    :return: dict of notebook filename to that directory, for the first pattern that found the notebook
+    """
+    notebooks = {}
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            root = pattern
+            pattern = os.path.join(pattern, '**', '*.ipynb')
+        else:
+            root = _pattern_root(pattern)
+        for filename in glob.glob(pattern, recursive=True):
+            if os.path.isfile(filename) and '.ipynb_checkpoints' not in filename.split(os.sep):
+                notebooks.setdefault(filename, root)
+    return notebooks
+
+
+def _pattern_root(pattern):
+    dirname = os.path.dirname(pattern)
+    while glob.has_magic(dirname):
+        dirname = os.path.dirname(dirname)
+    return dirname
+
+
+def output_filename(ipynb_filename, output_dir=None, root=None):
+    """
+    Where to write the spreadsheet for a notebook, named as nbconvert would: alongside it, or in output_dir.
+    :param root: directory the notebook was found under, see find_notebook_roots; its path below root is kept
+      under output_dir, so that notebooks with the same name in different directories don't overwrite each other
+    """
+    basename = os.path.splitext(os.path.basename(ipynb_filename))[0] + '.xlsx'
+    if not output_dir:
+        return os.path.join(os.path.dirname(ipynb_filename), basename)
+    subdir = os.path.relpath(os.path.dirname(ipynb_filename), root or os.curdir) if root is not None else ''
+    return os.path.normpath(os.path.join(output_dir, subdir, basename))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='nb2xls',
+        description='Convert Jupyter notebooks to Excel spreadsheets (xlsx) in parallel. Any --XLSExporter.<trait>=<value> '
+                    'arguments configure the exporter, as with jupyter nbconvert.')
+    parser.add_argument('notebooks', nargs='+', help='notebook files, glob patterns or directories to search')
+    parser.add_argument('--output-dir', help='directory for the xlsx files (default: next to each notebook)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='number of worker processes (default: number of CPUs)')
+
+    args, config_args = parser.parse_known_args(argv)
+    unknown = [arg for arg in config_args if not config_arg_pat.match(arg)]
+    if unknown:
+        parser.error('unrecognized arguments: {}'.format(' '.join(unknown)))
+    config = KVArgParseConfigLoader(argv=config_args).load_config()
+
+    notebooks = find_notebook_roots(args.notebooks)
+    if len(notebooks) == 0:
+        print('No notebooks found', file=sys.stderr)
+        return 1
+
+    start = time.perf_counter()
+    failures = 0
+
+    # Notebooks whose spreadsheets would overwrite one already in the batch are reported as failures instead
+    jobs, outputs = [], {}
+    for ipynb_filename in sorted(notebooks):
+        xlsx_filename = output_filename(ipynb_filename, args.output_dir, notebooks[ipynb_filename])
+        key = os.path.normcase(os.path.abspath(xlsx_filename))
+        if key in outputs:
+            failures += 1
+            print('{:8.2f}s  FAILED {}: {} is already the output of {}'.format(
+                0.0, ipynb_filename, xlsx_filename, outputs[key]), file=sys.stderr)
+            continue
+        outputs[key] = ipynb_filename
+        jobs.append((ipynb_filename, xlsx_filename))
+        os.makedirs(os.path.dirname(xlsx_filename) or '.', exist_ok=True)
+
+    workers = max(1, min(args.workers or 1, len(jobs)))
+    if workers == 1:
+        _init_worker(config)
+        results = map(_export_one, jobs)
+        pool = None
+    else:
+        pool = Pool(workers, initializer=_init_worker, initargs=(config,))
+        results = pool.imap_unordered(_export_one, jobs)
+
+    try:
+        for ipynb_filename, xlsx_filename, seconds, error in results:
+            if error is None:
+                print('{:8.2f}s  {} -> {}'.format(seconds, ipynb_filename, xlsx_filename))
+            else:
+                failures += 1
+                print('{:8.2f}s  FAILED {}: {}'.format(seconds, ipynb_filename, error), file=sys.stderr)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    print('Converted {} of {} notebooks in {:.2f}s with {} worker{}'.format(
+        len(notebooks)-failures, len(notebooks), time.perf_counter()-start, workers, '' if workers == 1 else 's'))
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
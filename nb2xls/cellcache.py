@@ -0,0 +1,228 @@
+import json
+import pickle
+from collections import namedtuple
+from io import BytesIO
+
+import xlsxwriter
+
+from .diskcache import DiskCache
+
+
+# Positions of the row arguments of the worksheet methods the exporter writes with. Calls to these are recorded
+# with rows relative to the first row of the cell, so they can be replayed wherever the cell lands next time.
+ROW_ARGS = {
+    'write': (0,),
+    'write_string': (0,),
+    'write_number': (0,),
+    'write_blank': (0,),
+    'write_formula': (0,),
+    'write_datetime': (0,),
+    'write_boolean': (0,),
+    'write_row': (0,),
+    'write_url': (0,),
+    'write_rich_string': (0,),
+    'insert_image': (0,),
+    'merge_range': (0, 2),
+    'add_table': (0, 2),
+    'set_column': (),
+}
+
+# Stand-ins for the arguments that only make sense in the workbook they were created for
+CachedStyle = namedtuple('CachedStyle', 'key')
+CachedImage = namedtuple('CachedImage', 'data')
+CachedSheetLink = namedtuple('CachedSheetLink', 'sheet')
+
+
+class WorksheetRecorder(object):
+    """
+    Stands in for the worksheet while a cell is written, recording the writes (and passing them through to a
+    worksheet, if given).
+    Writes to the cell's own worksheet are recorded with rows relative to the cell's first row. A cell can also
+    open worksheets of its own (see open_sheet), whose rows are recorded as they are.
+    """
+
+    def __init__(self, worksheet, registry, first_row, ops=None, sheet=None):
+        """
+        :param worksheet: the xlsxwriter Worksheet actually written to, or None to only record the writes
+        :param registry: MdXlsStyleRegistry all the formats used come from
+        :param first_row: row the cell starts on
+        """
+        self._worksheet = worksheet
+        self._registry = registry
+        self._first_row = first_row
+        self._sheet = sheet
+        self.ops = ops if ops is not None else []
+        self.sheets = []
+
+    def __getattr__(self, name):
+        rows = ROW_ARGS.get(name)
+        if self._worksheet is None:
+            if rows is None:
+                raise AttributeError(name)
+            method = None
+        else:
+            method = getattr(self._worksheet, name)
+            if rows is None:
+                return method
+
+        def record(*args, **kwargs):
+            self.ops.append((name, self._freeze_args(args, rows), self._freeze(kwargs), self._sheet))
+            if method is None:
+                return 0
+            return method(*args, **kwargs)
+
+        return record
+
+    def open_sheet(self, kind):
+        """
+        Record that the cell opens a worksheet of its own, e.g. for a large table. It is only created on replay,
+        with a name that is unique in the workbook it is replayed into, so that is not known yet.
+        :param kind: what the worksheet is for, passed on to replay's open_sheet
+        :return: (recorder for the new worksheet, CachedSheetLink standing in for an internal: hyperlink to it)
+        """
+        self.sheets.append(kind)
+        sheet = len(self.sheets) - 1
+        return WorksheetRecorder(None, self._registry, 0, self.ops, sheet), CachedSheetLink(sheet)
+
+    def _freeze_args(self, args, rows):
+        args = [self._freeze(arg) for arg in args]
+        for i in rows:
+            args[i] -= self._first_row
+        return tuple(args)
+
+    def _freeze(self, value):
+        if isinstance(value, xlsxwriter.format.Format):
+            return CachedStyle(self._registry.style_key(value))
+        if isinstance(value, BytesIO):
+            return CachedImage(value.getvalue())
+        if isinstance(value, CachedSheetLink):
+            return value
+        if isinstance(value, dict):
+            return {k: self._freeze(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return type(value)(self._freeze(v) for v in value)
+        return value
+
+
+class DetachedFormats(object):
+    """
+    Creates formats belonging to no workbook, for an MdXlsStyleRegistry used to record cells that are replayed
+    into a workbook elsewhere; the recording only keeps their style keys.
+    """
+
+    def add_format(self, properties=None):
+        return xlsxwriter.format.Format(properties)
+
+
+def replay(worksheet, registry, recording, first_row, open_sheet=None, max_rows=None, set_column=None):
+    """
+    Repeat the writes recorded for a cell, starting at first_row.
+    :param worksheet: xlsxwriter Worksheet to write to
+    :param registry: MdXlsStyleRegistry of the worksheet's workbook, for the formats
+    :param recording: (ops, kinds of the worksheets the cell opened), from a WorksheetRecorder
+    :param open_sheet: function (kind, worksheet) returning a new Worksheet, with kind 'rollover' to continue
+      worksheet once max_rows is reached, or else one of the recorded kinds
+    :param max_rows: rows per worksheet; writes at or beyond this go to a new worksheet
+    :param set_column: function (worksheet, first_col, last_col, width) to call instead of worksheet.set_column,
+      e.g. to only ever widen columns
+    :return: (worksheet, first_row) the cell's following rows belong on, which has moved if it rolled over
+    """
+    ops, sheet_kinds = recording
+    images = {}
+
+    # Each target is a list of the worksheets its rows went on, each [worksheet, offset added to recorded rows,
+    # first recorded row on it], with more than one once it has rolled over; None is the cell's own worksheet
+    targets = {None: [[worksheet, first_row, float('-inf')]]}
+    sheet_links = {}
+
+    def target(sheet):
+        # The cell's own worksheets are opened when first used, so worksheets are added in the same order as when
+        # the cell was written directly
+        if sheet not in targets:
+            new_sheet = open_sheet(sheet_kinds[sheet], targets[None][-1][0])
+            targets[sheet] = [[new_sheet, 0, 0]]
+            sheet_links[sheet] = "internal:'{}'!A1".format(new_sheet.name)
+        return targets[sheet]
+
+    def thaw(value):
+        if isinstance(value, CachedStyle):
+            return registry.style_from_key(value.key)
+        if isinstance(value, CachedImage):
+            # Images that appear more than once share a BytesIO, as when they were first written
+            image = images.get(value.data)
+            if image is None:
+                image = images[value.data] = BytesIO(value.data)
+            return image
+        if isinstance(value, CachedSheetLink):
+            target(value.sheet)
+            return sheet_links[value.sheet]
+        if isinstance(value, dict):
+            return {k: thaw(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return type(value)(thaw(v) for v in value)
+        return value
+
+    for name, args, kwargs, sheet in ops:
+        segments = target(sheet)
+        rows = ROW_ARGS[name]
+        args = [thaw(arg) for arg in args]
+
+        segment = segments[-1]
+        if rows:
+            first, last = args[rows[0]], args[rows[-1]]
+            if max_rows is not None and first >= segment[2] and first + segment[1] >= max_rows:
+                # Carry on from the top of a new worksheet
+                segment = [open_sheet('rollover', segment[0]), -first, first]
+                segments.append(segment)
+            else:
+                # Rows written after the worksheet rolled over, e.g. merged table headings, go where those rows went
+                segment = next(segment for segment in reversed(segments) if first >= segment[2])
+
+            if last != first:
+                # As when writing directly, ranges that went over onto a new worksheet are left out
+                following = segments.index(segment) + 1
+                if (following < len(segments) and last >= segments[following][2]) or \
+                        (max_rows is not None and last + segment[1] >= max_rows):
+                    continue
+
+            for i in rows:
+                args[i] += segment[1]
+
+        if name == 'set_column' and set_column is not None:
+            set_column(segment[0], *args)
+        else:
+            getattr(segment[0], name)(*args, **thaw(kwargs))
+
+    return targets[None][-1][0], targets[None][-1][1]
+
+
+class CellCache(DiskCache):
+    """
+    On-disk cache of the writes each cell made, keyed by a hash of the cell and of the settings it was written with.
+    Entries are pickles, so only use a directory that nobody else can write to.
+    """
+
+    # Bump when the entries (or what the exporter writes for a cell) change, so old entries are not replayed
+    version = 3
+
+    def cell_key(self, cell, settings):
+        """
+        :param cell: notebook cell
+        :param settings: JSON-serializable dict of everything else that affects how the cell is written
+        """
+        return self.key(str(self.version),
+                        json.dumps(cell, sort_keys=True, default=str),
+                        json.dumps(settings, sort_keys=True, default=str))
+
+    def get_cell(self, key):
+        """
+        :return: (number of rows the cell took up, recording for replay, image counts from when it was written, see
+          ExportStats.images), or None if the cell is not cached
+        """
+        data = self.get(key)
+        if data is None:
+            return None
+        return pickle.loads(data)
+
+    def put_cell(self, key, rows, recording, image_stats):
+        self.put(key, pickle.dumps((rows, recording, image_stats), protocol=pickle.HIGHEST_PROTOCOL))
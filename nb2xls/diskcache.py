@@ -0,0 +1,51 @@
+import hashlib
+import os
+import tempfile
+
+
+class DiskCache(object):
+    """
+    Directory of cache entries (bytes), each in a file named by a hash of whatever determines its contents.
+    Entries are written atomically so several exporters (or processes) can share one directory.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(*parts):
+        """
+        Content hash for a cache entry.
+        :param parts: bytes or str that together determine the entry, e.g. backend name and source
+        """
+        h = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, str):
+                part = part.encode('utf-8')
+            h.update(part)
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """
+        :return: cached bytes, or None if there is no entry for key
+        """
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, data):
+        fd, tmpname = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmpname, self._path(key))
+        except BaseException:
+            os.unlink(tmpname)
+            raise
@@ -1,33 +1,49 @@
+import asyncio
 import copy
+import cProfile
+import os
+import tempfile
+import threading
 from io import BytesIO
 import re
-import base64
-from collections.abc import Iterable
-from collections import defaultdict
-from math import ceil, isnan
+import hashlib
+from collections import defaultdict, deque
+from functools import lru_cache
+from itertools import islice
+from math import ceil
+from time import perf_counter
 
 from nbconvert.exporters import Exporter
+from nbconvert.preprocessors import coalesce_streams
 
-from traitlets import Bool
+from traitlets import Bool, Unicode, Enum, Int, Dict, TraitError, default, observe, validate
+from traitlets.utils.importstring import import_item
 
 from bs4 import BeautifulSoup
 from bs4.element import NavigableString, Tag
 import xlsxwriter
 
 import mistune
-from .mdrenderer import Md2XLSRenderer, \
-    MdStyleInstructionCell, MdStyleInstructionText, MdStyleInstructionLink, MdStyleInstructionListItem, \
-    MdStyleInstructionLineBreak, MdStyleInstructionListStart, MdStyleInstructionListEnd
+from .mdrenderer import Md2XLSRenderer, flatten_blocks, \
+    KIND_CELL, KIND_TEXT, KIND_LINK, KIND_LIST_START, KIND_LIST_END, KIND_LIST_ITEM, KIND_LINE_BREAK, KIND_BLOCK_END
 
-from .mdxlsstyles import MdXlsStyleRegistry
+from .mdxlsstyles import MdXlsStyleRegistry, FormatTable
 
-try:
-    import cv2 # Prefer Open CV2 but don't put in requirements.txt because it can be difficult to install
-    import numpy as np
-    usecv2 = True
-except ImportError:
-    import png # PyPNG is a pure-Python PNG manipulator
-    usecv2 = False
+from .images import image_size, decode_base64, base64_digest, resample_image, cairosvg, Image, ImageCache
+from .cellcache import CellCache, WorksheetRecorder, DetachedFormats, replay
+from .render import render_executor, render_cell
+from .asyncexport import ExportCancelled, export_executor, write_chunks
+from .sheets import unique_sheet_name, top_heading, MAX_SHEET_ROWS
+from .stats import ExportStats
+from .__meta__ import __version__
+from .htmlstream import HTMLStreamParser
+from .textplain import merged_stream_outputs, collapse_lines, WRITE_SPECIAL_PREFIXES
+from .tables import is_dataframe_html, parse_dataframe_html, rows_from_soup, rows_from_dataresource, \
+    rows_from_frame, place_cells, convert_column, typed_column, infer_column, column_width, excel_table_headers
+from .sidecar import sidecar_filename, load_sidecar
+
+# GIF images can only be inserted by recent versions of xlsxwriter
+xlsxwriter_gif = hasattr(xlsxwriter.workbook.Workbook, '_process_gif')
 
 
 class XLSExporter(Exporter):
@@ -46,6 +62,185 @@ class XLSExporter(Exporter):
         jupyter nbconvert --to xls Examples/Test.ipynb --XLSExporter.ignore_markdown_errors=False
     """).tag(config=True)
 
+    markdown_cache_size = Int(256, help="""
+        Number of distinct markdown texts (cells and text/markdown outputs) whose parsed form is kept by this
+        exporter, so boilerplate repeated across cells or across the notebooks of a batch is only parsed once.
+        Set to 0 to parse every time.
+    """).tag(config=True)
+
+    markdown_formats = Dict(help="""
+        Format properties (as for xlsxwriter's add_format) to add to or override those of the markdown styles,
+        by style name: h1-h6, double_emphasis, emphasis, codespan and strikethrough. Each style's properties are
+        merged over its defaults, for example {'h1': {'font_color': 'navy'}, 'codespan': {'font_name': 'Consolas'}}.
+    """).tag(config=True)
+
+    constant_memory = Bool(False, help="""
+        Set constant_memory to True to use xlsxwriter's constant_memory mode. Each row is flushed to a
+        temporary file as soon as the next row is started, so peak memory depends on the width of a row
+        rather than the size of the notebook. Strings are then stored inline instead of in the shared
+        string table. Combine with export_to_file to send the workbook straight to its destination.
+    """).tag(config=True)
+
+    copy_notebook = Bool(True, help="""
+        Preprocessors are run on a copy of the notebook so the caller's notebook is left untouched. The copy is
+        only made if an enabled preprocessor would actually change the notebook. Set copy_notebook to False to
+        export a trusted notebook without ever copying it; enabled preprocessors then modify it in place.
+    """).tag(config=True)
+
+    merge_streams = Bool(True, help="""
+        Write consecutive stream outputs of the same name (stdout or stderr) as one output, as Jupyter displays
+        them, and apply carriage returns in stream text. Doing this while writing means nbconvert's
+        coalesce_streams preprocessor, and the copy of the notebook it needs, can be skipped. Set to False to leave
+        it to coalesce_streams.
+    """).tag(config=True)
+
+    text_head_lines = Int(0, help="""
+        Together with text_tail_lines, limits the length of text/plain and stream outputs. If either is set, an
+        output with more than text_head_lines + text_tail_lines lines is collapsed to its first text_head_lines
+        and last text_tail_lines lines, with a line in between saying how many were left out.
+    """).tag(config=True)
+
+    text_tail_lines = Int(0, help="""
+        Number of lines kept from the end of long text/plain and stream outputs; see text_head_lines.
+    """).tag(config=True)
+
+    html_parser = Enum(['html.parser', 'lxml', 'streaming'], default_value='html.parser', help="""
+        How text/html outputs (other than plain pandas DataFrames) are parsed. 'html.parser' and 'lxml' select
+        the BeautifulSoup tree builder; lxml is much faster but must be installed. 'streaming' uses an event
+        driven parser that writes the same cells without ever building a document tree.
+    """).tag(config=True)
+
+    svg_rasterizer = Unicode(help="""
+        Dotted name of a function that takes an SVG document as bytes and returns a PNG image as bytes, used to
+        embed image/svg+xml outputs. Defaults to nb2xls.images.cairosvg_rasterize if CairoSVG is installed.
+        Set to an empty string to skip SVG outputs.
+    """).tag(config=True)
+
+    @default('svg_rasterizer')
+    def _svg_rasterizer_default(self):
+        return 'nb2xls.images.cairosvg_rasterize' if cairosvg is not None else ''
+
+    image_cache_dir = Unicode('', help="""
+        Directory for an on-disk cache of rasterized SVG images and resampled images, keyed by a hash of the
+        original and the settings used. Re-exporting a notebook then reuses the cached images instead of
+        rasterizing or resampling again.
+    """).tag(config=True)
+
+    image_max_width = Int(0, help="""
+        Maximum width in pixels of embedded PNG and JPEG images; wider ones are resampled with Pillow, and shown at
+        the same size as before. 0 for no limit. The image_* resampling options all need Pillow to be installed.
+    """).tag(config=True)
+
+    image_max_height = Int(0, help="""
+        Maximum height in pixels of embedded PNG and JPEG images, as for image_max_width. 0 for no limit.
+    """).tag(config=True)
+
+    image_dpi = Int(0, help="""
+        Resolution to resample images to, relative to the size they are shown at in the notebook (96 pixels per
+        inch). For example 192 keeps twice the displayed pixels for high resolution screens, so a 4K figure shown
+        at 600 pixels wide is stored 1200 pixels wide. 0 keeps every pixel.
+    """).tag(config=True)
+
+    image_jpeg_quality = Int(0, help="""
+        JPEG quality (1-95) at which photo-like PNGs (opaque, with more than 4096 colors) are stored as JPEG when
+        that is smaller, and resampled JPEGs are saved. 0 leaves PNGs as PNGs.
+    """).tag(config=True)
+
+    image_palette_colors = Int(0, help="""
+        Number of colors (at most 256) to try reducing PNGs other than photos to, storing them as palette PNGs when
+        that is smaller. 0 to leave colors alone.
+    """).tag(config=True)
+
+    cell_cache_dir = Unicode('', help="""
+        Directory for an on-disk cache of what was written for each cell, keyed by a hash of the cell's source and
+        outputs and of the exporter settings. When a notebook is exported again, unchanged cells are replayed into
+        the new workbook without parsing their markdown, HTML or images again. Entries are pickles, so the
+        directory must not be writable by anyone untrusted.
+    """).tag(config=True)
+
+    sheet_layout = Enum(['single', 'heading', 'cell'], default_value='single', help="""
+        How the notebook is split between worksheets: 'single' writes every cell to one worksheet, 'heading' starts
+        a new worksheet (named after the heading) at each markdown cell beginning with a level 1 heading, and
+        'cell' gives every cell its own worksheet.
+    """).tag(config=True)
+
+    table_sheet_rows = Int(0, help="""
+        Tables with more rows than this are written to a worksheet of their own, with a hyperlink to it where the
+        table would have been. 0 keeps every table in place.
+    """).tag(config=True)
+
+    max_sheet_rows = Int(MAX_SHEET_ROWS, help="""
+        Number of rows after which writing continues on a new worksheet, named after the full one. The default is
+        Excel's limit, beyond which xlsxwriter ignores writes, and the most allowed.
+    """).tag(config=True)
+
+    @validate('max_sheet_rows')
+    def _validate_max_sheet_rows(self, proposal):
+        if not 1 <= proposal['value'] <= MAX_SHEET_ROWS:
+            raise TraitError('max_sheet_rows must be from 1 to {}, not {}'.format(MAX_SHEET_ROWS, proposal['value']))
+        return proposal['value']
+
+    table_types = Bool(False, help="""
+        Recognise dates, date-times, percentages, numbers with thousands separators and booleans in HTML tables,
+        one column at a time, and write them as Excel dates, numbers and booleans with matching number formats.
+        Otherwise only plain numbers are converted and everything else is written as text. Tables from
+        application/vnd.dataresource+json outputs already have their types, and get dates and date-times too.
+    """).tag(config=True)
+
+    excel_tables = Bool(False, help="""
+        Make each simple table (one row of headings, no spanning cells), such as most DataFrames, into an Excel
+        table with an autofilter, for sorting, filtering and pivot tables. Not available with constant_memory.
+    """).tag(config=True)
+
+    table_column_widths = Bool(False, help="""
+        Widen worksheet columns to fit the tables in them, judging by a sample of each column's values.
+        Columns are only ever widened, so the widest table in a column decides its width.
+    """).tag(config=True)
+
+    merge_table_spans = Bool(False, help="""
+        Merge the cells that table headings span, such as the outer levels of a pandas MultiIndex, rather than
+        writing each heading in the first of its cells only.
+    """).tag(config=True)
+
+    table_sidecars = Bool(False, help="""
+        Export the whole of a table that the notebook only shows truncated, from the pickled DataFrame named in
+        its output's metadata (see nb2xls.sidecar). Sidecar filenames are relative to the notebook's directory.
+        Unpickling can run arbitrary code, so only enable this for notebooks you trust.
+    """).tag(config=True)
+
+    profile_file = Unicode('', help="""
+        Filename to save cProfile statistics of each export to, for example to open with pstats or snakeviz.
+        Only the exporting process is profiled, not any render_workers processes.
+    """).tag(config=True)
+
+    render_workers = Int(0, help="""
+        Number of workers to render cells in. Parsing markdown and HTML and probing images are done for several
+        cells at once, and the results are written to the worksheet in order as they arrive. 0 or 1 renders each
+        cell in turn, as it is written.
+    """).tag(config=True)
+
+    render_pool = Enum(['process', 'thread'], default_value='process', help="""
+        Whether render_workers are processes or threads. Threads avoid sending cells and their rendered rows
+        between processes, but only run in parallel where the parsers release the GIL. Threads are always used in
+        a daemon process, such as a worker of the nb2xls batch command.
+    """).tag(config=True)
+
+    tmpdir = Unicode('', help="""
+        Directory for the temporary files xlsxwriter creates while assembling the workbook, for example
+        in constant_memory mode. Defaults to the system temporary directory.
+    """).tag(config=True)
+
+    release_image_data = Bool(False, help="""
+        Remove each image's base64 data from its output once the image is in the workbook, so that only the decoded
+        image is held until the export finishes. Only for callers that don't need the notebook afterwards, and only
+        effective when preprocessing didn't copy the notebook (otherwise the caller's notebook still has the data).
+    """).tag(config=True)
+
+    async_workers = Int(4, help="""
+        Number of export_async exports that may run at once in this process, in a thread pool shared by every
+        exporter with the same setting. Further exports wait for a free thread.
+    """).tag(config=True)
+
     def __init__(self, config=None, **kw):
         """
         Public constructor
@@ -63,7 +258,23 @@ class XLSExporter(Exporter):
 
         self.msxlsstylereg = None
         self.workbook = None
+        self.worksheet = None
         self.row = 0
+        self._image_cache = None
+        self._cell_cache = None
+        self._row_limit = self.max_sheet_rows
+        self._table_sheets = 0
+        self._column_widths = {}
+        self._images = {}
+        self.stats = ExportStats()
+        self.image_stats = self.stats.images
+        self._rows_done = 0
+        self._markdown = None
+        self._markdown_cache = None
+        self._cancel = None
+        self._async_lock = None
+        self._notebook_dir = ''
+        self._warned_no_pillow = False
 
     def _file_extension_default(self):
         """
@@ -84,45 +295,467 @@ class XLSExporter(Exporter):
         `**kw`
           Ignored
         """
-        nb_copy = copy.deepcopy(nb)
+        output = BytesIO()
+
+        resources = self.export_to_file(nb, output, resources, **kw)
+
+        xlsx_data = output.getvalue()
+
+        return xlsx_data, resources
+
+    def export_to_file(self, nb, output, resources=None, **kw):
+        """
+        Convert a notebook, writing the workbook straight to output instead of returning it as bytes.
+        Parameters
+        ----------
+        nb : :class:`~nbformat.NotebookNode`
+          Notebook node (dict-like with attr-access)
+        output : str or file-like object
+          Filename or binary file object (opened for writing) to receive the xlsx data
+        resources : dict
+          Additional resources that can be accessed read/write by
+          preprocessors and filters.
+        `**kw`
+          Ignored
+        :return: resources
+        """
+        if self.profile_file:
+            profiler = cProfile.Profile()
+            try:
+                return profiler.runcall(self._export_to_file, nb, output, resources)
+            finally:
+                profiler.dump_stats(self.profile_file)
+
+        return self._export_to_file(nb, output, resources)
+
+    async def export_async(self, nb, writer, resources=None, chunk_size=65536):
+        """
+        Convert a notebook without blocking the event loop, then stream the workbook to writer in chunks.
+
+        The export runs in a thread from a pool of async_workers threads. If the coroutine is cancelled, for
+        example because the client disconnected, the export stops at the start of the next cell and nothing is
+        written. Exports by one exporter run one at a time; use an exporter per request for more at once.
+        Parameters
+        ----------
+        nb : :class:`~nbformat.NotebookNode`
+          Notebook node (dict-like with attr-access)
+        writer : object with a write(bytes) method
+          Receives the xlsx data. write may return an awaitable, and if writer has a drain() coroutine method
+          (as asyncio.StreamWriter does) it is awaited after each chunk.
+        resources : dict
+          Additional resources that can be accessed read/write by
+          preprocessors and filters.
+        chunk_size : int
+          Bytes per write
+        :return: resources
+        """
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+
+        loop = asyncio.get_running_loop()
+        cancel = threading.Event()
+
+        # Small workbooks stay in memory; bigger ones go to a temporary file rather than being held whole
+        with tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024, dir=self.tmpdir or None) as output:
+
+            async with self._async_lock:
+                future = loop.run_in_executor(export_executor(max(1, self.async_workers)),
+                                              self._export_cancellable, nb, output, resources, cancel)
+                try:
+                    resources = await asyncio.shield(future)
+                except asyncio.CancelledError:
+                    # Stop the export, and wait for it so the exporter is free before anyone else uses it
+                    cancel.set()
+                    await asyncio.wait([future])
+                    if not future.cancelled():
+                        # Retrieve the ExportCancelled, which asyncio would otherwise log as never retrieved
+                        future.exception()
+                    raise
+
+            output.seek(0)
+            await write_chunks(output, writer, chunk_size)
+
+        return resources
+
+    def _export_cancellable(self, nb, output, resources, cancel):
+        self._cancel = cancel
+        try:
+            return self.export_to_file(nb, output, resources)
+        finally:
+            self._cancel = None
+
+    def _export_to_file(self, nb, output, resources):
+        export_start = perf_counter()
+
+        self.stats = ExportStats()
+        self.image_stats = self.stats.images
+
         resources = self._init_resources(resources)
 
         if 'language' in nb['metadata']:
             resources['language'] = nb['metadata']['language'].lower()
 
+        self._notebook_dir = resources.get('metadata', {}).get('path', '')
+
         # Preprocess
-        nb_copy, resources = super(XLSExporter, self).from_notebook_node(nb, resources, **kw)
+        nb, resources = self._preprocess(nb, resources)
 
-        output = BytesIO()
-        self.workbook = xlsxwriter.Workbook(output, {'nan_inf_to_errors': True})
+        cells_start = perf_counter()
+        self.stats.seconds['preprocess'] = cells_start - export_start
+
+        self.workbook = xlsxwriter.Workbook(output, self._workbook_options())
 
-        self.msxlsstylereg = MdXlsStyleRegistry(self.workbook)
+        self.msxlsstylereg = MdXlsStyleRegistry(self.workbook, FormatTable.for_formats(self.markdown_formats))
 
-        self.worksheet = self.workbook.add_worksheet()
+        self.worksheet = None
+        self._row_limit = self.max_sheet_rows
+        self._rows_done = 0
+        self._table_sheets = 0
+        self._column_widths = {}
+
+        self._images = {}
 
         self.row = 0
-        for cellno, cell in enumerate(nb_copy.cells):
-            self.worksheet.write(self.row, 0, str(cellno+1))
+        if self.render_workers > 1 and len(nb.cells) > 1:
+            self._write_cells_parallel(nb.cells)
+        else:
+            for cellno, cell in enumerate(nb.cells):
+                start = perf_counter()
 
-            # Convert depending on nbformat
-            # https://nbformat.readthedocs.io/en/latest/format_description.html#cell-types
+                self._start_cell(cellno, cell)
+                first_row = self._rows_done + self.row
 
-            if cell.cell_type == 'markdown':
-                self._write_markdown(cell.source)
+                if self.cell_cache_dir:
+                    cached = self._write_cell_cached(cell)
+                else:
+                    self._write_cell(cell)
+                    cached = False
 
-            elif cell.cell_type == 'code':
-                self._write_code(cell)
+                self.stats.add_cell(cellno, cell.cell_type, perf_counter() - start,
+                                    self._rows_done + self.row - first_row, cached)
 
-            else:
-                self._write_textplain('No convertible outputs available for cell: {}'.format(cell.source))
+                self.row += 1
 
-            self.row += 1
+        if self.worksheet is None:
+            self.worksheet = self.workbook.add_worksheet()
+
+        close_start = perf_counter()
+        self.stats.seconds['cells'] = close_start - cells_start
+
+        sheets = len(self.workbook.worksheets())
 
         self.workbook.close()
 
-        xlsx_data = output.getvalue()
+        self._images = {}
+        resources['nb2xls_images'] = {stat: self.image_stats[stat] for stat in ('images', 'unique_images', 'bytes_saved')}
 
-        return xlsx_data, resources
+        end = perf_counter()
+        self.stats.seconds['close'] = end - close_start
+        self.stats.seconds['total'] = end - export_start
+
+        stats = self.stats.as_dict()
+        stats['sheets'] = sheets
+        stats['formats'] = len(self.msxlsstylereg.keys)
+        resources['nb2xls_stats'] = stats
+
+        return resources
+
+    def _write_cell(self, cell):
+        # Convert depending on nbformat
+        # https://nbformat.readthedocs.io/en/latest/format_description.html#cell-types
+
+        if cell.cell_type == 'markdown':
+            self._write_markdown(cell.source)
+
+        elif cell.cell_type == 'code':
+            self._write_code(cell)
+
+        else:
+            self._write_textplain('No convertible outputs available for cell: {}'.format(cell.source))
+
+    def _start_cell(self, cellno, cell):
+        """
+        Move on to the worksheet the cell belongs on, following sheet_layout and max_sheet_rows,
+        and write the cell number.
+        """
+        if self._cancel is not None and self._cancel.is_set():
+            raise ExportCancelled('Export cancelled before cell {}'.format(cellno+1))
+
+        heading = top_heading(cell.source) if self.sheet_layout == 'heading' and cell.cell_type == 'markdown' \
+            else None
+
+        if self.sheet_layout == 'cell':
+            self._add_sheet('Cell {}'.format(cellno+1))
+        elif heading is not None:
+            self._add_sheet(heading)
+        elif self.worksheet is None:
+            self._add_sheet(None)
+        else:
+            self._check_row_limit()
+
+        self.worksheet.write(self.row, 0, str(cellno+1))
+
+    def _add_sheet(self, name):
+        """
+        Carry on writing at the top of a new worksheet.
+        :param name: str to name it after, or None for xlsxwriter's default name (Sheet1 etc.)
+        """
+        self.worksheet = self.workbook.add_worksheet(unique_sheet_name(name, self.workbook) if name else None)
+        self.row = 0
+
+    def _new_sheet(self, kind, worksheet):
+        """
+        Add a worksheet that a cell needs: 'rollover' to continue worksheet once it is full, or 'table' for a
+        table of more than table_sheet_rows rows.
+        :return: the new Worksheet
+        """
+        if kind == 'rollover':
+            name = worksheet.name
+        else:
+            self._table_sheets += 1
+            name = 'Table {}'.format(self._table_sheets)
+        return self.workbook.add_worksheet(unique_sheet_name(name, self.workbook))
+
+    def _check_row_limit(self):
+        if self.row >= self._row_limit:
+            # Carry on in a new worksheet before xlsxwriter starts ignoring writes
+            self.worksheet = self._new_sheet('rollover', self.worksheet)
+            self._rows_done += self.row
+            self.row = 0
+
+    def _open_table_sheet(self):
+        """
+        Switch to a new worksheet for a large table, starting at its top row.
+        :return: internal: hyperlink to the new worksheet, for the cell linking to it
+        """
+        if isinstance(self.worksheet, WorksheetRecorder):
+            self.worksheet, link = self.worksheet.open_sheet('table')
+        else:
+            self.worksheet = self._new_sheet('table', self.worksheet)
+            link = "internal:'{}'!A1".format(self.worksheet.name)
+        self.row = 0
+        return link
+
+    def _write_cell_cached(self, cell):
+        """
+        Write a cell by replaying the writes recorded in cell_cache_dir when it was last written with the same
+        settings, or else record the writes for next time and replay them.
+        :return: whether the cell was found in the cache
+        """
+        cell_cache = self._get_cell_cache()
+
+        key = self._cell_key(cell_cache, cell, self._cell_settings())
+        cached = cell_cache.get_cell(key)
+
+        if cached is not None:
+            rows, recording, image_stats = cached
+            self._add_image_stats(image_stats)
+        else:
+            rows, recording, stats = self._record_cell(cell)
+            self.stats.add(stats)
+            cell_cache.put_cell(key, rows, recording, stats.images)
+
+        self._replay_cell(rows, recording)
+
+        return cached is not None
+
+    def _add_image_stats(self, image_stats):
+        """
+        Add in the image counts of a cell replayed from cell_cache_dir, as they were when it was written
+        """
+        for stat, n in image_stats.items():
+            self.image_stats[stat] += n
+
+    def _replay_cell(self, rows, recording):
+        self.worksheet, self.row = replay(self.worksheet, self.msxlsstylereg, recording, self.row,
+                                          self._new_sheet, self._row_limit, self._widen_column)
+        self.row += rows
+
+    def _cell_key(self, cell_cache, cell, settings):
+        """
+        Cache key for a cell, which also depends on the sidecar files it exports, if any
+        """
+        if self.table_sidecars:
+            sidecars = []
+            for o in cell.get('outputs', []):
+                filename = sidecar_filename(o, self._notebook_dir)
+                if filename is not None and os.path.exists(filename):
+                    stat = os.stat(filename)
+                    sidecars.append((os.path.abspath(filename), stat.st_size, stat.st_mtime_ns))
+            if sidecars:
+                settings = dict(settings, sidecars=sidecars)
+        return cell_cache.cell_key(cell, settings)
+
+    def _get_cell_cache(self):
+        if self._cell_cache is None or self._cell_cache.directory != self.cell_cache_dir:
+            self._cell_cache = CellCache(self.cell_cache_dir)
+        return self._cell_cache
+
+    def _write_cells_parallel(self, cells):
+        """
+        Render the cells in a pool of render_workers workers, and replay the recordings into the worksheet in
+        cell order as they arrive. Cells found in cell_cache_dir are replayed without being sent to a worker.
+        """
+        settings = self._cell_settings()
+        cell_cache = self._get_cell_cache() if self.cell_cache_dir else None
+        keys = [self._cell_key(cell_cache, cell, settings) if cell_cache else None for cell in cells]
+        cached = [cell_cache.get_cell(key) if cell_cache else None for key in keys]
+
+        to_render = [cell for cell, recording in zip(cells, cached) if recording is None]
+        workers = min(self.render_workers, len(to_render)) or 1
+
+        # Worker exporters need only the settings that affect what is written for a cell, and where to cache
+        worker_settings = {name: getattr(self, name) for name in self.cell_settings}
+        for name in ('markdown_cache_size', 'image_cache_dir', 'tmpdir'):
+            worker_settings[name] = getattr(self, name)
+
+        with render_executor(self.render_pool, workers, worker_settings) as executor:
+            # Only a few cells per worker are queued at a time, so a cancelled export waits just for those
+            pending = iter(to_render)
+            rendering = deque()
+
+            def submit(count):
+                for next_cell in islice(pending, count):
+                    rendering.append(executor.submit(render_cell, next_cell, self._notebook_dir))
+
+            submit(workers*4)
+            try:
+                for cellno, cell in enumerate(cells):
+                    start = perf_counter()
+                    render_seconds = 0.0
+
+                    self._start_cell(cellno, cell)
+
+                    if cached[cellno] is not None:
+                        rows, recording, image_stats = cached[cellno]
+                        self._add_image_stats(image_stats)
+                    else:
+                        rows, recording, stats = rendering.popleft().result()
+                        submit(1)
+                        # Count the time the worker took, rather than the time spent waiting for it
+                        start = perf_counter()
+                        render_seconds = stats.seconds['render']
+                        self.stats.add(stats)
+                        if cell_cache is not None:
+                            cell_cache.put_cell(keys[cellno], rows, recording, stats.images)
+
+                    self._replay_cell(rows, recording)
+
+                    self.stats.add_cell(cellno, cell.cell_type, render_seconds + perf_counter() - start, rows,
+                                        cached[cellno] is not None)
+
+                    self.row += 1
+            except BaseException:
+                for future in rendering:
+                    future.cancel()
+                raise
+
+    def _record_cell(self, cell):
+        """
+        Write a cell into a recording only, starting at row 0, as a render worker does.
+        :return: (number of rows taken up, recording, ExportStats for the cell), see cellcache.replay
+        """
+        start = perf_counter()
+
+        if self.msxlsstylereg is None:
+            self.msxlsstylereg = MdXlsStyleRegistry(DetachedFormats())
+
+        state = self.worksheet, self.row, self.stats, self.image_stats, self._row_limit
+
+        recorder = WorksheetRecorder(None, self.msxlsstylereg, 0)
+        self.worksheet = recorder
+        self.row = 0
+        self.stats = ExportStats()
+        self.image_stats = self.stats.images
+        # Rows are relative to the cell here, so rolling over is left to replay
+        self._row_limit = float('inf')
+
+        try:
+            self._write_cell(cell)
+            self.stats.seconds['render'] = perf_counter() - start
+            return self.row, (recorder.ops, recorder.sheets), self.stats
+        finally:
+            self.worksheet, self.row, self.stats, self.image_stats, self._row_limit = state
+
+    # Traits that change what is written for a cell, and so are part of its cell_cache_dir key.
+    # Formats are recorded by style name, so markdown_formats can change without invalidating the cache.
+    cell_settings = ('ignore_markdown_errors', 'merge_streams', 'text_head_lines', 'text_tail_lines',
+                     'html_parser', 'svg_rasterizer', 'table_sheet_rows', 'image_max_width', 'image_max_height',
+                     'image_dpi', 'image_jpeg_quality', 'image_palette_colors', 'table_types', 'excel_tables',
+                     'table_column_widths', 'merge_table_spans', 'table_sidecars')
+
+    def _cell_settings(self):
+        settings = {name: getattr(self, name) for name in self.cell_settings}
+        settings['nb2xls'] = __version__
+        return settings
+
+    def _preprocess(self, nb, resources):
+        """
+        Run the enabled preprocessors over the notebook.
+        Unlike the base Exporter, which deep copies the notebook and resources up front and then calls (and
+        validates after) every registered preprocessor, the notebook is copied at most once and only when a
+        preprocessor would change it. Disabled preprocessors are skipped altogether.
+        :param nb: notebook node
+        :param resources: resources dict from _init_resources
+        :return: (nb, resources) - nb is the original notebook if nothing needed to change
+        """
+        preprocessors = [p for p in self._preprocessors if self._preprocessor_changes(p, nb)]
+
+        if len(preprocessors) == 0:
+            return nb, resources
+
+        if self.copy_notebook:
+            nb = copy.deepcopy(nb)
+
+        optimistic_validation = getattr(self, 'optimistic_validation', True)
+
+        for preprocessor in preprocessors:
+            nb, resources = preprocessor(nb, resources)
+            if not optimistic_validation:
+                self._validate_preprocessor(nb, preprocessor)
+
+        if optimistic_validation and hasattr(self, '_validate_preprocessor'):
+            self._validate_preprocessor(nb, preprocessor)
+
+        return nb, resources
+
+    def _preprocessor_changes(self, preprocessor, nb):
+        """
+        Could running this preprocessor change the notebook?
+        coalesce_streams is always registered but only alters cells with consecutive stream outputs or
+        carriage returns in stream text, so check for those, unless merge_streams does its work while writing.
+        Other preprocessors count if they are enabled.
+        """
+        if preprocessor is coalesce_streams:
+            if self.merge_streams:
+                return False
+            for cell in nb.cells:
+                last = None
+                for o in cell.get('outputs', []):
+                    if o.output_type == 'stream':
+                        if '\r' in o.text:
+                            return True
+                        if last is not None and last.output_type == 'stream' and last.name == o.name:
+                            return True
+                    last = o
+            return False
+
+        return getattr(preprocessor, 'enabled', True)
+
+    def _workbook_options(self):
+        """
+        Options passed to the xlsxwriter Workbook constructor
+        """
+        options = {'nan_inf_to_errors': True}
+
+        if self.constant_memory:
+            # Everything is written row by row in order, so rows can be flushed as we go
+            options['constant_memory'] = True
+
+        if self.tmpdir:
+            options['tmpdir'] = self.tmpdir
+
+        return options
 
     def _write_code(self, cell):
         """
@@ -131,48 +764,124 @@ class XLSExporter(Exporter):
         :return:
         """
 
-        for i,o in enumerate(cell.outputs):
+        outputs = cell.outputs
+        if self.merge_streams:
+            outputs = merged_stream_outputs(outputs)
+
+        for i,o in enumerate(outputs):
+            start = perf_counter()
 
-            display_data = None
             if o.output_type in ('execute_result', 'display_data'):
-                if 'text/html' in o.data:
-                    self._write_texthtml(o.data['text/html'])
-                elif 'text/markdown' in o.data:
-                    self._write_markdown(o.data['text/markdown'])
-                elif 'image/png' in o.data:
+                sidecar = self._sidecar(o) if self.table_sidecars else None
+                mimetype = 'sidecar' if sidecar is not None else self._output_mimetype(o.data)
+
+                if mimetype == 'sidecar':
+                    self._write_table(rows_from_frame(load_sidecar(sidecar)), convert=False)
+                elif mimetype == 'application/vnd.dataresource+json':
+                    self._write_table(rows_from_dataresource(o.data[mimetype], self.table_types), convert=False)
+                elif mimetype == 'text/html':
+                    self._write_texthtml(o.data[mimetype])
+                elif mimetype == 'text/markdown':
+                    self._write_markdown(o.data[mimetype])
+                elif mimetype == 'application/json':
+                    self._write_textplain(repr(o.data[mimetype]))
+                elif mimetype == 'text/plain':
+                    self._write_textplain(o.data[mimetype], collapse=True)
+                elif mimetype is not None:
                     width, height = 0, 0
-                    if 'image/png' in o.metadata and set(o.metadata['image/png'].keys()) == {'width', 'height'} :
-                        width, height = o.metadata['image/png']['width'], o.metadata['image/png']['height']
-                    self._write_image(o.data['image/png'], width, height)
-                elif 'application/json' in o.data:
-                    self._write_textplain(repr(o.data['application/json']))
-                elif 'text/plain' in o.data:
-                    self._write_textplain(o.data['text/plain'])
+                    if mimetype in o.metadata and set(o.metadata[mimetype].keys()) == {'width', 'height'} :
+                        width, height = o.metadata[mimetype]['width'], o.metadata[mimetype]['height']
+                    if mimetype == 'image/svg+xml':
+                        self._write_svg(o.data[mimetype], width, height)
+                    else:
+                        self._write_image(o.data[mimetype], width, height, 'image.'+mimetype[6:])
+                    if self.release_image_data:
+                        del o.data[mimetype]
                 else:
                     self._write_textplain('No convertible mimetype available for source (output {}): {}'.format(i, cell.source))
 
             elif o.output_type == 'stream':
-                self._write_textplain(o.text)
+                mimetype = 'stream'
+                self._write_textplain(o.text, collapse=True)
 
-            if i < len(cell.outputs)-1:
+            else:
+                mimetype = o.output_type
+
+            self.stats.add_output(mimetype, perf_counter() - start)
+
+            if i < len(outputs)-1:
                 # Blank row between outputs, but not at the end
                 self.row += 1
 
     ###
     # Sub-handlers for code cells
 
-    def _write_textplain(self, text):
-        lines = text.split("\n")
+    def _sidecar(self, output):
+        """
+        :return: filename of the sidecar holding the full data of a table output, or None if it has none
+        """
+        filename = sidecar_filename(output, self._notebook_dir)
+        if filename is not None and not os.path.exists(filename):
+            self.log.warning('Sidecar file %s not found, so the table is exported as the notebook shows it', filename)
+            return None
+        return filename
+
+    def _write_textplain(self, text, collapse=False):
+        """
+        Write text one line per row, in a single pass over the lines.
+        :param text: str
+        :param collapse: apply the text_head_lines/text_tail_lines limits
+        """
+        if collapse and (self.text_head_lines > 0 or self.text_tail_lines > 0):
+            lines = collapse_lines(text, self.text_head_lines, self.text_tail_lines)
+        else:
+            lines = text.split("\n")
+
+        write = self.worksheet.write
+        write_string = self.worksheet.write_string
+        row = self.row
+        row_limit = self._row_limit
         for l in lines:
-            self.worksheet.write(self.row, 1, l)
-            self.row += 1
+            if row >= row_limit:
+                self.row = row
+                self._check_row_limit()
+                write = self.worksheet.write
+                write_string = self.worksheet.write_string
+                row = self.row
+            if l.startswith(WRITE_SPECIAL_PREFIXES):
+                # write() turns these into formulas or hyperlinks
+                write(row, 1, l)
+            elif l:
+                # Plain text, without write()'s type sniffing; empty lines are left blank as write() would
+                write_string(row, 1, l)
+            row += 1
+        self.row = row
 
     # HTML functions start here
 
     def _write_texthtml(self, html):
-        soup = BeautifulSoup(html, 'html.parser')
+        if is_dataframe_html(html):
+            # Fast path for pandas DataFrames: tokenize the table directly rather than building a soup
+            self._write_table(parse_dataframe_html(html))
+            return
+
+        if self.html_parser == 'streaming':
+            parser = HTMLStreamParser(self._write_htmltext, self._write_table)
+            parser.feed(html)
+            parser.close()
+            return
+
+        soup = BeautifulSoup(html, self.html_parser)
+        if self.html_parser == 'lxml' and soup.body is not None:
+            # lxml wraps everything in <html><body>
+            soup = soup.body
         self._write_soup(soup)
 
+    def _write_htmltext(self, s):
+        self._check_row_limit()
+        self.worksheet.write(self.row, 1, s)
+        self.row += 1
+
     def _write_soup(self, soup):
         s = ''
         for child in soup.children:
@@ -187,65 +896,296 @@ class XLSExporter(Exporter):
                     re.sub(r'\s+', ' ', s)
                     s = s.strip()
                     if len(s) > 0:
-                        self.worksheet.write(self.row, 1, s.strip())
-                        self.row += 1
+                        self._write_htmltext(s)
                         s = ''
 
                 if child.name in ('div', 'body', 'span', 'p'):
                     self._write_soup(child)
 
                 elif child.name == 'table':
-                    self._write_htmltable(soup)
-
-    def _write_htmltable(self, soup):
-        double_emphasis_fmt = self.msxlsstylereg.use_style(['double_emphasis'])
-        rowspans = defaultdict(int)
-        for tablerow in soup('tr'):
-            col = 1
-            for child in tablerow.children:
-                if isinstance(child, Tag):
-                    if child.name == 'th' or child.name == 'td':
-                        while rowspans[col] > 1:
-                            rowspans[col] -= 1
-                            col += 1
-
-                        s = child.get_text()
-
-                        fmt = double_emphasis_fmt if child.name == 'th' else None
-
-                        try:
-                            f = float(s)
-                            if isnan(f):
-                                self.worksheet.write_formula(self.row, col, '=NA()', fmt)
-                            else:
-                                self.worksheet.write_number(self.row, col, f, fmt)
-                        except ValueError:
-                            self.worksheet.write(self.row, col, s, fmt)
-
-                        if 'rowspan' in child.attrs and child.attrs['rowspan'].isdigit():
-                            rowspans[col] = int(child.attrs['rowspan'])
-
-                        if 'colspan' in child.attrs and child.attrs['colspan'].isdigit():
-                            col += int(child.attrs['colspan'])-1
-
-                        col += 1
+                    self._write_htmltable(child)
+
+    def _write_htmltable(self, table):
+        self._write_table(rows_from_soup(table))
+
+    def _write_table(self, rows, convert=True):
+        """
+        Write table rows below the current row, starting in column 1.
+        Cell values are converted a whole column at a time and then written a row at a time with write_row,
+        one call per run of adjacent cells sharing a format (header cells are bold).
+        Tables of more than table_sheet_rows rows go on a worksheet of their own, with a hyperlink to it here.
+        :param rows: list of rows, each a list of TableCell
+        :param convert: whether values are text to be converted to numbers where possible
+        """
+        if 0 < self.table_sheet_rows < len(rows):
+            worksheet, row = self.worksheet, self.row
+            link = self._open_table_sheet()
+            self._write_table_rows(rows, convert)
+            self.worksheet, self.row = worksheet, row
+
+            self._check_row_limit()
+            self.worksheet.write_url(self.row, 1, link, None, 'Table of {} rows'.format(len(rows)))
+            self.row += 1
+            return
+
+        self._write_table_rows(rows, convert)
+
+    def _write_table_rows(self, rows, convert):
+        double_emphasis_fmt = self.msxlsstylereg.use_style(('double_emphasis',))
+
+        placed_rows = list(place_cells(rows))
+
+        columns = defaultdict(list)
+        for placed in placed_rows:
+            for col, cell in placed:
+                columns[col].append(cell.value)
+
+        values = {}
+        num_formats = {}
+        if convert and self.table_types:
+            # Headings only take part in a column's type in rows that also hold data, as a DataFrame's index does
+            data_rows = [any(not cell.header for col, cell in placed) for placed in placed_rows]
+            data = defaultdict(list)
+            for placed, is_data in zip(placed_rows, data_rows):
+                for col, cell in placed:
+                    data[col].append(is_data)
+            for col, column in columns.items():
+                converted, num_formats[col] = infer_column(column, data[col])
+                values[col] = iter(converted)
+        elif convert:
+            for col, column in columns.items():
+                values[col] = iter(convert_column(column))
+        else:
+            for col, column in columns.items():
+                converted, num_formats[col] = typed_column(column)
+                values[col] = iter(converted)
+
+        styles = {}
+        for col, num_format in num_formats.items():
+            if num_format is not None:
+                styles[col] = (self.msxlsstylereg.number_style(num_format, ('double_emphasis',)),
+                               self.msxlsstylereg.number_style(num_format))
+
+        first_row, worksheet = self.row, self.worksheet
+
+        # Where each row was written, and the cells spanning more than one row or column
+        positions = []
+        spanning = []
+
+        for r, placed in enumerate(placed_rows):
+            self._check_row_limit()
+            positions.append((self.worksheet, self.row))
+            run, run_col, run_fmt = [], None, None
+            for col, cell in placed:
+                if col in styles:
+                    fmt = styles[col][0] if cell.header else styles[col][1]
+                else:
+                    fmt = double_emphasis_fmt if cell.header else None
+                if run and (col != run_col + len(run) or fmt is not run_fmt):
+                    self.worksheet.write_row(self.row, 1+run_col, run, run_fmt)
+                    run = []
+                if not run:
+                    run_col, run_fmt = col, fmt
+                value = next(values[col])
+                run.append(value)
+                if cell.rowspan > 1 or cell.colspan > 1:
+                    spanning.append((r, col, cell, value, fmt))
+            if run:
+                self.worksheet.write_row(self.row, 1+run_col, run, run_fmt)
             self.row += 1
 
-    # Image handler
+        if self.merge_table_spans:
+            for r, col, cell, value, fmt in spanning:
+                worksheet_from, row_from = positions[r]
+                worksheet_to, row_to = positions[min(r + cell.rowspan, len(positions)) - 1]
+                # Spans that went over onto a new worksheet are left unmerged
+                if worksheet_to is worksheet_from and (row_to > row_from or cell.colspan > 1):
+                    worksheet_from.merge_range(row_from, 1+col, row_to, col+cell.colspan, value, fmt)
+
+        if self.excel_tables and not self.constant_memory and self.worksheet is worksheet:
+            headers = excel_table_headers(rows)
+            if headers is not None:
+                self.worksheet.add_table(first_row, 1, self.row-1, len(headers), {
+                    'columns': [{'header': header, 'header_format': double_emphasis_fmt} for header in headers],
+                    'autofilter': True,
+                })
+
+        if self.table_column_widths:
+            for col, column in columns.items():
+                width = column_width(column)
+                if width is not None:
+                    if isinstance(self.worksheet, WorksheetRecorder):
+                        self.worksheet.set_column(1+col, 1+col, width)
+                    else:
+                        self._widen_column(self.worksheet, 1+col, 1+col, width)
+
+    def _widen_column(self, worksheet, first_col, last_col, width):
+        """
+        Set the width of worksheet columns, unless this export has already made them wider.
+        """
+        widths = self._column_widths.setdefault(worksheet.name, {})
+        if width > widths.get(first_col, 0):
+            widths[first_col] = width
+            worksheet.set_column(first_col, last_col, width)
+
+    # Image handlers
+
+    def _output_mimetype(self, data):
+        """
+        Pick which of an output's mimetypes to write, in order of preference.
+        :return: mimetype, or None if there is none we can write
+        """
+        if 'application/vnd.dataresource+json' in data:
+            return 'application/vnd.dataresource+json'
+        if 'text/html' in data:
+            return 'text/html'
+        if 'text/markdown' in data:
+            return 'text/markdown'
+        image_mimetype = self._image_mimetype(data)
+        if image_mimetype is not None:
+            return image_mimetype
+        if 'application/json' in data:
+            return 'application/json'
+        if 'text/plain' in data:
+            return 'text/plain'
+        return None
+
+    def _image_mimetype(self, data):
+        """
+        Pick the image mimetype to export from an output's data, preferring formats that can be embedded as they are.
+        :return: mimetype, or None if there is no image we can export
+        """
+        if 'image/png' in data:
+            return 'image/png'
+        if 'image/jpeg' in data:
+            return 'image/jpeg'
+        if 'image/gif' in data and xlsxwriter_gif:
+            return 'image/gif'
+        if 'image/svg+xml' in data and self.svg_rasterizer:
+            return 'image/svg+xml'
+        return None
+
+    def _write_svg(self, svg, want_width, want_height):
+        """
+        Rasterize SVG to PNG with the svg_rasterizer backend and embed that
+        """
+        if isinstance(svg, list):
+            svg = ''.join(svg)
+
+        key = ('image/svg+xml', hashlib.sha1(svg.encode('utf-8')).digest())
+        self._insert_image(key, lambda: (self._rasterize_svg(svg), None), want_width, want_height, 'image.png')
+
+    def _rasterize_svg(self, svg):
+        """
+        Run the svg_rasterizer backend, going through the on-disk cache if image_cache_dir is set
+        :param svg: SVG document as str
+        :return: PNG image as bytes
+        """
+        svg = svg.encode('utf-8')
+        return self._cached_image(self.svg_rasterizer, svg, lambda: import_item(self.svg_rasterizer)(svg))
+
+    def _cached_image(self, method, source, render):
+        """
+        :param method: str describing how the image is rendered, part of the cache key along with source
+        :param source: bytes the image is rendered from
+        :param render: function returning the image as bytes, called if it isn't in image_cache_dir
+        :return: image as bytes
+        """
+        if not self.image_cache_dir:
+            return render()
+
+        if self._image_cache is None or self._image_cache.directory != self.image_cache_dir:
+            self._image_cache = ImageCache(self.image_cache_dir)
 
-    def _write_image(self, image, want_width, want_height):
+        key = ImageCache.key(method, source)
+        image = self._image_cache.get(key)
+        if image is None:
+            image = render()
+            self._image_cache.put(key, image)
 
-        image = base64.b64decode(image)
+        return image
 
-        image_data = BytesIO(image)
+    def _write_image(self, image, want_width, want_height, filename='image.png'):
+        """
+        Embed a base64 encoded PNG, JPEG or GIF image as it is, without re-encoding, unless resampling is enabled.
+        Repeats of an image are found by a digest of its base64 str before anything is decoded, so each distinct
+        image is decoded once, and neither the str nor a second copy of the image is kept for the rest of the export.
+        """
+        key = ('image', base64_digest(image))
 
-        if usecv2:
-            nparr = np.frombuffer(image, np.uint8)
-            img = cv2.imdecode(nparr, cv2.IMREAD_ANYCOLOR)
-            height, width = img.shape[:2]
+        if self._resampling():
+            key += (want_width, want_height)
+
+            def render():
+                image_bytes = decode_base64(image)
+                # The image is shown at the same size whatever happens to its pixels
+                width, height = image_size(image_bytes)
+                return self._resample_image(image_bytes, want_width or width, want_height or height), (width, height)
+        else:
+            render = lambda: (decode_base64(image), None)
+
+        self._insert_image(key, render, want_width, want_height, filename)
+
+    def _resampling(self):
+        if not (self.image_max_width or self.image_max_height or self.image_dpi or
+                self.image_jpeg_quality or self.image_palette_colors):
+            return False
+        if Image is None:
+            if not self._warned_no_pillow:
+                self.log.warning('Pillow is not installed, so images are embedded as they are, ignoring the image_* '
+                                 'resampling and recompression options')
+                self._warned_no_pillow = True
+            return False
+        return True
+
+    def _resample_image(self, image_bytes, want_width, want_height):
+        """
+        Resample and recompress an image following the image_* options, going through the on-disk cache if
+        image_cache_dir is set
+        :param want_width: width the image is shown at, in pixels
+        :param want_height: height the image is shown at, in pixels
+        :return: image as bytes
+        """
+        if self.image_dpi:
+            width, height = ceil(want_width * self.image_dpi / 96), ceil(want_height * self.image_dpi / 96)
         else:
-            img = png.Reader(image_data)
-            (width, height, _, _) = img.asDirect()
+            width, height = image_size(image_bytes)
+        if self.image_max_width:
+            width = min(width, self.image_max_width)
+        if self.image_max_height:
+            height = min(height, self.image_max_height)
+
+        settings = 'resample {} {} {} {}'.format(width, height, self.image_jpeg_quality, self.image_palette_colors)
+        return self._cached_image(settings, image_bytes,
+                                  lambda: resample_image(image_bytes, width, height, self.image_jpeg_quality,
+                                                         self.image_palette_colors))
+
+    def _insert_image(self, key, render, want_width, want_height, filename):
+        """
+        Insert an image below the current row.
+        Identical images are only rendered and probed once per export, and all share one BytesIO so xlsxwriter
+        stores them as a single xl/media part. BytesIO shares the image bytes rather than copying them.
+        :param key: hashable digest of what the image comes from, used as the deduplication key
+        :param render: function returning (image bytes, (width, height) in pixels to show it at if not given by
+          want_width and want_height, or None for its own size), called only for the first image with this key
+        """
+        image = self._images.get(key)
+
+        if image is None:
+            image_bytes, shown_size = render()
+            # Only the header is read, the pixels are never decoded
+            width, height = image_size(image_bytes)
+            image = self._images[key] = (BytesIO(image_bytes), width, height, len(image_bytes),
+                                         shown_size or (width, height))
+            self.image_stats['unique_images'] += 1
+            self.image_stats['bytes'] += len(image_bytes)
+        else:
+            self.image_stats['bytes_saved'] += image[3]
+
+        self.image_stats['images'] += 1
+
+        image_data, width, height, _, (shown_width, shown_height) = image
+        want_width, want_height = want_width or shown_width, want_height or shown_height
 
         x_scale, y_scale = 1.0, 1.0
 
@@ -256,8 +1196,9 @@ class XLSExporter(Exporter):
             x_scale = want_width / width
 
         self.row += 1
+        self._check_row_limit()
 
-        self.worksheet.insert_image(self.row, 1, 'image.png',
+        self.worksheet.insert_image(self.row, 1, filename,
                                     {'image_data': image_data, 'x_scale': x_scale, 'y_scale': y_scale})
 
         self.row += ceil(height*y_scale / 15) # 15 is default row height in Excel
@@ -274,102 +1215,59 @@ class XLSExporter(Exporter):
         else:
             self._write_markdown_core(md)
 
-    def _write_markdown_core(self, md):
-        markdown = mistune.Markdown(renderer=Md2XLSRenderer())
-        lines = markdown(md)
-
-        def flatten(l):
-            """
-            Nested lists cause problems due to the way the MD parser works.
-            :param l: arbitrary-depth nested list of strs and MdStyleInstruction objects
-            :return: single-depth flattened version of the array containing only the leaves
-            """
-            for el in l:
-                if isinstance(el, Iterable) and not isinstance(el, str):
-                    for sub in flatten(el):
-                        yield sub
-                else:
-                    yield el
+    @observe('markdown_cache_size')
+    def _markdown_cache_size_changed(self, change):
+        self._markdown_cache = None
 
-        list_counters = []
-        list_ordered = []
-
-        all_o = []
-
-        for l in lines:
-            in_softnewline = False
-            is_indented = 0
-            link_url = ''
-            already_outputted_text = False
-            cell_format_mdname = ''
-            o = []
-            mdtextstylenames = []
-            for i,s in enumerate(flatten(l)):
-                if isinstance(s, MdStyleInstructionText):
-                    mdtextstylenames += [s.mdname]
-
-                elif isinstance(s, MdStyleInstructionCell):
-                    cell_format_mdname = s.mdname
-
-                elif isinstance(s, MdStyleInstructionLink):
-                    if already_outputted_text:
-                        all_o.append([o, cell_format_mdname, link_url, is_indented])
-                        o = []
-                        already_outputted_text = False
-                    in_softnewline = True
-                    link_url = s.link
-
-                elif isinstance(s, MdStyleInstructionListStart):
-                    if already_outputted_text:
-                        all_o.append([o, cell_format_mdname, link_url, is_indented])
-                        o = []
-                        already_outputted_text = False
-
-                    is_indented += 1
-                    list_counters.append(1)
-                    list_ordered.append(s.ordered)
-
-                elif isinstance(s, MdStyleInstructionListEnd):
-
-                    if already_outputted_text:
-                        all_o.append([o, cell_format_mdname, link_url, is_indented])
-                        o = []
-                        already_outputted_text = False
+    def _parse_markdown(self, md):
+        """
+        Parse markdown text, going through the LRU cache of recently parsed texts.
+        :return: flat tuple of strs and MdStyleInstruction objects, with a MdStyleInstructionBlockEnd after each
+          block (see flatten_blocks)
+        """
+        if self._markdown_cache is None:
+            self._markdown_cache = lru_cache(maxsize=self.markdown_cache_size)(self._parse_markdown_uncached)
+        return self._markdown_cache(md)
 
-                    is_indented -= 1
+    def _parse_markdown_uncached(self, md):
+        if self._markdown is None:
+            # Built once and reused: constructing the lexers is much of the cost of a short parse
+            self._markdown = mistune.Markdown(renderer=Md2XLSRenderer())
 
-                    list_counters.pop()
-                    list_ordered.pop()
+        try:
+            lines = self._markdown(md)
+        except Exception:
+            # mistune only resets its state at the end of a successful parse
+            self._markdown = None
+            raise
 
-                    in_softnewline = True
-                    link_url = ''
+        return tuple(flatten_blocks(lines))
 
-                elif isinstance(s, MdStyleInstructionListItem):
-                    if already_outputted_text:
-                        all_o.append([o, cell_format_mdname, link_url, is_indented])
-                        o = []
-                        already_outputted_text = False
-                    in_softnewline = True
-                    link_url = ''
+    def _write_markdown_core(self, md):
+        stream = self._parse_markdown(md)
 
-                    li_count = list_counters[-1]
-                    if list_ordered[-1]:
-                        o = ['{}. '.format(li_count)]
-                    list_counters[-1] += 1
+        list_counters = []
+        list_ordered = []
 
-                elif isinstance(s, MdStyleInstructionLineBreak):
-                    if already_outputted_text:
-                        all_o.append([o, cell_format_mdname, link_url, is_indented])
-                        o = []
-                        already_outputted_text = False
-                    in_softnewline = True
-                    link_url = ''
+        all_o = []
 
-                elif len(s) > 0:
-                    if len(mdtextstylenames) > 0 or (cell_format_mdname != '' and i >= 2):
-                        fmt = self.msxlsstylereg.use_style([cell_format_mdname] + mdtextstylenames)
+        # State for the current block, reset at each MdStyleInstructionBlockEnd
+        block_start = 0
+        in_softnewline = False
+        is_indented = 0
+        link_url = ''
+        already_outputted_text = False
+        cell_format_mdname = ''
+        o = []
+        mdtextstylenames = ()
+
+        for i,s in enumerate(stream):
+            if s.__class__ is str:
+                if len(s) > 0:
+                    if len(mdtextstylenames) > 0 or (cell_format_mdname != '' and i-block_start >= 2):
+                        fmt = self.msxlsstylereg.use_style((cell_format_mdname,) + mdtextstylenames)
                         o.append(fmt)
-                        mdtextstylenames = []
+                        mdtextstylenames = ()
 
                     o.append(s)
                     already_outputted_text = True
@@ -380,14 +1278,89 @@ class XLSExporter(Exporter):
                         already_outputted_text = False
                         in_softnewline = False
                         link_url = ''
-
-            if len(o) > 0:
-                all_o.append([o, cell_format_mdname, link_url, is_indented])
+                continue
+
+            kind = s.kind
+
+            if kind == KIND_TEXT:
+                mdtextstylenames += (s.mdname,)
+
+            elif kind == KIND_BLOCK_END:
+                if len(o) > 0:
+                    all_o.append([o, cell_format_mdname, link_url, is_indented])
+
+                block_start = i+1
+                in_softnewline = False
+                is_indented = 0
+                link_url = ''
+                already_outputted_text = False
+                cell_format_mdname = ''
+                o = []
+                mdtextstylenames = ()
+
+            elif kind == KIND_CELL:
+                cell_format_mdname = s.mdname
+
+            elif kind == KIND_LINK:
+                if already_outputted_text:
+                    all_o.append([o, cell_format_mdname, link_url, is_indented])
+                    o = []
+                    already_outputted_text = False
+                in_softnewline = True
+                link_url = s.link
+
+            elif kind == KIND_LIST_START:
+                if already_outputted_text:
+                    all_o.append([o, cell_format_mdname, link_url, is_indented])
+                    o = []
+                    already_outputted_text = False
+
+                is_indented += 1
+                list_counters.append(1)
+                list_ordered.append(s.ordered)
+
+            elif kind == KIND_LIST_END:
+
+                if already_outputted_text:
+                    all_o.append([o, cell_format_mdname, link_url, is_indented])
+                    o = []
+                    already_outputted_text = False
+
+                is_indented -= 1
+
+                list_counters.pop()
+                list_ordered.pop()
+
+                in_softnewline = True
+                link_url = ''
+
+            elif kind == KIND_LIST_ITEM:
+                if already_outputted_text:
+                    all_o.append([o, cell_format_mdname, link_url, is_indented])
+                    o = []
+                    already_outputted_text = False
+                in_softnewline = True
+                link_url = ''
+
+                li_count = list_counters[-1]
+                if list_ordered[-1]:
+                    o = ['{}. '.format(li_count)]
+                list_counters[-1] += 1
+
+            elif kind == KIND_LINE_BREAK:
+                if already_outputted_text:
+                    all_o.append([o, cell_format_mdname, link_url, is_indented])
+                    o = []
+                    already_outputted_text = False
+                in_softnewline = True
+                link_url = ''
 
         for o, cell_format_mdname, link_url, is_indented in all_o:
 
+            self._check_row_limit()
+
             if cell_format_mdname != '':
-                o.append(self.msxlsstylereg.use_style(cell_format_mdname))
+                o.append(self.msxlsstylereg.use_style((cell_format_mdname,)))
 
             if link_url != '':
                 if len(o) >= 2:
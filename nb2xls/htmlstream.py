@@ -0,0 +1,156 @@
+from html.parser import HTMLParser
+
+from .tables import TableCell, _span
+
+
+# Tags whose contents are written out; anything else (apart from tables) is skipped along with its text
+CONTAINER_TAGS = frozenset(('div', 'body', 'span', 'p'))
+
+# Elements that never have content or an end tag, as in BeautifulSoup's html.parser tree builder
+VOID_TAGS = frozenset(('area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem',
+                       'meta', 'param', 'source', 'track', 'wbr', 'basefont', 'bgsound', 'command', 'frame',
+                       'image', 'isindex', 'nextid', 'spacer'))
+
+
+class _Frame(object):
+    """
+    An open element. Containers collect their text; table frames point at the rows of the table they belong to.
+    """
+
+    __slots__ = ('tag', 'container', 'text', 'rows', 'depth', 'footer', 'section', 'row', 'cell')
+
+    def __init__(self, tag, container=False, rows=None, depth=0):
+        self.tag = tag
+        self.container = container
+        self.text = [] if container else None
+        self.rows = rows      # Rows of the outermost open table (or of its <tfoot>), if inside one
+        self.depth = depth    # Number of tables open inside that table, counting itself
+        self.footer = None    # For the outermost <table>: rows of its <tfoot>, written after the others
+        self.section = False  # Can this element hold rows of the outermost table?
+        self.row = None       # For a <tr> of the outermost table: its cells
+        self.cell = None      # For a <th>/<td> of such a row: (TableCell, text parts)
+
+
+class HTMLStreamParser(HTMLParser):
+    """
+    Event driven equivalent of XLSExporter._write_soup, which never builds a document tree.
+
+    Text directly inside div/body/span/p elements is written (stripped) each time another element starts, as the
+    soup walk does. Each table is collected as rows of TableCell and written when it ends, with the same rows as
+    tables.rows_from_soup: <tfoot> rows go last, and a table nested in a cell only contributes its text to that cell.
+    """
+
+    def __init__(self, write_text, write_table):
+        """
+        :param write_text: function called with each string to write
+        :param write_table: function called with the rows (lists of TableCell) of each table
+        """
+        super(HTMLStreamParser, self).__init__(convert_charrefs=True)
+        self.write_text = write_text
+        self.write_table = write_table
+        self.stack = [_Frame(None, container=True)]
+        self.open_cells = []
+
+    def handle_starttag(self, tag, attrs):
+        parent = self.stack[-1]
+
+        if parent.rows is not None:
+            frame = self._start_table_element(parent, tag, attrs)
+
+        elif parent.container:
+            self._flush(parent)
+            if tag in CONTAINER_TAGS:
+                frame = _Frame(tag, container=True)
+            elif tag == 'table':
+                frame = _Frame(tag, rows=[], depth=1)
+                frame.footer = []
+                frame.section = True
+            else:
+                frame = _Frame(tag)
+
+        else:
+            frame = _Frame(tag)
+
+        if tag in VOID_TAGS:
+            self._end(frame)
+        else:
+            self.stack.append(frame)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def _start_table_element(self, parent, tag, attrs):
+        depth = parent.depth + 1 if tag == 'table' else parent.depth
+        frame = _Frame(tag, rows=parent.rows, depth=depth)
+
+        if depth == 1:
+            if tag in ('thead', 'tbody', 'tfoot') and parent.tag == 'table':
+                frame.section = True
+                if tag == 'tfoot':
+                    frame.rows = parent.footer
+
+            elif tag == 'tr' and (parent.section or parent.row is not None):
+                # An unclosed <tr> is left open when the next one starts, so rows can also be nested in rows
+                frame.row = []
+                frame.section = False
+                parent.rows.append(frame.row)
+
+            elif tag in ('th', 'td') and parent.row is not None:
+                attrs = dict(attrs)
+                cell = TableCell(None, tag == 'th', _span(attrs, 'rowspan'), _span(attrs, 'colspan'))
+                parent.row.append(cell)
+                frame.cell = (cell, [])
+                self.open_cells.append(frame.cell)
+
+        return frame
+
+    def handle_endtag(self, tag):
+        for i in range(len(self.stack)-1, 0, -1):
+            if self.stack[i].tag == tag:
+                while len(self.stack) > i:
+                    self._end(self.stack.pop())
+                return
+        # End tags with no open element are ignored
+
+    def _end(self, frame):
+        if frame.cell is not None:
+            cell, parts = frame.cell
+            cell.value = ''.join(parts)
+            self.open_cells.remove(frame.cell)
+
+        elif frame.tag == 'table' and frame.depth == 1:
+            self.write_table(frame.rows + frame.footer)
+
+        # Text left over at the end of a container is not written, just as in the soup walk
+
+    def handle_data(self, data):
+        frame = self.stack[-1]
+        if frame.container:
+            frame.text.append(data)
+        else:
+            for cell, parts in self.open_cells:
+                parts.append(data)
+
+    def handle_comment(self, data):
+        # Comments are strings in the soup, so they count as container text too
+        frame = self.stack[-1]
+        if frame.container:
+            frame.text.append(data)
+
+    def handle_decl(self, decl):
+        frame = self.stack[-1]
+        if frame.container:
+            frame.text.append(decl[len('DOCTYPE '):] if decl.upper().startswith('DOCTYPE ') else decl)
+
+    def _flush(self, frame):
+        s = ''.join(frame.text).strip()
+        frame.text = []
+        if len(s) > 0:
+            self.write_text(s)
+
+    def close(self):
+        super(HTMLStreamParser, self).close()
+        while len(self.stack) > 1:
+            self._end(self.stack.pop())
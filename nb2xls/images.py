@@ -0,0 +1,186 @@
+import hashlib
+from binascii import a2b_base64
+from io import BytesIO
+from struct import unpack
+
+from .diskcache import DiskCache
+
+try:
+    import cairosvg # Only needed to rasterize SVG outputs, so not in requirements.txt
+except ImportError:
+    cairosvg = None
+
+try:
+    from PIL import Image # Only needed to resample images, so not in requirements.txt
+except ImportError:
+    Image = None
+
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# JPEG start-of-frame markers carry the image dimensions (C4, C8 and CC are not SOF markers)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def image_size(data):
+    """
+    Read the pixel dimensions of a PNG, JPEG or GIF image from its header alone, without decoding any pixels.
+    :param data: bytes (or memoryview) of the image file
+    :return: (width, height)
+    """
+    if data[:8] == PNG_SIGNATURE:
+        return _png_size(data)
+
+    if data[:2] == b'\xff\xd8':
+        return _jpeg_size(data)
+
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return _gif_size(data)
+
+    raise ValueError('Unknown or unsupported image format')
+
+
+def _png_size(data):
+    # IHDR must be the first chunk: 4 byte length, 'IHDR', then width and height as big-endian uint32
+    if data[12:16] != b'IHDR':
+        raise ValueError('PNG image has no IHDR chunk')
+    return unpack('>II', data[16:24])
+
+
+def _jpeg_size(data):
+    # Walk the marker segments, skipping each by its length, until we reach a start-of-frame segment
+    offset = 2
+    data_length = len(data)
+    while offset + 4 <= data_length:
+        if data[offset] != 0xFF:
+            raise ValueError('Corrupt JPEG image: expected a marker at offset {}'.format(offset))
+
+        marker = data[offset+1]
+
+        if marker == 0xFF:
+            # Fill byte before a marker
+            offset += 1
+            continue
+
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:
+            # Standalone markers have no length field
+            offset += 2
+            continue
+
+        (length,) = unpack('>H', data[offset+2:offset+4])
+
+        if marker in JPEG_SOF_MARKERS:
+            # Segment is length, sample precision (1 byte), then height and width
+            height, width = unpack('>HH', data[offset+5:offset+9])
+            return width, height
+
+        offset += 2 + length
+
+    raise ValueError('JPEG image has no start-of-frame segment')
+
+
+def _gif_size(data):
+    # Logical screen width and height as little-endian uint16 follow the 6 byte signature
+    return unpack('<HH', data[6:10])
+
+
+def decode_base64(data):
+    """
+    Decode a base64 encoded image from a notebook output in one pass, straight from the str, rather than first
+    copying it to bytes as base64.b64decode does. Line breaks are skipped.
+    :param data: base64 str (or bytes)
+    :return: image as bytes
+    """
+    return a2b_base64(data)
+
+
+def base64_digest(data, chunk_size=1 << 20):
+    """
+    Digest of a base64 encoded image, taken from the text a chunk at a time so the whole image is neither decoded
+    nor copied to bytes, to find repeats of an image before decoding it.
+    :param data: base64 str (or bytes)
+    :return: bytes
+    """
+    if isinstance(data, bytes):
+        return hashlib.sha1(data).digest()
+    digest = hashlib.sha1()
+    for start in range(0, len(data), chunk_size):
+        digest.update(data[start:start+chunk_size].encode('ascii'))
+    return digest.digest()
+
+
+def cairosvg_rasterize(svg):
+    """
+    Default SVG rasterization backend for XLSExporter.svg_rasterizer, using CairoSVG.
+    :param svg: SVG document as bytes
+    :return: PNG image as bytes
+    """
+    return cairosvg.svg2png(bytestring=svg)
+
+
+# Images with more distinct colors than this are treated as photos by resample_image
+PHOTO_COLORS = 4096
+
+
+def resample_image(data, width, height, jpeg_quality=0, palette_colors=0):
+    """
+    Shrink a PNG or JPEG image to fit within width x height pixels, keeping its aspect ratio, and recompress it.
+    Images are never enlarged, and GIFs (which may be animated) are left alone.
+    :param data: image as bytes
+    :param width: maximum width in pixels
+    :param height: maximum height in pixels
+    :param jpeg_quality: if not 0, also try opaque PNGs of more than PHOTO_COLORS colors (photos rather than plots)
+      as JPEGs of this quality (1-95); resized JPEGs are saved at this quality, or 90
+    :param palette_colors: if not 0, also try PNGs of up to PHOTO_COLORS colors reduced to a palette of at most
+      this many colors
+    :return: image as bytes: the smallest version tried, which is the original data if it was neither resized
+      nor made smaller
+    """
+    image = Image.open(BytesIO(data))
+    source_format = image.format
+    if source_format not in ('PNG', 'JPEG'):
+        return data
+
+    scale = min(1.0, width / image.width, height / image.height)
+    resized = scale < 1.0
+    if source_format == 'JPEG' and not resized:
+        # Saving it again would only lose quality
+        return data
+    if resized:
+        if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            image = image.convert('RGBA' if 'transparency' in image.info or image.mode.endswith('A') else 'RGB')
+        image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                             Image.LANCZOS)
+
+    if source_format == 'JPEG':
+        candidates = [_save(image.convert('RGB') if image.mode not in ('RGB', 'L') else image, 'JPEG',
+                            quality=jpeg_quality or 90)]
+    else:
+        candidates = [_save(image, 'PNG', optimize=True)]
+
+        # Plots have few colors, even antialiased; only photo-like images are worth JPEG's artifacts,
+        # and are the ones a palette would spoil
+        opaque = image.mode in ('RGB', 'L') and 'transparency' not in image.info
+        photo = image.getcolors(PHOTO_COLORS) is None
+
+        if jpeg_quality and opaque and photo:
+            candidates.append(_save(image, 'JPEG', quality=jpeg_quality))
+
+        if palette_colors and not photo and image.mode in ('RGB', 'RGBA'):
+            method = Image.FASTOCTREE if image.mode == 'RGBA' else Image.MEDIANCUT
+            candidates.append(_save(image.quantize(min(256, palette_colors), method=method), 'PNG', optimize=True))
+
+    smallest = min(candidates, key=len)
+    return smallest if resized or len(smallest) < len(data) else data
+
+
+def _save(image, format, **params):
+    f = BytesIO()
+    image.save(f, format, **params)
+    return f.getvalue()
+
+
+class ImageCache(DiskCache):
+    """
+    On-disk cache of rendered images, keyed by a hash of whatever they were rendered from.
+    """
@@ -3,8 +3,17 @@ import re
 from mistune import Renderer, escape, escape_link
 
 
+# Type tags for MdStyleInstruction.kind, so the markdown writer can dispatch on one attribute
+# instead of a chain of isinstance checks
+KIND_CELL, KIND_TEXT, KIND_LINK, KIND_LIST_START, KIND_LIST_END, KIND_LIST_ITEM, KIND_LINE_BREAK, KIND_BLOCK_END \
+    = range(8)
+
+
 class MdStyleInstruction(object):
 
+    __slots__ = ('mdname',)
+
+    kind = None
     softnewline = False
 
     def __init__(self, mdname):
@@ -16,15 +25,24 @@ class MdStyleInstruction(object):
 
 
 class MdStyleInstructionCell(MdStyleInstruction):
-    pass
+
+    __slots__ = ()
+
+    kind = KIND_CELL
 
 
 class MdStyleInstructionText(MdStyleInstruction):
-    pass
+
+    __slots__ = ()
+
+    kind = KIND_TEXT
 
 
 class MdStyleInstructionLink(MdStyleInstruction):
 
+    __slots__ = ('link',)
+
+    kind = KIND_LINK
     softnewline = True
 
     def __init__(self, link):
@@ -34,16 +52,21 @@ class MdStyleInstructionLink(MdStyleInstruction):
 
 class MdStyleInstructionListStart(MdStyleInstruction):
 
+    __slots__ = ('ordered',)
+
+    kind = KIND_LIST_START
     softnewline = True
-    ordered = True
 
-    def __init__(self, ordered):
+    def __init__(self, ordered=True):
         super(MdStyleInstructionListStart, self).__init__('link')
         self.ordered = ordered
 
 
 class MdStyleInstructionListEnd(MdStyleInstruction):
 
+    __slots__ = ()
+
+    kind = KIND_LIST_END
     softnewline = False
 
     def __init__(self):
@@ -52,6 +75,9 @@ class MdStyleInstructionListEnd(MdStyleInstruction):
 
 class MdStyleInstructionListItem(MdStyleInstruction):
 
+    __slots__ = ()
+
+    kind = KIND_LIST_ITEM
     softnewline = True
 
     def __init__(self):
@@ -60,14 +86,75 @@ class MdStyleInstructionListItem(MdStyleInstruction):
 
 class MdStyleInstructionLineBreak(MdStyleInstruction):
 
+    __slots__ = ()
+
+    kind = KIND_LINE_BREAK
     softnewline = True
 
     def __init__(self):
         super(MdStyleInstructionLineBreak, self).__init__('linebreak')
 
 
+class MdStyleInstructionBlockEnd(MdStyleInstruction):
+
+    __slots__ = ()
+
+    kind = KIND_BLOCK_END
+
+    def __init__(self):
+        super(MdStyleInstructionBlockEnd, self).__init__('block_end')
+
+
+# Instructions that carry no state of their own are shared rather than allocated for every use,
+# as are those for the fixed set of cell and text styles
+LIST_END = MdStyleInstructionListEnd()
+LIST_ITEM = MdStyleInstructionListItem()
+LINE_BREAK = MdStyleInstructionLineBreak()
+BLOCK_END = MdStyleInstructionBlockEnd()
+ORDERED_LIST_START = MdStyleInstructionListStart(True)
+UNORDERED_LIST_START = MdStyleInstructionListStart(False)
+HEADER_CELLS = {level: MdStyleInstructionCell('h{}'.format(level)) for level in range(1, 7)}
+HRULE_CELL = MdStyleInstructionCell('hrule')
+DOUBLE_EMPHASIS = MdStyleInstructionText('double_emphasis')
+EMPHASIS = MdStyleInstructionText('emphasis')
+CODESPAN = MdStyleInstructionText('codespan')
+STRIKETHROUGH = MdStyleInstructionText('strikethrough')
+
+
+def flatten_blocks(blocks):
+    """
+    Flatten the renderer's nested output into one flat instruction stream, in a single linear pass.
+    Renderer methods wrap their content in a new list rather than copying it, so content can be nested deeply;
+    an explicit stack of iterators is used instead of recursion.
+    :param blocks: list of top-level blocks, each an arbitrary-depth nested list of strs and MdStyleInstruction objects
+      (or a single str or MdStyleInstruction)
+    :return: list of the leaves in order, with a MdStyleInstructionBlockEnd after each top-level block
+    """
+    stream = []
+    append = stream.append
+    for block in blocks:
+        if isinstance(block, list):
+            stack = [iter(block)]
+            while stack:
+                for el in stack[-1]:
+                    if isinstance(el, list):
+                        stack.append(iter(el))
+                        break
+                    append(el)
+                else:
+                    stack.pop()
+        else:
+            append(block)
+        append(BLOCK_END)
+
+    return stream
+
+
 class Md2XLSRenderer(Renderer):
 
+    # Span and block functions wrap their content in a new list instead of concatenating onto it (which copies
+    # the content at every level of nesting); flatten_blocks turns the result into a flat instruction stream.
+
     def placeholder(self):
         """Returns the default, empty output value for the renderer.
         All renderer methods use the '+=' operator to append to this value.
@@ -113,23 +200,26 @@ class Md2XLSRenderer(Renderer):
         :param level: a number for the header level, for example: 1.
         :param raw: raw text content of the header.
         """
-        return [[MdStyleInstructionCell('h{}'.format(level))] + text]
+        cell = HEADER_CELLS.get(level)
+        if cell is None:
+            cell = MdStyleInstructionCell('h{}'.format(level))
+        return [[cell, text]]
 
     def hrule(self):
         """Rendering method for ``<hr>`` tag."""
-        return [MdStyleInstructionCell('hrule')]
+        return [HRULE_CELL]
 
     def list(self, body, ordered=True):
         """Rendering list tags like ``<ul>`` and ``<ol>``.
         :param body: body contents of the list.
         :param ordered: whether this list is ordered or not.
         """
-        return [[MdStyleInstructionListStart(ordered)]] + body + [[MdStyleInstructionListEnd()]]
+        return [[ORDERED_LIST_START if ordered else UNORDERED_LIST_START]] + body + [[LIST_END]]
 
     def list_item(self, text):
         """Rendering list item snippet. Like ``<li>``."""
         #return [[MdStyleInstructionList(), *text]]
-        return [[MdStyleInstructionListItem()] + text]
+        return [[LIST_ITEM, text]]
 
     def paragraph(self, text):
         """Rendering paragraph tags. Like ``<p>``."""
@@ -163,13 +253,13 @@ class Md2XLSRenderer(Renderer):
         """Rendering **strong** text.
         :param text: text content for emphasis.
         """
-        return [MdStyleInstructionText('double_emphasis')] + text
+        return [DOUBLE_EMPHASIS, text]
 
     def emphasis(self, text):
         """Rendering *emphasis* text.
         :param text: text content for emphasis.
         """
-        return [MdStyleInstructionText('emphasis')] + text
+        return [EMPHASIS, text]
 
     def codespan(self, text):
         """Rendering inline `code` text.
@@ -177,18 +267,18 @@ class Md2XLSRenderer(Renderer):
         """
         if isinstance(text, str):
             text = [' {} '.format(text)]
-        return [MdStyleInstructionText('codespan')] + text
+        return [CODESPAN, text]
 
     def linebreak(self):
         """Rendering line break like ``<br>``."""
 
-        return [MdStyleInstructionLineBreak()]
+        return [LINE_BREAK]
 
     def strikethrough(self, text):
         """Rendering ~~strikethrough~~ text.
         :param text: text content for strikethrough.
         """
-        return [MdStyleInstructionText('strikethrough')] + text
+        return [STRIKETHROUGH, text]
 
     def text(self, text):
         """Rendering unformatted text.
@@ -219,7 +309,7 @@ class Md2XLSRenderer(Renderer):
         :param text: text content for description.
         """
         link = escape_link(link)
-        return [MdStyleInstructionLink(link)] + text
+        return [MdStyleInstructionLink(link), text]
 
     def image(self, src, title, text):
         """Rendering a image with title and text.
@@ -1,3 +1,80 @@
+from itertools import combinations
+from threading import Lock
+from types import MappingProxyType
+
+
+# Style names the markdown renderer produces: at most one for the whole cell, plus any of the text styles
+CELL_STYLES = ('h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hrule')
+TEXT_STYLES = ('double_emphasis', 'emphasis', 'codespan', 'strikethrough')
+
+# First item of the registry keys of formats with a number format, see MdXlsStyleRegistry.number_style
+NUM_FORMAT = 'num_format'
+
+
+class FormatTable(object):
+    """
+    Immutable table of the merged format properties for every combination of a cell style (or none) with any
+    set of text styles, computed once and shared by every workbook (and every export) using the same formats.
+    The cell style's properties come first, then the text styles' in TEXT_STYLES order.
+    """
+
+    _shared = {}
+    _shared_lock = Lock()
+
+    def __init__(self, formats):
+        """
+        :param formats: dict of format properties (as for workbook.add_format) by style name
+        """
+        table = {}
+        for cell in ('',) + CELL_STYLES:
+            for n in range(len(TEXT_STYLES)+1):
+                for texts in combinations(TEXT_STYLES, n):
+                    d = {}
+                    for name in (cell,) + texts:
+                        d.update(formats.get(name, {}))
+                    table[(cell, frozenset(texts))] = MappingProxyType(d) if len(d) > 0 else None
+        self._table = table
+
+    @classmethod
+    def for_formats(cls, overrides=None):
+        """
+        The shared table for MdXlsStyleRegistry.default_formats with overrides applied, built on first use.
+        :param overrides: dict of format properties by style name, merged over the defaults for that style
+        """
+        key = repr(sorted((name, sorted(props.items())) for name, props in (overrides or {}).items()))
+        table = cls._shared.get(key)
+        if table is None:
+            with cls._shared_lock:
+                table = cls._shared.get(key)
+                if table is None:
+                    formats = {name: dict(props) for name, props in MdXlsStyleRegistry.default_formats.items()}
+                    for name, props in (overrides or {}).items():
+                        formats[name] = {**formats.get(name, {}), **props}
+                    table = cls._shared[key] = cls(formats)
+        return table
+
+    @staticmethod
+    def normalize(mdnames):
+        """
+        :param mdnames: tuple of style names, e.g. ('h1', 'emphasis', 'emphasis')
+        :return: table key (cell style, frozenset of text styles); names with no formatting are dropped
+        """
+        cell = ''
+        texts = []
+        for name in mdnames:
+            if name in CELL_STYLES:
+                cell = name
+            elif name in TEXT_STYLES:
+                texts.append(name)
+        return cell, frozenset(texts)
+
+    def __getitem__(self, key):
+        """
+        :return: read-only dict of format properties, or None if the combination has no formatting
+        """
+        return self._table[key]
+
+
 class MdXlsStyleRegistry(object):
 
     default_formats = {
@@ -13,35 +90,73 @@ class MdXlsStyleRegistry(object):
         'h6': {'font_size': 13},
     }
 
-    def __init__(self, workbook):
+    def __init__(self, workbook, table=None):
+        """
+        :param workbook: xlsxwriter Workbook the formats are added to
+        :param table: FormatTable to take format properties from, by default the shared one for default_formats
+        """
         self.workbook = workbook
+        self.table = table if table is not None else FormatTable.for_formats()
         self.stylereg = {}
+        self.formats = {}
+        self.keys = {}
 
     def use_style(self, mdnames):
+        """
+        :param mdnames: tuple of md style names, e.g. ('h1', 'emphasis'), which is also the registry key;
+          a list or a single name is accepted too
+        :return: workbook Format, or '' if the names have no formatting
+        """
+        if mdnames.__class__ is not tuple:
+            mdnames = tuple(mdnames) if isinstance(mdnames, list) else (mdnames,)
 
-        if not isinstance(mdnames, list):
-            mdnames = [mdnames]
+        style = self.stylereg.get(mdnames)
 
-        mdname = '-'.join(mdnames)
+        if style is None:
 
-        if not mdname in self.stylereg:
+            style = self._create_style(FormatTable.normalize(mdnames))
 
-            style = self._create_style(mdnames)
+            self.stylereg[mdnames] = style
 
-            self.stylereg[mdname] = style
+        return style
 
-        return self.stylereg[mdname]
+    def number_style(self, num_format, mdnames=()):
+        """
+        :param num_format: Excel number format, e.g. 'yyyy-mm-dd'
+        :param mdnames: tuple of md style names whose formatting is added, e.g. ('double_emphasis',)
+        :return: workbook Format, created once for each combination
+        """
+        return self._create_style((NUM_FORMAT, num_format, FormatTable.normalize(mdnames)))
 
-    def _create_style(self, mdnames):
+    def style_key(self, style):
+        """
+        :param style: Format returned by use_style
+        :return: the normalized key it was created for, which can be passed to style_from_key
+          in this or another workbook's registry
+        """
+        return self.keys[style]
 
-        d = {}
+    def style_from_key(self, key):
+        """
+        :param key: (cell style, frozenset of text styles), see FormatTable.normalize, or
+          (NUM_FORMAT, number format, such a key), see number_style
+        :return: workbook Format, or '' if the key has no formatting
+        """
+        return self._create_style(key)
 
-        for submdname in mdnames:
+    def _create_style(self, key):
 
-            if submdname in self.default_formats:
-                d = {**d, **self.default_formats[submdname]}
+        # Only the combinations this workbook actually uses are added to it, each once
+        style = self.formats.get(key)
 
-        if len(d) > 0:
-            return self.workbook.add_format(d)
+        if style is None:
+            if key[0] == NUM_FORMAT:
+                props = dict(self.table[key[2]] or {}, num_format=key[1])
+            else:
+                props = self.table[key]
+            style = self.workbook.add_format(dict(props)) if props is not None else ''
+            self.formats[key] = style
+            if props is not None:
+                self.keys[style] = key
 
-        return ''
+        return style
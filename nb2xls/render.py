@@ -0,0 +1,41 @@
+"""
+Render notebook cells in a pool of worker processes (or threads), each with its own exporter.
+
+A worker writes each cell it is given into a recording (see cellcache.WorksheetRecorder) rather than a worksheet;
+the recordings come back in cell order to be replayed into the workbook.
+"""
+
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+# The exporter for this worker (process or thread), created once by _init_renderer
+_local = threading.local()
+
+
+def _init_renderer(settings):
+    from .exporter import XLSExporter
+    _local.exporter = XLSExporter(**settings)
+
+
+def render_cell(cell, notebook_dir=''):
+    """
+    :param notebook_dir: directory of the notebook, which sidecar filenames are relative to
+    :return: (number of rows, recorded ops, image stats) for the cell, see XLSExporter._record_cell
+    """
+    _local.exporter._notebook_dir = notebook_dir
+    return _local.exporter._record_cell(cell)
+
+
+def render_executor(pool, workers, settings):
+    """
+    :param pool: 'process' or 'thread'; threads are used anyway in a daemon process, such as a worker of the nb2xls
+      batch command, as it may not start processes of its own
+    :param workers: number of workers
+    :param settings: keyword arguments for each worker's XLSExporter
+    :return: concurrent.futures Executor whose workers can run render_cell
+    """
+    if pool == 'thread' or multiprocessing.current_process().daemon:
+        return ThreadPoolExecutor(workers, initializer=_init_renderer, initargs=(settings,))
+    return ProcessPoolExecutor(workers, initializer=_init_renderer, initargs=(settings,))
@@ -0,0 +1,58 @@
+import re
+
+
+# Characters Excel doesn't allow in worksheet names
+INVALID_SHEET_NAME_CHARS = re.compile(r'[\[\]:*?/\\]')
+
+# Excel's limit on the length of a worksheet name
+MAX_SHEET_NAME_LENGTH = 31
+
+# Excel's limit on the number of rows in a worksheet
+MAX_SHEET_ROWS = 1048576
+
+# A top-level heading: '# Title' or 'Title' underlined with '='
+atx_heading = re.compile(r'#[ \t]+(.*?)(?:[ \t]+#+)?[ \t]*$')
+setext_heading_underline = re.compile(r'=+[ \t]*$')
+
+
+def unique_sheet_name(name, workbook):
+    """
+    Turn text into a valid worksheet name that is not yet used in the workbook (ignoring case, as Excel does),
+    numbering it 'name (2)', 'name (3)' and so on if need be.
+    :param name: str, e.g. a heading
+    :param workbook: xlsxwriter Workbook the worksheet will be added to
+    """
+    name = INVALID_SHEET_NAME_CHARS.sub('', name).strip().strip("'").strip()[:MAX_SHEET_NAME_LENGTH] or 'Sheet'
+
+    used = {worksheet.name.lower() for worksheet in workbook.worksheets()}
+    if name.lower() not in used:
+        return name
+
+    base = re.sub(r' \(\d+\)$', '', name)
+    n = 2
+    while True:
+        suffix = ' ({})'.format(n)
+        candidate = base[:MAX_SHEET_NAME_LENGTH-len(suffix)] + suffix
+        if candidate.lower() not in used:
+            return candidate
+        n += 1
+
+
+def top_heading(source):
+    """
+    :param source: markdown cell source
+    :return: text of the level 1 heading the markdown starts with, or None if it doesn't start with one
+    """
+    lines = source.lstrip('\n').split('\n', 2)
+
+    match = atx_heading.match(lines[0].strip())
+    if match is not None:
+        heading = match.group(1)
+    elif len(lines) > 1 and lines[0].strip() and setext_heading_underline.match(lines[1].strip()):
+        heading = lines[0]
+    else:
+        return None
+
+    # Leave out emphasis and code markers
+    heading = re.sub(r'[*_`]', '', heading).strip()
+    return heading or None
@@ -0,0 +1,47 @@
+"""
+Full data for tables that a notebook only shows truncated, saved alongside the notebook ("sidecar" files).
+
+pandas shows only the first and last rows of a long DataFrame. To export all of it, display it with metadata
+naming a pickle of the whole frame, and set XLSExporter.table_sidecars:
+
+    from nb2xls.sidecar import save_sidecar
+    display(df, metadata=save_sidecar(df, 'results.pkl'))
+"""
+
+import os
+
+
+# Key of the output metadata naming the sidecar file
+SIDECAR_METADATA = 'nb2xls'
+
+
+def save_sidecar(frame, filename):
+    """
+    Pickle a DataFrame (or Series) to a sidecar file.
+    :param frame: pandas DataFrame or Series
+    :param filename: where to save it, relative to the notebook's directory when the notebook is exported
+    :return: output metadata pointing at the file, to display the frame with
+    """
+    frame.to_pickle(filename)
+    return {SIDECAR_METADATA: {'sidecar': filename}}
+
+
+def sidecar_filename(output, notebook_dir=''):
+    """
+    :param output: notebook output
+    :param notebook_dir: directory relative sidecar filenames are in
+    :return: filename of the output's sidecar, or None if it doesn't name one
+    """
+    filename = output.get('metadata', {}).get(SIDECAR_METADATA, {}).get('sidecar')
+    if not filename:
+        return None
+    return os.path.join(notebook_dir, filename)
+
+
+def load_sidecar(filename):
+    """
+    Unpickle a sidecar file, which can run arbitrary code, so only for trusted notebooks.
+    :return: pandas DataFrame or Series
+    """
+    import pandas # Only needed for sidecars, so not in requirements.txt
+    return pandas.read_pickle(filename)
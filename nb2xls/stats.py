@@ -0,0 +1,54 @@
+class ExportStats(object):
+    """
+    Timings and counts for an export, returned in resources['nb2xls_stats'].
+    A render worker collects them for each cell it renders, to be added into the export's.
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self.cells = []
+        self.mimetypes = {}
+        self.images = {'images': 0, 'unique_images': 0, 'bytes_saved': 0, 'bytes': 0}
+
+    def add_output(self, mimetype, seconds):
+        """
+        Count an output written as mimetype ('stream' for stream outputs), taking seconds
+        """
+        entry = self.mimetypes.get(mimetype)
+        if entry is None:
+            entry = self.mimetypes[mimetype] = {'count': 0, 'seconds': 0.0}
+        entry['count'] += 1
+        entry['seconds'] += seconds
+
+    def add_cell(self, cellno, cell_type, seconds, rows, cached=False):
+        self.cells.append({'cell': cellno+1, 'cell_type': cell_type, 'seconds': seconds, 'rows': rows,
+                           'cached': cached})
+
+    def add(self, other):
+        """
+        Add in the output timings and image counts of a cell rendered by another exporter
+        """
+        for mimetype, entry in other.mimetypes.items():
+            total = self.mimetypes.setdefault(mimetype, {'count': 0, 'seconds': 0.0})
+            total['count'] += entry['count']
+            total['seconds'] += entry['seconds']
+        for stat, n in other.images.items():
+            self.images[stat] += n
+
+    def as_dict(self):
+        """
+        :return: dict with
+          seconds: time spent preprocessing, writing cells, closing (assembling and zipping) the workbook, and in total
+          cells: for each cell, its number, cell_type, seconds taken, rows taken up and whether it came from the
+            cell cache
+          mimetypes: number of outputs written as each mimetype (or 'stream'), and the seconds they took
+          rows: rows taken up by all the cells
+          images: number of images, of distinct images, bytes not stored for duplicates and bytes of distinct images
+        """
+        return {
+            'seconds': dict(self.seconds),
+            'cells': list(self.cells),
+            'mimetypes': {mimetype: dict(entry) for mimetype, entry in self.mimetypes.items()},
+            'rows': sum(cell['rows'] for cell in self.cells),
+            'images': dict(self.images),
+        }
@@ -0,0 +1,515 @@
+import json
+import re
+from datetime import date, datetime
+from decimal import Decimal
+from html.parser import HTMLParser
+from itertools import groupby
+from numbers import Real
+
+
+# Written with worksheet.write so it becomes a formula showing #N/A in Excel
+NA_FORMULA = '=NA()'
+
+# Number formats for the column types infer_column recognises besides plain numbers and booleans
+DATE_FORMAT = 'yyyy-mm-dd'
+DATETIME_FORMAT = 'yyyy-mm-dd hh:mm:ss'
+
+# How pandas shows missing values in a column of dates, numbers or objects
+MISSING_TEXT = frozenset(('NaN', 'NaT', 'nan', 'None', '<NA>'))
+
+bool_pat = re.compile(r'(True|False)$')
+thousands_pat = re.compile(r'[-+]?\d{1,3}(,\d{3})*(\.(\d*))?$')
+percent_pat = re.compile(r'[-+]?\d+(\.(\d*))?%$')
+date_pat = re.compile(r'\d{4}-\d{2}-\d{2}$')
+datetime_pat = re.compile(r'(\d{4}-\d{2}-\d{2})[ T](\d{2}:\d{2})(:\d{2})?(\.\d+)?$')
+utc_offset_pat = re.compile(r'(Z|[-+]\d{2}:?\d{2})$')
+
+# Values of a column looked at to choose its type, and to size it
+TYPE_SAMPLE = 20
+WIDTH_SAMPLE = 100
+
+# Column widths set for tables, in characters
+MIN_COLUMN_WIDTH = 8.43 # Excel's default
+MAX_COLUMN_WIDTH = 50
+
+# A pandas DataFrame's _repr_html_: an optional <div> wrapper and scoped <style>, then one dataframe <table>,
+# then optionally the '<p>N rows x M columns</p>' footer that is never written out anyway.
+dataframe_html_head = re.compile(r'\s*(<div>\s*)?(<style scoped>.*?</style>\s*)?<table[^>]*\sclass="dataframe"', re.S)
+dataframe_html_tail = re.compile(r'</table>\s*(<p>[^<]*</p>\s*)?(</div>)?\s*$')
+
+
+class TableCell(object):
+    """
+    One <th> or <td> of a table, however it was parsed
+    """
+
+    __slots__ = ('value', 'header', 'rowspan', 'colspan')
+
+    def __init__(self, value, header=False, rowspan=1, colspan=1):
+        self.value = value
+        self.header = header
+        self.rowspan = rowspan
+        self.colspan = colspan
+
+    def __repr__(self):
+        return '<TableCell {!r} header={} rowspan={} colspan={}>'.format(self.value, self.header,
+                                                                      self.rowspan, self.colspan)
+
+
+def is_dataframe_html(html):
+    """
+    Is this text/html output a plain pandas DataFrame, so the table can be tokenized directly without a soup?
+    """
+    return html.count('<table') == 1 \
+        and dataframe_html_head.match(html) is not None \
+        and dataframe_html_tail.search(html) is not None
+
+
+class DataFrameHTMLParser(HTMLParser):
+    """
+    Streaming tokenizer collecting the rows of a pandas DataFrame's HTML table, without building a tree.
+    Cell text is everything inside the <th>/<td>, as with BeautifulSoup's get_text().
+    """
+
+    def __init__(self):
+        super(DataFrameHTMLParser, self).__init__(convert_charrefs=True)
+        self.rows = []
+        self._cells = None
+        self._cell = None
+        self._text = []
+        self._in_style = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'tr':
+            self._end_cell()
+            self._cells = []
+            self.rows.append(self._cells)
+
+        elif tag in ('th', 'td') and self._cells is not None:
+            self._end_cell()
+            attrs = dict(attrs)
+            self._cell = TableCell(None, tag == 'th', _span(attrs, 'rowspan'), _span(attrs, 'colspan'))
+            self._cells.append(self._cell)
+
+        elif tag == 'style':
+            self._in_style = True
+
+    def handle_endtag(self, tag):
+        if tag in ('th', 'td'):
+            self._end_cell()
+        elif tag in ('tr', 'table'):
+            self._end_cell()
+            self._cells = None
+        elif tag == 'style':
+            self._in_style = False
+
+    def handle_data(self, data):
+        if self._cell is not None and not self._in_style:
+            self._text.append(data)
+
+    def _end_cell(self):
+        if self._cell is not None:
+            self._cell.value = ''.join(self._text)
+            self._cell = None
+            self._text = []
+
+
+def _span(attrs, name):
+    span = attrs.get(name)
+    if span is not None and span.isdigit():
+        return int(span)
+    return 1
+
+
+def parse_dataframe_html(html):
+    """
+    :param html: text/html of a pandas DataFrame, see is_dataframe_html
+    :return: list of rows, each a list of TableCell
+    """
+    parser = DataFrameHTMLParser()
+    parser.feed(html)
+    parser.close()
+    parser._end_cell()
+    return parser.rows
+
+
+def rows_from_soup(table):
+    """
+    Collect a table's rows in a single pass over its own elements.
+    Rows are the <tr> elements directly in the table or in its <thead>/<tbody>, followed by those in its <tfoot>.
+    The rows of a nested table are not included: a nested table is just part of the text of the cell holding it.
+    :param table: BeautifulSoup <table> Tag
+    :return: list of rows, each a list of TableCell
+    """
+    rows, footer = [], []
+    for child in table.children:
+        if child.name == 'tr':
+            _rows_from_soup_tr(child, rows)
+        elif child.name in ('thead', 'tbody', 'tfoot'):
+            section = footer if child.name == 'tfoot' else rows
+            for tablerow in child.children:
+                if tablerow.name == 'tr':
+                    _rows_from_soup_tr(tablerow, section)
+    return rows + footer
+
+
+def _rows_from_soup_tr(tablerow, rows):
+    # html.parser doesn't close an unclosed <tr> when the next one starts, so following rows can be nested inside
+    pending = [tablerow]
+    while pending:
+        tablerow = pending.pop()
+        cells = []
+        nested = []
+        for child in tablerow.children:
+            if child.name == 'th' or child.name == 'td':
+                cells.append(TableCell(child.get_text(), child.name == 'th',
+                                       _span(child.attrs, 'rowspan'), _span(child.attrs, 'colspan')))
+            elif child.name == 'tr':
+                nested.append(child)
+        rows.append(cells)
+        pending.extend(reversed(nested))
+
+
+def rows_from_dataresource(resource, dates=False):
+    """
+    Rows for an application/vnd.dataresource+json output, which pandas produces with display.html.table_schema.
+    The header row holds the field names and the primary key (index) fields are header cells, as in pandas' HTML.
+    Values keep their JSON types, with null for missing values.
+    :param resource: dict with 'schema' and 'data'
+    :param dates: convert the ISO 8601 text of fields the schema types as date or datetime to datetimes,
+      ignoring any timezone
+    :return: list of rows, each a list of TableCell
+    """
+    fields = [field['name'] for field in resource['schema']['fields']]
+    date_fields = {field['name'] for field in resource['schema']['fields'] if field.get('type') in ('date', 'datetime')}
+    primary_key = resource['schema'].get('primaryKey', [])
+    if isinstance(primary_key, str):
+        primary_key = [primary_key]
+
+    # pandas names an unnamed index 'index'; its HTML leaves that header blank
+    rows = [[TableCell('' if name == 'index' and name in primary_key else name, True) for name in fields]]
+
+    for record in resource['data']:
+        rows.append([TableCell(_schema_date(record.get(name)) if dates and name in date_fields else record.get(name),
+                               name in primary_key) for name in fields])
+
+    return rows
+
+
+def _schema_date(value):
+    """
+    :return: datetime for the ISO 8601 date or date-time text pandas writes in table schema JSON, or value as it
+      is if it isn't one
+    """
+    if not isinstance(value, str):
+        return value
+    text = utc_offset_pat.sub('', value) if 'T' in value else value
+    for matches, convert in ((date_pat.match, _dates), (datetime_pat.match, _datetimes)):
+        if matches(text):
+            return convert([text])[0][0]
+    return value
+
+
+def rows_from_frame(frame):
+    """
+    Rows for a whole pandas DataFrame (or Series), laid out as in its HTML but never truncated: a heading row for
+    each level of the columns, then a row of the index names if there are any, then a row for each row of data,
+    starting with its index values as headings. As in pandas' HTML, repeated outer labels of a MultiIndex are
+    shown once, spanning their group. Values keep their types, with None, NaN and NaT for missing values.
+    :param frame: pandas DataFrame or Series
+    :return: list of rows, each a list of TableCell
+    """
+    if frame.ndim == 1:
+        frame = frame.to_frame()
+
+    index, columns = frame.index, frame.columns
+    index_levels = index.nlevels
+
+    rows = []
+
+    column_labels = [label if isinstance(label, tuple) else (label,) for label in columns]
+    for level in range(columns.nlevels):
+        # The columns' level names go in the last index heading, as pandas does
+        name = columns.names[level]
+        row = [TableCell('', True) for _ in range(index_levels - 1)]
+        row.append(TableCell(_label(name), True))
+        if level < columns.nlevels - 1:
+            for prefix, group in groupby(column_labels, key=lambda label: label[:level+1]):
+                row.append(TableCell(_label(prefix[-1]), True, colspan=sum(1 for _ in group)))
+        else:
+            row.extend(TableCell(_label(label[level]), True) for label in column_labels)
+        rows.append(row)
+
+    if any(name is not None for name in index.names):
+        rows.append([TableCell(_label(name), True) for name in index.names] +
+                    [TableCell('', True) for _ in column_labels])
+
+    index_labels = [label if isinstance(label, tuple) else (label,) for label in index]
+
+    # Rowspans for the outer index levels: a cell at the first row of each group, none for the rest
+    spans = []
+    for level in range(index_levels - 1):
+        level_spans = [0] * len(index_labels)
+        r = 0
+        for prefix, group in groupby(index_labels, key=lambda label: label[:level+1]):
+            n = sum(1 for _ in group)
+            level_spans[r] = n
+            r += n
+        spans.append(level_spans)
+
+    values = [_cell_values(frame.iloc[:, i]) for i in range(frame.shape[1])]
+
+    for r, (label, row_values) in enumerate(zip(index_labels, zip(*values) if values else ((),) * len(index))):
+        row = [TableCell(_cell_value(label[level]), True, rowspan=spans[level][r])
+               for level in range(index_levels - 1) if spans[level][r] > 0]
+        row.append(TableCell(_cell_value(label[-1]), True))
+        row.extend(TableCell(v) for v in row_values)
+        rows.append(row)
+
+    return rows
+
+
+# Values rows_from_frame writes as they are; anything else is written as its str
+WRITABLE_TYPES = (str, int, float, bool, Decimal, date, datetime)
+
+
+def _label(label):
+    return '' if label is None else _cell_value(label)
+
+
+def _cell_value(value):
+    if value is None or isinstance(value, WRITABLE_TYPES):
+        return value
+    return str(value)
+
+
+def _cell_values(series):
+    values = series.tolist()
+    if series.dtype == object:
+        values = [_cell_value(v) for v in values]
+    return values
+
+
+def place_cells(rows):
+    """
+    Work out the column offset of each cell in a single pass, allowing for colspans and for rowspans from earlier
+    rows, which cover every column the spanning cell covers.
+    :param rows: list of rows, each a list of TableCell
+    :return: generator giving, for each row, a list of (column offset, TableCell)
+    """
+    # For each column, the first row that is free of spanning cells from the rows above
+    free_from = []
+    for r, cells in enumerate(rows):
+        col = 0
+        placed = []
+        for cell in cells:
+            while col < len(free_from) and free_from[col] > r:
+                col += 1
+
+            placed.append((col, cell))
+
+            end = col + cell.colspan
+            if end > len(free_from):
+                free_from.extend([0] * (end - len(free_from)))
+            if cell.rowspan > 1:
+                for c in range(col, end):
+                    free_from[c] = r + cell.rowspan
+            col = end
+        yield placed
+
+
+def convert_column(values):
+    """
+    Convert a whole column of cell text to numbers where it looks like numbers, with NaN as NA_FORMULA.
+    Columns that are entirely numeric (the usual case for DataFrames) are converted in a single pass;
+    otherwise each value is tried on its own and non-numbers are left as they are.
+    :param values: list of str
+    :return: list of float or str
+    """
+    try:
+        numbers = list(map(float, values))
+    except ValueError:
+        return [_convert_value(v) for v in values]
+    return [NA_FORMULA if n != n else n for n in numbers]
+
+
+def _convert_value(value):
+    try:
+        f = float(value)
+    except ValueError:
+        return value
+    return NA_FORMULA if f != f else f
+
+
+def typed_column(values):
+    """
+    Typed (e.g. JSON or DataFrame) cell values for writing, see typed_value. Dates and date-times, which Excel
+    needs a number format to show, are written without a timezone.
+    :param values: list of values
+    :return: (list of values, Excel number format for the column's dates or None)
+    """
+    values = [typed_value(v) for v in values]
+    dates = [v for v in values if isinstance(v, date)]
+    if len(dates) == 0:
+        return values, None
+
+    if any(isinstance(v, datetime) and v.tzinfo is not None for v in dates):
+        values = [v.replace(tzinfo=None) if isinstance(v, datetime) else v for v in values]
+
+    times = any(isinstance(v, datetime) and v.time() != datetime.min.time() for v in dates)
+    return values, DATETIME_FORMAT if times else DATE_FORMAT
+
+
+def typed_value(value):
+    """
+    Convert an already typed (e.g. JSON) cell value for writing, with None and NaN as NA_FORMULA. Lists and
+    objects are written as JSON text, and any other value xlsxwriter can't write as its text.
+    """
+    if value is None:
+        return NA_FORMULA
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, default=str)
+    if not isinstance(value, WRITABLE_TYPES + (Real,)):
+        return str(value)
+    if value != value:
+        return NA_FORMULA
+    return value
+
+
+def infer_column(values, data=None):
+    """
+    Work out the type of a column of cell text from a sample of its values, then convert the whole column to it.
+    Besides numbers (as convert_column), the types are booleans, numbers with thousands separators, percentages,
+    and dates or date-times as pandas shows them; missing values (NaN, NaT etc.) become NA_FORMULA. A column
+    whose values don't all fit one type is converted value by value as convert_column does.
+    :param values: list of str
+    :param data: list of bool, whether each value is data rather than a heading; headings take no part in the
+      type and are converted as by convert_column. Default all data.
+    :return: (list of converted values, Excel number format for the column's data or None)
+    """
+    if data is None:
+        data = [True] * len(values)
+
+    present = [v for v, d in zip(values, data) if d and v not in MISSING_TEXT]
+    if len(present) > 0:
+        sample = present[:TYPE_SAMPLE]
+        for matches, convert in _COLUMN_TYPES:
+            if all(matches(v) for v in sample):
+                try:
+                    converted, num_format = convert(present)
+                except ValueError:
+                    break
+                converted = iter(converted)
+                return [next(converted) if d and v not in MISSING_TEXT else NA_FORMULA if d else _convert_value(v)
+                        for v, d in zip(values, data)], num_format
+
+    return convert_column(values), None
+
+
+def _numbers(values):
+    return list(map(float, values)), None
+
+
+def _booleans(values):
+    if not all(bool_pat.match(v) for v in values):
+        raise ValueError('Not all booleans')
+    return [v == 'True' for v in values], None
+
+
+def _decimals_format(base, matches, group):
+    decimals = max(len(m.group(group) or '') for m in matches)
+    return base + ('.' + '0' * decimals if decimals else '')
+
+
+def _thousands(values):
+    matches = [thousands_pat.match(v) for v in values]
+    if not all(matches):
+        raise ValueError('Not all numbers with thousands separators')
+    return [float(v.replace(',', '')) for v in values], _decimals_format('#,##0', matches, 3)
+
+
+def _percentages(values):
+    matches = [percent_pat.match(v) for v in values]
+    if not all(matches):
+        raise ValueError('Not all percentages')
+    return [float(v[:-1]) / 100 for v in values], _decimals_format('0', matches, 2) + '%'
+
+
+def _dates(values):
+    if not all(date_pat.match(v) for v in values):
+        raise ValueError('Not all dates')
+    return [datetime.strptime(v, '%Y-%m-%d') for v in values], DATE_FORMAT
+
+
+def _datetimes(values):
+    converted = []
+    for v in values:
+        m = datetime_pat.match(v)
+        if m is None:
+            raise ValueError('Not all date-times')
+        date, hours_minutes, seconds, fraction = m.groups()
+        # strptime takes at most microseconds, where pandas can show nanoseconds
+        converted.append(datetime.strptime(date + ' ' + hours_minutes + (seconds or ':00') + (fraction or '.0')[:7],
+                                           '%Y-%m-%d %H:%M:%S.%f'))
+    return converted, DATETIME_FORMAT
+
+
+def _is_number(value):
+    try:
+        float(value)
+    except ValueError:
+        return False
+    return True
+
+
+# (test for a sample value, conversion of all the values), tried in turn
+_COLUMN_TYPES = (
+    (_is_number, _numbers),
+    (bool_pat.match, _booleans),
+    (thousands_pat.match, _thousands),
+    (percent_pat.match, _percentages),
+    (date_pat.match, _dates),
+    (datetime_pat.match, _datetimes),
+)
+
+
+def column_width(values):
+    """
+    Width for a column, from the lengths of a sample of its values spread through it.
+    :param values: list of cell text (or typed values)
+    :return: width in characters, or None if the default width is wide enough
+    """
+    step = max(1, len(values) // WIDTH_SAMPLE)
+    longest = max((len(str(v)) for v in values[::step] if v is not None), default=0)
+    width = min(longest + 2, MAX_COLUMN_WIDTH)
+    return width if width > MIN_COLUMN_WIDTH else None
+
+
+def excel_table_headers(rows):
+    """
+    Headers for an Excel table over a simple table: one row of header cells, then data rows, all the same width
+    and without any spanning cells. Excel needs the headers to be distinct, non-empty strings.
+    :param rows: list of rows, each a list of TableCell
+    :return: list of header names, or None if the table isn't that simple
+    """
+    if len(rows) < 2 or not all(cell.header for cell in rows[0]):
+        return None
+    width = len(rows[0])
+    for i, cells in enumerate(rows):
+        if len(cells) != width or any(cell.rowspan != 1 or cell.colspan != 1 for cell in cells):
+            return None
+        if i > 0 and all(cell.header for cell in cells):
+            # A second heading row, e.g. the names of a DataFrame's index
+            return None
+
+    headers, seen = [], set()
+    for col, cell in enumerate(rows[0]):
+        name = str(cell.value).strip() if cell.value is not None else ''
+        name = name or ('index' if col == 0 and rows[1][0].header else 'Column{}'.format(col+1))
+        unique, n = name, 1
+        while unique.lower() in seen:
+            n += 1
+            unique = '{} ({})'.format(name, n)
+        seen.add(unique.lower())
+        headers.append(unique)
+    return headers
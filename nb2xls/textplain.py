@@ -0,0 +1,62 @@
+import re
+
+from nbformat import NotebookNode
+
+
+# Lines starting with these are given to worksheet.write(), which makes formulas of '=...' and '{=...}' and
+# hyperlinks of URLs; any other line is written as a plain string
+WRITE_SPECIAL_PREFIXES = ('=', '{=', 'http', 'ftp', 'mailto:', 'internal:', 'external:')
+
+# As in nbconvert's coalesce_streams: text up to a carriage return that is not at the end of a line is overwritten
+cr_pat = re.compile(r'.*\r(?=[^\n])')
+
+
+def merged_stream_outputs(outputs):
+    """
+    Merge consecutive stream outputs with the same name and apply carriage returns, as nbconvert's
+    coalesce_streams preprocessor does, but without changing the outputs passed in.
+    :param outputs: list of a code cell's outputs
+    :return: list of outputs, where merged or rewritten streams are new NotebookNodes
+    """
+    merged = []
+    texts = None
+    for o in outputs:
+        if o.output_type == 'stream':
+            if texts is not None and merged[-1].name == o.name:
+                texts.append(o.text)
+                continue
+            _end_stream(merged, texts)
+            texts = [o.text]
+        else:
+            _end_stream(merged, texts)
+            texts = None
+        merged.append(o)
+    _end_stream(merged, texts)
+    return merged
+
+
+def _end_stream(merged, texts):
+    if texts is None:
+        return
+    text = ''.join(texts)
+    if '\r' in text:
+        text = cr_pat.sub('', text)
+    if len(texts) > 1 or text is not texts[0]:
+        merged[-1] = NotebookNode(output_type='stream', name=merged[-1].name, text=text)
+
+
+def collapse_lines(text, head, tail):
+    """
+    Split text into lines, keeping only the first head and last tail lines if there are more than head + tail.
+    Only the lines kept are split out of the text.
+    :return: list of str, with a line saying how many lines were left out in place of those dropped
+    """
+    count = text.count('\n') + 1
+    if count <= head + tail:
+        return text.split('\n')
+
+    lines = text.split('\n', head)[:head] if head > 0 else []
+    lines.append('[... {} lines omitted ...]'.format(count - head - tail))
+    if tail > 0:
+        lines.extend(text.rsplit('\n', tail)[1:])
+    return lines
@@ -37,16 +37,17 @@ keywords = ['jupyter',
 license = 'MIT'
 classifiers = ['Development Status :: 4 - Beta',
                'License :: OSI Approved :: MIT License',
-               'Programming Language :: Python :: 3.5',
-               'Programming Language :: Python :: 3.6',
-               'Programming Language :: Python :: 3.7'
+               'Programming Language :: Python :: 3.7',
+               'Programming Language :: Python :: 3.8'
                ]
+python_requires = '>=3.7'
 include_package_data = True
 
 zip_safe = False
 
 extra_requirements = {
-    'test': ['pytest', 'testpath', 'openpyxl', 'matplotlib']
+    'test': ['pytest', 'testpath', 'openpyxl', 'matplotlib'],
+    'svg': ['cairosvg'],
 }
 
 # ref https://packaging.python.org/tutorials/distributing-packages/
@@ -63,6 +64,7 @@ setup(
     keywords=keywords,
     license=license,
     classifiers=classifiers,
+    python_requires=python_requires,
     include_package_data=include_package_data,
     install_requires=install_requires,
     extras_require=extra_requirements,
@@ -72,6 +74,9 @@ setup(
         'nbconvert.exporters': [
             'xls = nb2xls:XLSExporter'
         ],
+        'console_scripts': [
+            'nb2xls = nb2xls.batch:main'
+        ],
     }
 )
 
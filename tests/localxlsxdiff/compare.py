@@ -1,15 +1,25 @@
 # Based almost entirely on https://bitbucket.org/adimian/xlsx-diff/src/default/
 # License: MIT License (MIT/Expat)
 # Author: Eric Gazoni (eric.gazoni@adimian.com)
+#
+# Reads the sheet XML parts straight out of the zip with iterparse, rather than loading whole workbooks with
+# openpyxl, and skips any sheet whose part (and the strings it refers to) is byte for byte the same in both files.
 
-import openpyxl
+import hashlib
+import posixpath
+import re
+import zipfile
+from xml.etree.ElementTree import iterparse, fromstring, tostring
 
 
-try:
-    # Python 3
-    from itertools import zip_longest
-except ImportError:
-    from itertools import izip_longest as zip_longest
+NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PKG_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+ROW, CELL, VALUE, INLINE, TEXT = NS + 'row', NS + 'c', NS + 'v', NS + 'is', NS + 't'
+MERGE_CELL = NS + 'mergeCell'
+
+coord_pat = re.compile(r'([A-Z]+)(\d+)')
 
 
 class Difference(object):
@@ -36,113 +46,320 @@ class CellDifference(Difference):
     __slots__ = ('worksheet', 'coordinate', 'kind', 'expected', 'found')
 
 
-def diff(ref, other, ignores=(), precision=None, typeless=False):
+class MergedCellsDifference(Difference):
+    __slots__ = ('worksheet', 'expected', 'found')
+
+
+class PartDifference(Difference):
+    __slots__ = ('part', 'kind', 'expected', 'found')
+
+
+class Package(object):
+    ''' an xlsx file opened as a zip, with the parts it is made of '''
+
+    def __init__(self, filename):
+        self.zip = zipfile.ZipFile(filename)
+        self.names = set(self.zip.namelist())
+        self._digests = {}
+        self._strings = None
+        self._styles = None
+
+    def close(self):
+        self.zip.close()
+
+    def digest(self, part):
+        ''' @return: md5 of the part's bytes, or None if there is no such part '''
+        if part not in self.names:
+            return None
+        d = self._digests.get(part)
+        if d is None:
+            d = self._digests[part] = hashlib.md5(self.zip.read(part)).digest()
+        return d
+
+    def rels(self, part):
+        ''' @return: dict of relationship id to the part it targets, for the given part '''
+        folder, name = posixpath.split(part)
+        rels_part = posixpath.join(folder, '_rels', name + '.rels')
+        if rels_part not in self.names:
+            return {}
+        targets = {}
+        for rel in fromstring(self.zip.read(rels_part)).iter(PKG_REL_NS + 'Relationship'):
+            if rel.get('TargetMode') == 'External':
+                continue
+            target = rel.get('Target')
+            if target.startswith('/'):
+                target = target[1:]
+            else:
+                target = posixpath.normpath(posixpath.join(folder, target))
+            targets[rel.get('Id')] = target
+        return targets
+
+    def sheets(self):
+        ''' @return: dict of sheet name to the part holding it '''
+        rels = self.rels('xl/workbook.xml')
+        return {sheet.get('name'): rels[sheet.get(REL_NS + 'id')]
+                for sheet in fromstring(self.zip.read('xl/workbook.xml')).iter(NS + 'sheet')}
+
+    def strings(self):
+        ''' @return: list of the shared strings, rich text flattened '''
+        if self._strings is None:
+            self._strings = []
+            if 'xl/sharedStrings.xml' in self.names:
+                with self.zip.open('xl/sharedStrings.xml') as f:
+                    for event, elem in iterparse(f):
+                        if elem.tag == NS + 'si':
+                            self._strings.append(''.join(t.text or '' for t in elem.iter(TEXT)))
+                            elem.clear()
+        return self._strings
+
+    def styles(self):
+        ''' @return: list of a canonical description of each cell format (xf), by style index '''
+        if self._styles is None:
+            self._styles = []
+            if 'xl/styles.xml' in self.names:
+                root = fromstring(self.zip.read('xl/styles.xml'))
+
+                def items(tag, child):
+                    group = root.find(NS + tag)
+                    return [tostring(e) for e in group.iter(NS + child)] if group is not None else []
+
+                fonts, fills, borders = items('fonts', 'font'), items('fills', 'fill'), items('borders', 'border')
+                numfmts = {f.get('numFmtId'): f.get('formatCode') for f in root.iter(NS + 'numFmt')}
+
+                xfs = root.find(NS + 'cellXfs')
+                for xf in (xfs.iter(NS + 'xf') if xfs is not None else ()):
+                    alignment = xf.find(NS + 'alignment')
+                    protection = xf.find(NS + 'protection')
+                    self._styles.append((
+                        numfmts.get(xf.get('numFmtId'), xf.get('numFmtId')),
+                        _item(fonts, xf.get('fontId')),
+                        _item(fills, xf.get('fillId')),
+                        _item(borders, xf.get('borderId')),
+                        tostring(alignment) if alignment is not None else None,
+                        tostring(protection) if protection is not None else None,
+                    ))
+        return self._styles
+
+
+def _item(items, index):
+    try:
+        return items[int(index or 0)]
+    except IndexError:
+        return None
+
+
+def diff(ref, other, ignores=(), precision=None, typeless=False, styles=False, drawings=False):
     ''' compare a reference workbook with another workbook
     @param ignores: list of ignore classes to ignore
     @param precision: number of decimal digits to keep when comparing floats
     @param typeless: whether we consider number-looking strings as number or not
+    @param styles: whether to compare the format of each cell too, as CellDifference of kind 'style'
+    @param drawings: whether to compare the drawing and media parts too (images and their positions),
+        as PartDifference
 
     @return: (workbook-level differences, dict with per-sheet differences)
     '''
 
-    kwargs = dict(read_only=True, keep_vba=False, data_only=True)
-
     if precision is not None:
         if precision < 0:
             raise ValueError('negative precision is meaningless')
         else:
             precision = 10 ** (-precision)
 
-    wb1 = openpyxl.load_workbook(ref, **kwargs)
-    wb2 = openpyxl.load_workbook(other, **kwargs)
+    wb1 = Package(ref)
+    wb2 = Package(other)
+    try:
+        sheets1 = wb1.sheets()
+        sheets2 = wb2.sheets()
+
+        wb1_sheets = set(sheets1)
+        wb2_sheets = set(sheets2)
+
+        wb_differences = []
+        if not MissingWorksheet in ignores:
+            for sh in (wb1_sheets - wb2_sheets):
+                wb_differences.append(MissingWorksheet(worksheet=sh,
+                                                       missing_in='reference'))
 
-    wb1_sheets = set(wb1.sheetnames)
-    wb2_sheets = set(wb2.sheetnames)
+            for sh in (wb2_sheets - wb1_sheets):
+                wb_differences.append(MissingWorksheet(worksheet=sh,
+                                                       missing_in='other'))
 
-    wb_differences = []
-    if not MissingWorksheet in ignores:
-        for sh in (wb1_sheets - wb2_sheets):
-            wb_differences.append(MissingWorksheet(worksheet=sh,
-                                                   missing_in='reference'))
+        if drawings and not PartDifference in ignores:
+            wb_differences.extend(part_changes(wb1, wb2, ('xl/drawings/', 'xl/media/')))
 
-        for sh in (wb2_sheets - wb1_sheets):
-            wb_differences.append(MissingWorksheet(worksheet=sh,
-                                                   missing_in='other'))
+        # Cells refer to shared strings and formats by index, so the indexes can be compared directly when those
+        # parts are the same, and a sheet whose own part is the same too has nothing to compare at all
+        same_strings = wb1.digest('xl/sharedStrings.xml') == wb2.digest('xl/sharedStrings.xml')
+        same_styles = not styles or wb1.digest('xl/styles.xml') == wb2.digest('xl/styles.xml')
 
-    sheet_differences = {}
-    for sh in (wb1_sheets & wb2_sheets):
-        changes = sheet_changes(wb1, wb2, sh, ignores, precision, typeless)
-        if changes:
-            sheet_differences[sh] = changes
+        sheet_differences = {}
+        for sh in (wb1_sheets & wb2_sheets):
+            part1, part2 = sheets1[sh], sheets2[sh]
+            if same_strings and same_styles and wb1.digest(part1) == wb2.digest(part2):
+                continue
+            changes = sheet_changes(wb1, wb2, sh, part1, part2, ignores, precision, typeless, styles,
+                                    same_strings, same_styles)
+            if changes:
+                sheet_differences[sh] = changes
+
+    finally:
+        wb1.close()
+        wb2.close()
 
     return wb_differences, sheet_differences
 
 
-def sheet_changes(wb1, wb2, sheet_name, ignores, precision, typeless):
-    sheet1 = wb1[sheet_name]
-    sheet2 = wb2[sheet_name]
+def part_changes(wb1, wb2, prefixes):
+    diffs = []
+    parts = sorted(name for name in wb1.names | wb2.names if name.startswith(prefixes))
+    for part in parts:
+        d1, d2 = wb1.digest(part), wb2.digest(part)
+        if d1 is None:
+            diffs.append(PartDifference(part=part, kind='missing', expected=None, found=d2.hex()))
+        elif d2 is None:
+            diffs.append(PartDifference(part=part, kind='missing', expected=d1.hex(), found=None))
+        elif d1 != d2:
+            diffs.append(PartDifference(part=part, kind='content', expected=d1.hex(), found=d2.hex()))
+    return diffs
+
+
+def read_rows(wb, part, strings, resolve, styles, merged):
+    ''' generate (row number, {coordinate: (value, style index)}) for each row of a sheet part in turn,
+    leaving out empty cells; merged cell ranges are appended to merged at the end
+    @param strings: shared strings, if resolve is set
+    @param resolve: whether to look up shared strings, rather than give their index as (index,)
+    @param styles: whether to read style indexes, which are otherwise None
+    '''
+    with wb.zip.open(part) as f:
+        for event, elem in iterparse(f):
+            tag = elem.tag
+            if tag == ROW:
+                cells = {}
+                for c in elem.iter(CELL):
+                    t = c.get('t')
+                    if t == 'inlineStr':
+                        inline = c.find(INLINE)
+                        if inline is None:
+                            continue
+                        value = ''.join(e.text or '' for e in inline.iter(TEXT))
+                    else:
+                        v = c.find(VALUE)
+                        if v is None or v.text is None:
+                            continue
+                        value = v.text
+                        if t == 's':
+                            value = strings[int(value)] if resolve else (int(value),)
+                        elif t == 'b':
+                            value = value == '1'
+                        elif t is None or t == 'n':
+                            value = _cast_number(value)
+                    cells[c.get('r')] = (value, c.get('s', '0') if styles else None)
+                yield int(elem.get('r')), cells
+                elem.clear()
+            elif tag == MERGE_CELL:
+                merged.append(elem.get('ref'))
+
+
+def _cast_number(value):
+    ''' as openpyxl does '''
+    if '.' in value or 'E' in value or 'e' in value:
+        return float(value)
+    return int(value)
+
+
+def _aligned(rows1, rows2):
+    ''' generate (cells in rows1, cells in rows2) for each row number in either, in order '''
+    r1 = next(rows1, None)
+    r2 = next(rows2, None)
+    while r1 is not None or r2 is not None:
+        if r2 is None or (r1 is not None and r1[0] < r2[0]):
+            yield r1[1], {}
+            r1 = next(rows1, None)
+        elif r1 is None or r2[0] < r1[0]:
+            yield {}, r2[1]
+            r2 = next(rows2, None)
+        else:
+            yield r1[1], r2[1]
+            r1 = next(rows1, None)
+            r2 = next(rows2, None)
+
+
+def _column_order(coordinate):
+    letters, row = coord_pat.match(coordinate).groups()
+    return len(letters), letters
+
 
+def sheet_changes(wb1, wb2, sheet_name, part1, part2, ignores, precision, typeless, styles,
+                  same_strings, same_styles):
     diffs = []
     miss = MissingCell not in ignores
     diff = CellDifference not in ignores
-    for r1, r2 in zip_longest(sheet1.rows, sheet2.rows):
-        if r1 is None:
-            if miss:
-                for cell in r2:
-                    if not empty(cell):
-                        diffs.append(MissingCell(worksheet=sheet_name,
-                                                 coordinate=cell.coordinate,
-                                                 missing_in='reference'))
-        elif r2 is None:
-            if miss:
-                for cell in r1:
-                    if not empty(cell):
-                        diffs.append(MissingCell(worksheet=sheet_name,
-                                                 coordinate=cell.coordinate,
-                                                 missing_in='other'))
-        else:
-            for c1, c2 in zip_longest(r1, r2):
-                if empty(c1) and empty(c2):
-                    continue
-                elif empty(c1) and not empty(c2):
-                    if miss:
-                        diffs.append(MissingCell(worksheet=sheet_name,
-                                                 coordinate=c2.coordinate,
-                                                 missing_in='reference'))
-                elif empty(c2) and not empty(c1):
-                    if miss:
-                        diffs.append(MissingCell(worksheet=sheet_name,
-                                                 coordinate=c1.coordinate,
-                                                 missing_in='other'))
-                elif diff:
-                    if c1.value != c2.value:
-                        v1 = c1.value
-                        v2 = c2.value
+    style = styles and diff
+
+    strings1 = wb1.strings() if not same_strings else None
+    strings2 = wb2.strings() if not same_strings else None
+    merged1, merged2 = [], []
+
+    rows1 = read_rows(wb1, part1, strings1, not same_strings, style, merged1)
+    rows2 = read_rows(wb2, part2, strings2, not same_strings, style, merged2)
+
+    for cells1, cells2 in _aligned(rows1, rows2):
+        if cells1 == cells2 and same_styles:
+            continue
+        for coordinate in sorted(set(cells1) | set(cells2), key=_column_order):
+            c1 = cells1.get(coordinate)
+            c2 = cells2.get(coordinate)
+            if c1 is None:
+                if miss:
+                    diffs.append(MissingCell(worksheet=sheet_name,
+                                             coordinate=coordinate,
+                                             missing_in='reference'))
+            elif c2 is None:
+                if miss:
+                    diffs.append(MissingCell(worksheet=sheet_name,
+                                             coordinate=coordinate,
+                                             missing_in='other'))
+            elif diff:
+                v1, s1 = c1
+                v2, s2 = c2
+                if v1 != v2:
+                    if same_strings:
+                        # Only look up the strings for cells that actually differ
+                        if isinstance(v1, tuple):
+                            v1 = wb1.strings()[v1[0]]
+                        if isinstance(v2, tuple):
+                            v2 = wb2.strings()[v2[0]]
+                    if v1 != v2:
                         if typeless:
                             try:
                                 v1, v2 = float(v1), float(v2)
                             except:
                                 pass
-                        if isinstance(v1, float) and isinstance(v2, float):
-                            if precision is not None:
-                                if abs(v1 - v2) < precision:
-                                    continue
-                            else:
-                                if v1 == v2:
-                                    continue
+                        if not (isinstance(v1, float) and isinstance(v2, float) and
+                                (abs(v1 - v2) < precision if precision is not None else v1 == v2)):
+                            diffs.append(CellDifference(worksheet=sheet_name,
+                                                        coordinate=coordinate,
+                                                        kind='value',
+                                                        expected=v1,
+                                                        found=v2))
+                if style and (s1 != s2 or not same_styles):
+                    f1 = _item(wb1.styles(), s1)
+                    f2 = _item(wb2.styles(), s2)
+                    if f1 != f2:
                         diffs.append(CellDifference(worksheet=sheet_name,
-                                                    coordinate=c1.coordinate,
-                                                    kind='value',
-                                                    expected=v1,
-                                                    found=v2))
-    diffs.sort(key=klass)
-    return diffs
+                                                    coordinate=coordinate,
+                                                    kind='style',
+                                                    expected=f1,
+                                                    found=f2))
 
+    if MergedCellsDifference not in ignores and sorted(merged1) != sorted(merged2):
+        diffs.append(MergedCellsDifference(worksheet=sheet_name,
+                                           expected=sorted(merged1),
+                                           found=sorted(merged2)))
 
-def empty(cell):
-    if cell and not cell.value is None:
-        return False
-    return True
+    diffs.sort(key=klass)
+    return diffs
 
 
 def klass(x):
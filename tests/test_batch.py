@@ -0,0 +1,93 @@
+import os
+
+import pytest
+from traitlets.config import Config
+from traitlets.config.loader import KVArgParseConfigLoader
+
+from nb2xls import batch
+from nb2xls.batch import main, find_notebooks, find_notebook_roots, output_filename
+
+
+files_path = os.path.join(os.path.dirname(__file__), 'files')
+
+
+def test_find_notebooks():
+    notebooks = find_notebooks([files_path, os.path.join(files_path, 'ExcelTest*.ipynb')])
+    assert len(notebooks) == len(set(notebooks))
+    assert os.path.join(files_path, 'PandasNA.ipynb') in notebooks
+    assert all(n.endswith('.ipynb') for n in notebooks)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_batch_export(tmpdir, capsys, workers):
+    broken = tmpdir.join('broken.ipynb')
+    broken.write('not a notebook')
+
+    output_dir = str(tmpdir.join('out'))
+    status = main([os.path.join(files_path, 'Pandas*.ipynb'), str(broken), '--output-dir', output_dir,
+                   '--workers', str(workers), '--XLSExporter.html_parser=streaming'])
+
+    assert status == 1
+    assert sorted(os.listdir(output_dir)) == ['PandasNA.xlsx', 'PandasTables.xlsx']
+
+    out, err = capsys.readouterr()
+    assert 'FAILED {}'.format(broken) in err
+    assert 'Converted 2 of 3 notebooks' in out
+
+
+def test_batch_export_render_workers(tmpdir, capsys):
+    # Batch workers are daemon processes, which can't start render worker processes of their own
+    output_dir = str(tmpdir.join('out'))
+    status = main([os.path.join(files_path, 'Pandas*.ipynb'), '--output-dir', output_dir, '--workers', '2',
+                   '--XLSExporter.render_workers=2'])
+
+    out, err = capsys.readouterr()
+    assert status == 0, err
+    assert sorted(os.listdir(output_dir)) == ['PandasNA.xlsx', 'PandasTables.xlsx']
+
+
+def test_output_filename():
+    roots = find_notebook_roots([files_path, os.path.join(os.path.dirname(files_path), '*', 'PandasNA.ipynb')])
+    notebook = os.path.join(files_path, 'PandasNA.ipynb')
+    assert roots[notebook] == files_path
+    assert output_filename(notebook, 'out', roots[notebook]) == os.path.join('out', 'PandasNA.xlsx')
+    assert output_filename(notebook) == os.path.join(files_path, 'PandasNA.xlsx')
+
+    assert output_filename(os.path.join('reports', 'a', 'summary.ipynb'), 'out', 'reports') == \
+        os.path.join('out', 'a', 'summary.xlsx')
+
+
+def test_batch_export_same_names(tmpdir, capsys):
+    with open(os.path.join(files_path, 'PandasNA.ipynb')) as f:
+        notebook = f.read()
+    for folder in ('a', 'b', 'c'):
+        tmpdir.join('reports', folder, 'summary.ipynb').write(notebook, ensure=True)
+
+    # Each notebook keeps its path below the directory it was found in
+    output_dir = tmpdir.join('out')
+    assert main([str(tmpdir.join('reports')), '--output-dir', str(output_dir), '--workers', '1']) == 0
+    assert sorted(p.relto(output_dir) for p in output_dir.visit('*.xlsx')) == \
+        [os.path.join(folder, 'summary.xlsx') for folder in ('a', 'b', 'c')]
+
+    # Notebooks that would still overwrite one another fail, rather than losing output
+    capsys.readouterr()
+    status = main([str(tmpdir.join('reports', 'a')), str(tmpdir.join('reports', 'b')),
+                   '--output-dir', str(tmpdir.join('flat')), '--workers', '1'])
+    assert status == 1
+    out, err = capsys.readouterr()
+    assert 'FAILED {}'.format(tmpdir.join('reports', 'b', 'summary.ipynb')) in err
+    assert 'Converted 1 of 2 notebooks' in out
+
+
+def test_init_worker_release_image_data():
+    batch._init_worker(Config())
+    assert batch._exporter.release_image_data
+
+    batch._init_worker(KVArgParseConfigLoader(argv=['--XLSExporter.release_image_data=False']).load_config())
+    assert not batch._exporter.release_image_data
+
+
+def test_batch_unknown_arguments(capsys):
+    with pytest.raises(SystemExit):
+        main([files_path, '--wrokers', '2'])
+    assert 'unrecognized arguments: --wrokers 2' in capsys.readouterr().err
@@ -0,0 +1,41 @@
+import json
+import os
+import sys
+
+import nbformat
+
+# The benchmarks live next to the tests, at the top of the repository rather than in the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import generators
+from benchmarks.run import main, compare
+from nb2xls.images import image_size
+
+
+def test_generators():
+    nb = generators.dataframe_notebook(tables=2, rows=3, cols=4)
+    nbformat.validate(nb)
+    assert nb.cells[0].outputs[0].data['text/html'].count('<td>') == 12
+
+    assert image_size(generators.png(30, 20)) == (30, 20)
+    assert generators.png(5, 5, seed=1) != generators.png(5, 5, seed=2)
+
+    nbformat.validate(generators.markdown_notebook(cells=2, paragraphs=3))
+    nbformat.validate(generators.image_notebook(images=3, width=8, height=8, distinct=2))
+    assert len(generators.stream_notebook(lines=100, chunks=10).cells[0].outputs) == 10
+
+
+def test_run_and_compare(tmpdir):
+    baseline = str(tmpdir.join('baseline.json'))
+    args = ['--scale', '0.01', '--repeat', '1', '--baseline', baseline]
+
+    assert main(args + ['--save-baseline']) == 0
+    with open(baseline) as f:
+        results = json.load(f)['results']
+    assert set(results) == {'tables', 'markdown', 'images', 'streams'}
+    assert results['tables']['table_cells_per_second'] > 0
+
+    assert main(args + ['--tolerance', '1000', 'tables']) == 0
+
+    slower = {'tables': dict(results['tables'], seconds=results['tables']['seconds'] * 2)}
+    assert compare(slower, results, 0.25) and not compare(results, results, 0.25)
@@ -0,0 +1,52 @@
+import io
+
+import nbformat
+import openpyxl
+import pandas as pd
+import pytest
+
+from nb2xls.exporter import XLSExporter
+
+
+snippets = [
+    '<div>Intro <b>ignored</b> text<p>Para one<br>still para</p>after</div>',
+    'Top level &amp; entities <span>in a span <i>with</i> more</span> trailing',
+    '<div><!-- a comment --><p>x</p></div>',
+    '<table><tr><th>User: </th><td>abc</td>\n<tr><th>Password: </th><td>1.5</td></table>',
+    '<h1>Dropped heading</h1><div>Kept <table><thead><tr><th>a</th><th>b</th></tr></thead>'
+    '<tbody><tr><td rowspan="2">1</td><td>nan</td></tr><tr><td>x</td></tr></tbody></table> after</div><p>end</p>',
+    '<div><style>.x {color: red}</style><table class="other"><tr><td colspan="2">wide</td><td>3</td></tr></table></div>',
+    pd.DataFrame({'a': [1, 2], 'b': ['x', 'y']}).style._repr_html_() if hasattr(pd.DataFrame().style, '_repr_html_') else '',
+    '<p>Some text</p>' + pd.DataFrame({'a': [1.5, None]}).to_html(),
+    '<div>' + pd.DataFrame({'a': [1, 2]}).to_html() + pd.DataFrame({'a': [1, 2]}).describe().to_html() + '</div>',
+    '<table><tfoot><tr><td>total</td></tr></tfoot><tbody><tr><td>1</td></tr></tbody></table>',
+    '<table><tr><td>outer</td><td><table><tr><td>in</td><td>ner</td></tr></table></td></tr><tr><td>2</td></tr></table>',
+]
+
+
+def _cells(html, html_parser):
+    nb = nbformat.v4.new_notebook()
+    nb.cells.append(nbformat.v4.new_code_cell('html', outputs=[
+        nbformat.v4.new_output('display_data', data={'text/html': html}),
+    ]))
+    (output, resources) = XLSExporter(html_parser=html_parser).from_notebook_node(nb)
+    ws = openpyxl.load_workbook(io.BytesIO(output)).active
+    return [[c.value for c in row] for row in ws.iter_rows()]
+
+
+@pytest.mark.parametrize("html", snippets)
+@pytest.mark.parametrize("html_parser", ["lxml", "streaming"])
+def test_html_parser_matches_soup(html, html_parser):
+    assert _cells(html, html_parser) == _cells(html, 'html.parser')
+
+
+def test_tables_written_once():
+    html = snippets[-3]
+    for html_parser in ('html.parser', 'streaming'):
+        values = [row[1] for row in _cells(html, html_parser)]
+        assert values == [None, 0, 1] + [None, 'count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max']
+
+
+def test_table_sections_and_nesting():
+    assert [row[1:] for row in _cells(snippets[-2], 'html.parser')] == [[1], ['total']]
+    assert [row[1:] for row in _cells(snippets[-1], 'html.parser')] == [['outer', 'inner'], [2, None]]
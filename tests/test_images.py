@@ -0,0 +1,250 @@
+import base64
+import io
+import os
+import struct
+import zipfile
+
+import nbformat
+import pytest
+
+from nb2xls.exporter import XLSExporter
+from nb2xls.images import image_size, decode_base64
+
+
+def _png_header(width, height):
+    return b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)
+
+
+def _jpeg_header(width, height):
+    app0 = b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'
+    sof0 = b'\xff\xc0' + struct.pack('>HBHHB', 11, 8, height, width, 1) + b'\x01\x11\x00'
+    return b'\xff\xd8' + app0 + sof0 + b'\xff\xd9'
+
+
+def _gif_header(width, height):
+    return b'GIF89a' + struct.pack('<HH', width, height) + b'\x00\x00\x00'
+
+
+@pytest.mark.parametrize("header", [_png_header, _jpeg_header, _gif_header])
+def test_image_size(header):
+    assert image_size(header(640, 480)) == (640, 480)
+    assert image_size(memoryview(header(3840, 2160))) == (3840, 2160)
+
+
+def test_image_size_notebook_png():
+    assert image_size(_notebook_png()) == (384, 278)
+
+
+def test_image_size_unknown():
+    with pytest.raises(ValueError):
+        image_size(b'BM not an image we handle')
+
+
+def _notebook_png():
+    nb = nbformat.read(os.path.join(os.path.dirname(__file__), 'files', 'ExcelTest4.ipynb'), as_version=4)
+    pngs = [o.data['image/png'] for c in nb.cells for o in c.get('outputs', []) if 'image/png' in o.get('data', {})]
+    return base64.b64decode(pngs[0])
+
+
+rasterized = []
+
+
+def fake_rasterize(svg):
+    """
+    Stand-in svg_rasterizer backend
+    """
+    rasterized.append(svg)
+    return _notebook_png()
+
+
+def _image_notebook(mimetype, data):
+    nb = nbformat.v4.new_notebook()
+    nb.cells.append(nbformat.v4.new_code_cell('show()', outputs=[
+        nbformat.v4.new_output('display_data', data={mimetype: data, 'text/plain': '<Figure>'}),
+    ]))
+    return nb
+
+
+def _media_names(xlsx_data):
+    with zipfile.ZipFile(io.BytesIO(xlsx_data)) as z:
+        return [n for n in z.namelist() if n.startswith('xl/media/')]
+
+
+def test_export_jpeg():
+    Image = pytest.importorskip('PIL.Image') # Installed along with matplotlib
+    f = io.BytesIO()
+    Image.new('RGB', (64, 32), 'red').save(f, 'JPEG')
+    assert image_size(f.getvalue()) == (64, 32)
+
+    jpeg = base64.b64encode(f.getvalue()).decode('ascii')
+    (output, resources) = XLSExporter().from_notebook_node(_image_notebook('image/jpeg', jpeg))
+    assert _media_names(output) == ['xl/media/image1.jpeg']
+
+
+def test_export_svg_cached(tmpdir):
+    svg = '<svg xmlns="http://www.w3.org/2000/svg" width="10" height="10"></svg>'
+    exporter = XLSExporter(svg_rasterizer='test_images.fake_rasterize', image_cache_dir=str(tmpdir))
+    del rasterized[:]
+
+    for _ in range(2):
+        (output, resources) = exporter.from_notebook_node(_image_notebook('image/svg+xml', svg))
+        assert _media_names(output) == ['xl/media/image1.png']
+
+    assert rasterized == [svg.encode('utf-8')]
+
+
+def test_export_svg_cached_parallel(tmpdir):
+    svgs = ['<svg xmlns="http://www.w3.org/2000/svg" width="{0}" height="{0}"></svg>'.format(n) for n in (10, 20, 30)]
+    nb = nbformat.v4.new_notebook()
+    for svg in svgs:
+        nb.cells.extend(_image_notebook('image/svg+xml', svg).cells)
+    exporter = XLSExporter(svg_rasterizer='test_images.fake_rasterize', image_cache_dir=str(tmpdir.join('cache')),
+                           render_workers=2, render_pool='thread')
+    del rasterized[:]
+
+    for _ in range(2):
+        (output, resources) = exporter.from_notebook_node(nb)
+        assert _media_names(output) == ['xl/media/image1.png']
+
+    # The workers share the cache, so each SVG is only rasterized by the first export
+    assert sorted(rasterized) == sorted(svg.encode('utf-8') for svg in svgs)
+
+
+def test_export_svg_without_rasterizer():
+    svg = '<svg xmlns="http://www.w3.org/2000/svg" width="10" height="10"></svg>'
+    (output, resources) = XLSExporter(svg_rasterizer='').from_notebook_node(_image_notebook('image/svg+xml', svg))
+    assert _media_names(output) == []
+
+
+def test_export_duplicate_images():
+    png = base64.b64encode(_notebook_png()).decode('ascii')
+    nb = nbformat.v4.new_notebook()
+    for _ in range(3):
+        nb.cells.append(nbformat.v4.new_code_cell('show()', outputs=[
+            nbformat.v4.new_output('display_data', data={'image/png': png}),
+        ]))
+
+    (output, resources) = XLSExporter().from_notebook_node(nb)
+
+    assert _media_names(output) == ['xl/media/image1.png']
+    assert resources['nb2xls_images'] == {'images': 3, 'unique_images': 1, 'bytes_saved': 2*len(_notebook_png())}
+
+
+def test_export_duplicate_images_cached(tmpdir):
+    png = base64.b64encode(_notebook_png()).decode('ascii')
+    nb = nbformat.v4.new_notebook()
+    for _ in range(3):
+        nb.cells.extend(_image_notebook('image/png', png).cells)
+    (output, expected) = XLSExporter().from_notebook_node(nb)
+
+    # Replayed cells count their images as they did when they were first written
+    for _ in range(2):
+        (output, resources) = XLSExporter(cell_cache_dir=str(tmpdir)).from_notebook_node(nb)
+        assert resources['nb2xls_images'] == expected['nb2xls_images']
+        assert resources['nb2xls_stats']['images'] == expected['nb2xls_stats']['images']
+    assert all(cell['cached'] for cell in resources['nb2xls_stats']['cells'])
+
+
+def test_export_duplicate_images_decoded_once(monkeypatch):
+    decoded = []
+
+    def counting_decode(data):
+        decoded.append(data)
+        return decode_base64(data)
+
+    monkeypatch.setattr('nb2xls.exporter.decode_base64', counting_decode)
+    png = base64.b64encode(_notebook_png()).decode('ascii')
+    nb = nbformat.v4.new_notebook()
+    for _ in range(3):
+        nb.cells.extend(_image_notebook('image/png', png).cells)
+
+    (output, resources) = XLSExporter().from_notebook_node(nb)
+    assert len(decoded) == 1
+    assert resources['nb2xls_images']['images'] == 3
+
+
+def test_decode_base64():
+    png = _notebook_png()
+    encoded = base64.encodebytes(png).decode('ascii') # With line breaks every 76 characters
+    assert decode_base64(encoded) == png
+
+
+def test_export_release_image_data():
+    png = base64.b64encode(_notebook_png()).decode('ascii')
+    nb = _image_notebook('image/png', png)
+    nb.cells.append(nbformat.v4.new_code_cell('show()', outputs=[
+        nbformat.v4.new_output('display_data', data={'image/png': png + '\n'}),
+    ]))
+
+    (expected, resources) = XLSExporter().from_notebook_node(nb)
+    assert len(nb.cells[0].outputs[0].data) == 2
+
+    # The same image with different base64 text is still only stored once
+    assert _media_names(expected) == ['xl/media/image1.png']
+
+    (output, resources) = XLSExporter(release_image_data=True).from_notebook_node(nb)
+    assert _media_names(output) == ['xl/media/image1.png']
+    assert [dict(c.outputs[0].data) for c in nb.cells] == [{'text/plain': '<Figure>'}, {}]
+
+
+def _pil_image(xlsx_data):
+    Image = pytest.importorskip('PIL.Image')
+    with zipfile.ZipFile(io.BytesIO(xlsx_data)) as z:
+        name, = [n for n in z.namelist() if n.startswith('xl/media/')]
+        return name, Image.open(io.BytesIO(z.read(name)))
+
+
+def _base64_image(image, format='PNG'):
+    f = io.BytesIO()
+    image.save(f, format)
+    return base64.b64encode(f.getvalue()).decode('ascii')
+
+
+def test_export_resampled(tmpdir):
+    Image = pytest.importorskip('PIL.Image')
+    plot = Image.new('RGB', (2000, 1000), 'white')
+    plot.paste((0, 0, 255), (100, 100, 1900, 900))
+    nb = _image_notebook('image/png', _base64_image(plot))
+    nb.cells[0].outputs[0].metadata['image/png'] = {'width': 600, 'height': 300}
+
+    (output, resources) = XLSExporter(image_dpi=192).from_notebook_node(nb)
+    name, image = _pil_image(output)
+    assert image.size == (1200, 600)
+    assert resources['nb2xls_stats']['rows'] == XLSExporter().from_notebook_node(nb)[1]['nb2xls_stats']['rows']
+
+    del nb.cells[0].outputs[0].metadata['image/png']
+    exporter = XLSExporter(image_max_width=500, image_cache_dir=str(tmpdir))
+    for _ in range(2):
+        (output, resources) = exporter.from_notebook_node(nb)
+        assert _pil_image(output)[1].size == (500, 250)
+    assert len(tmpdir.listdir()) == 1
+
+
+def test_export_resampled_without_pillow(monkeypatch, caplog):
+    monkeypatch.setattr('nb2xls.exporter.Image', None)
+    png = base64.b64encode(_notebook_png()).decode('ascii')
+    nb = _image_notebook('image/png', png)
+    nb.cells.extend(_image_notebook('image/png', png).cells)
+
+    exporter = XLSExporter(image_max_width=10)
+    for _ in range(2):
+        (output, resources) = exporter.from_notebook_node(nb)
+        assert _media_names(output) == ['xl/media/image1.png']
+
+    # The images are embedded as they are, with a single warning
+    assert len([r for r in caplog.records if 'Pillow is not installed' in r.getMessage()]) == 1
+
+
+def test_export_recompressed():
+    Image = pytest.importorskip('PIL.Image')
+    photo = Image.frombytes('RGB', (200, 100), os.urandom(200 * 100 * 3))
+    plot = Image.new('RGB', (200, 100), 'white')
+    plot.paste((255, 0, 0), (50, 25, 150, 75))
+
+    exporter = XLSExporter(image_jpeg_quality=80, image_palette_colors=16)
+
+    name, image = _pil_image(exporter.from_notebook_node(_image_notebook('image/png', _base64_image(photo)))[0])
+    assert name == 'xl/media/image1.jpeg' and image.size == (200, 100)
+
+    name, image = _pil_image(exporter.from_notebook_node(_image_notebook('image/png', _base64_image(plot)))[0])
+    assert name == 'xl/media/image1.png' and image.mode == 'P'
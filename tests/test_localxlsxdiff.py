@@ -0,0 +1,82 @@
+import os
+from io import BytesIO
+
+import nbformat
+import pytest
+import xlsxwriter
+
+from nb2xls.exporter import XLSExporter
+from localxlsxdiff.compare import diff, CellDifference, MissingCell, MergedCellsDifference, PartDifference
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def _png(width, height):
+    data = BytesIO()
+    Image.new('RGB', (width, height)).save(data, 'PNG')
+    return BytesIO(data.getvalue())
+
+
+def _workbook(filename, value=1.5, bold=False, merge=False, image=None, constant_memory=False):
+    workbook = xlsxwriter.Workbook(filename, {'constant_memory': constant_memory})
+    worksheet = workbook.add_worksheet('Sheet1')
+    worksheet.write(0, 0, 'Title', workbook.add_format({'bold': True}) if bold else None)
+    worksheet.write(1, 0, value)
+    worksheet.write(2, 1, 'Text')
+    if merge:
+        worksheet.merge_range(4, 0, 4, 2, 'Merged')
+    if image is not None:
+        worksheet.insert_image(6, 0, 'image.png', {'image_data': image})
+    workbook.close()
+    return filename
+
+
+def test_diff_same(tmpdir):
+    ref = _workbook(str(tmpdir.join('ref.xlsx')))
+    assert diff(ref, _workbook(str(tmpdir.join('same.xlsx')))) == ([], {})
+
+    # Inline strings give the same values as shared ones
+    assert diff(ref, _workbook(str(tmpdir.join('inline.xlsx')), constant_memory=True)) == ([], {})
+
+
+def test_diff_cells(tmpdir):
+    ref = _workbook(str(tmpdir.join('ref.xlsx')))
+
+    wb_diff, sheet_diffs = diff(ref, _workbook(str(tmpdir.join('value.xlsx')), value='1.5'))
+    assert wb_diff == []
+    assert [(type(d), d.coordinate, d.expected, d.found) for d in sheet_diffs['Sheet1']] == \
+        [(CellDifference, 'A2', 1.5, '1.5')]
+    assert diff(ref, str(tmpdir.join('value.xlsx')), typeless=True) == ([], {})
+
+    assert diff(ref, _workbook(str(tmpdir.join('close.xlsx')), value=1.5001), precision=3) == ([], {})
+
+    wb_diff, sheet_diffs = diff(ref, _workbook(str(tmpdir.join('merge.xlsx')), merge=True))
+    assert sorted(type(d).__name__ for d in sheet_diffs['Sheet1']) == ['MergedCellsDifference', 'MissingCell']
+    assert diff(ref, str(tmpdir.join('merge.xlsx')), ignores=(MissingCell, MergedCellsDifference)) == ([], {})
+
+
+def test_diff_styles_and_drawings(tmpdir):
+    ref = _workbook(str(tmpdir.join('ref.xlsx')), image=_png(10, 10))
+
+    bold = _workbook(str(tmpdir.join('bold.xlsx')), bold=True, image=_png(10, 10))
+    assert diff(ref, bold) == ([], {})
+    wb_diff, sheet_diffs = diff(ref, bold, styles=True)
+    assert [(d.coordinate, d.kind) for d in sheet_diffs['Sheet1']] == [('A1', 'style')]
+
+    other_image = _workbook(str(tmpdir.join('image.xlsx')), image=_png(20, 10))
+    assert diff(ref, other_image) == ([], {})
+    wb_diff, sheet_diffs = diff(ref, other_image, drawings=True)
+    assert all(isinstance(d, PartDifference) for d in wb_diff)
+    assert 'xl/media/image1.png' in [d.part for d in wb_diff]
+
+
+def test_diff_exports(tmpdir):
+    """
+    Are the reference files the same as exports of their notebooks, with styles and images too?
+    """
+    files = os.path.join(os.path.dirname(__file__), 'files')
+    for name in ('ExcelTest4.ipynb', 'PandasNA.ipynb'):
+        other_fn = str(tmpdir.join(name + '.xlsx'))
+        nb = nbformat.read(os.path.join(files, name), as_version=4)
+        XLSExporter(constant_memory=True).export_to_file(nb, other_fn)
+        assert diff(os.path.join(files, name + '.xlsx'), other_fn, styles=True, drawings=True) == ([], {})
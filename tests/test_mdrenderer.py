@@ -0,0 +1,72 @@
+import mistune
+import xlsxwriter
+
+from nb2xls.mdrenderer import Md2XLSRenderer, MdStyleInstructionBlockEnd, MdStyleInstructionText, \
+    MdStyleInstructionListItem, flatten_blocks, LIST_ITEM, KIND_LIST_ITEM
+from nb2xls.mdxlsstyles import MdXlsStyleRegistry, FormatTable
+
+
+def _stream(md):
+    return flatten_blocks(mistune.Markdown(renderer=Md2XLSRenderer())(md))
+
+
+def test_flatten_blocks():
+    stream = _stream('Some **bold** text\n\n- item')
+    kinds = [type(s).__name__ if not isinstance(s, str) else s for s in stream]
+    assert kinds == ['Some ', 'MdStyleInstructionText', 'bold', ' text', 'MdStyleInstructionBlockEnd',
+                     'MdStyleInstructionListStart', 'MdStyleInstructionBlockEnd',
+                     'MdStyleInstructionListItem', 'item', 'MdStyleInstructionBlockEnd',
+                     'MdStyleInstructionListEnd', 'MdStyleInstructionBlockEnd']
+
+
+def test_flatten_deeply_nested():
+    depth = 5000
+    nested = 'leaf'
+    for _ in range(depth):
+        nested = [MdStyleInstructionText('emphasis'), nested]
+    stream = flatten_blocks([nested, 'html block'])
+    assert len(stream) == depth + 4
+    assert stream[depth] == 'leaf'
+    assert stream[depth+2] == 'html block'
+    assert isinstance(stream[depth+1], MdStyleInstructionBlockEnd) and isinstance(stream[-1], MdStyleInstructionBlockEnd)
+
+
+def test_flatten_long_list():
+    md = '\n'.join('- item {}'.format(i) for i in range(2000))
+    stream = _stream(md)
+    assert sum(isinstance(s, MdStyleInstructionListItem) for s in stream) == 2000
+
+
+def test_instructions_shared():
+    stream = _stream('- **one**\n- **two**  \n  three')
+    items = [s for s in stream if isinstance(s, MdStyleInstructionListItem)]
+    assert items == [LIST_ITEM, LIST_ITEM] and all(s is LIST_ITEM for s in items)
+    assert LIST_ITEM.kind == KIND_LIST_ITEM
+    bold = [s for s in stream if isinstance(s, MdStyleInstructionText)]
+    assert len(bold) == 2 and bold[0] is bold[1]
+    assert not any(hasattr(s, '__dict__') for s in stream if not isinstance(s, str))
+
+
+def test_use_style_keys(tmpdir):
+    workbook = xlsxwriter.Workbook(str(tmpdir.join('styles.xlsx')))
+    reg = MdXlsStyleRegistry(workbook)
+    fmt = reg.use_style(('h1', 'emphasis'))
+    assert reg.use_style(['h1', 'emphasis']) is fmt
+    assert reg.use_style('h1') is reg.use_style(('h1',))
+    assert reg.use_style(('',)) == ''
+    workbook.close()
+
+
+def test_format_table_overrides(tmpdir):
+    assert FormatTable.for_formats() is FormatTable.for_formats({})
+    table = FormatTable.for_formats({'h1': {'font_color': 'navy'}, 'codespan': {'font_name': 'Consolas'}})
+    assert table is FormatTable.for_formats({'codespan': {'font_name': 'Consolas'}, 'h1': {'font_color': 'navy'}})
+    assert dict(table[('h1', frozenset(['codespan']))]) == {'font_size': 30, 'font_color': 'navy',
+                                                           'font_name': 'Consolas'}
+    assert FormatTable.for_formats()[('h1', frozenset())]['font_size'] == 30
+
+    workbook = xlsxwriter.Workbook(str(tmpdir.join('styles.xlsx')))
+    reg = MdXlsStyleRegistry(workbook, table)
+    assert reg.use_style(('h1', 'emphasis', 'emphasis')) is reg.use_style(('h1', 'emphasis'))
+    assert reg.use_style(('hrule',)) == ''
+    workbook.close()
@@ -1,5 +1,6 @@
 import os
 import pytest
+import nbformat
 
 from testpath.tempdir import TemporaryWorkingDirectory
 from nb2xls.exporter import XLSExporter
@@ -85,3 +86,354 @@ class TestsExcelExporter(LocalExportersTestsBase):
             assert len(wb_diff) == 0
 
             assert len(sheet_diffs) == 0
+
+    @pytest.mark.parametrize("ipynb_filename",
+                             [
+                                "ExcelTest4.ipynb",
+                                "PandasTables.ipynb",
+                                "NestedMarkdown1.ipynb",
+                             ])
+    def test_export_constant_memory(self, ipynb_filename):
+        """
+        Does streaming a constant_memory export straight to a file give the same cells as before?
+        """
+        nb = nbformat.read(self._get_notebook(ipynb_filename), as_version=4)
+
+        with self.create_temp_cwd() as temp_cwd:
+
+            other_fn = os.path.join(temp_cwd, ipynb_filename+'.xlsx')
+
+            resources = XLSExporter(constant_memory=True).export_to_file(nb, other_fn)
+            assert resources['output_extension'] == '.xlsx'
+
+            ref_fn = self._get_notebook(ipynb_filename)+'.xlsx'
+
+            wb_diff, sheet_diffs = diff(ref_fn, other_fn)
+
+            assert len(wb_diff) == 0
+
+            assert len(sheet_diffs) == 0
+
+    def _get_stream_notebook(self):
+        nb = nbformat.v4.new_notebook()
+        nb.cells.append(nbformat.v4.new_code_cell('print(1); print(2)', outputs=[
+            nbformat.v4.new_output('stream', name='stdout', text='1\n'),
+            nbformat.v4.new_output('stream', name='stdout', text='2\n'),
+        ]))
+        return nb
+
+    def test_preprocess_leaves_notebook_untouched(self):
+        """
+        Is the caller's notebook unchanged when coalesce_streams has work to do?
+        """
+        nb = self._get_stream_notebook()
+        (output, resources) = XLSExporter().from_notebook_node(nb)
+        assert len(output) > 0
+        assert len(nb.cells[0].outputs) == 2
+
+    def test_preprocess_without_copy(self):
+        """
+        Is the notebook passed straight through when no preprocessor would change it,
+        and modified in place by coalesce_streams when copy_notebook and merge_streams are False?
+        """
+        exporter = XLSExporter()
+        nb = nbformat.read(self._get_notebook('ExcelTest4.ipynb'), as_version=4)
+        nb_out, resources = exporter._preprocess(nb, exporter._init_resources(None))
+        assert nb_out is nb
+
+        nb = self._get_stream_notebook()
+        XLSExporter(copy_notebook=False).from_notebook_node(nb)
+        assert len(nb.cells[0].outputs) == 2
+
+        XLSExporter(copy_notebook=False, merge_streams=False).from_notebook_node(nb)
+        assert len(nb.cells[0].outputs) == 1
+        assert nb.cells[0].outputs[0].text == '1\n2\n'
+
+    @pytest.mark.parametrize("html_parser", ["lxml", "streaming"])
+    @pytest.mark.parametrize("ipynb_filename",
+                             [
+                                "ExcelTest4.ipynb",
+                                "MarkdownReprDisplay.ipynb",
+                                "MultipleOutputs.ipynb",
+                                "PandasNA.ipynb",
+                                "PandasTables.ipynb",
+                             ])
+    def test_export_html_parser(self, ipynb_filename, html_parser):
+        """
+        Does each html_parser backend give the same cells as before?
+        """
+        (other, resources) = XLSExporter(html_parser=html_parser).from_filename(self._get_notebook(ipynb_filename))
+
+        with self.create_temp_cwd() as temp_cwd:
+
+            other_fn = os.path.join(temp_cwd, ipynb_filename+'.xlsx')
+            with open(other_fn, "wb") as f:
+                f.write(other)
+
+            wb_diff, sheet_diffs = diff(self._get_notebook(ipynb_filename)+'.xlsx', other_fn)
+
+            assert len(wb_diff) == 0
+
+            assert len(sheet_diffs) == 0
+
+    def test_markdown_parser_cache(self):
+        """
+        Is the markdown parser built once, and is repeated markdown only parsed once?
+        """
+        nb = nbformat.v4.new_notebook()
+        for i in range(3):
+            nb.cells.append(nbformat.v4.new_markdown_cell('# Disclaimer\n\nSome **boilerplate**'))
+            nb.cells.append(nbformat.v4.new_markdown_cell('- Item {}'.format(i)))
+
+        exporter = XLSExporter()
+        exporter.from_notebook_node(nb)
+        parser = exporter._markdown
+        exporter.from_notebook_node(nb)
+        assert exporter._markdown is parser
+
+        info = exporter._markdown_cache.cache_info()
+        assert (info.misses, info.hits) == (4, 8)
+
+        exporter.markdown_cache_size = 0
+        (output, resources) = exporter.from_notebook_node(nb)
+        assert exporter._markdown_cache.cache_info().hits == 0
+        assert len(output) > 0
+
+    def test_markdown_formats(self):
+        """
+        Do markdown_formats overrides reach the workbook, merged over the default style?
+        """
+        openpyxl = pytest.importorskip('openpyxl')
+        from io import BytesIO
+
+        nb = nbformat.v4.new_notebook()
+        nb.cells.append(nbformat.v4.new_markdown_cell('# Title'))
+
+        exporter = XLSExporter(markdown_formats={'h1': {'font_color': '#000080'}})
+        (output, resources) = exporter.from_notebook_node(nb)
+
+        font = openpyxl.load_workbook(BytesIO(output)).active.cell(row=1, column=2).font
+        assert font.sz == 30
+        assert font.color.rgb.endswith('000080')
+
+    def _get_cell_values(self, output):
+        openpyxl = pytest.importorskip('openpyxl')
+        from io import BytesIO
+        sheet = openpyxl.load_workbook(BytesIO(output)).active
+        return [row[1] for row in sheet.iter_rows(values_only=True)]
+
+    def test_merge_streams(self):
+        """
+        Are consecutive streams written as one output, whether merged while writing or by coalesce_streams?
+        """
+        nb = self._get_stream_notebook()
+        nb.cells[0].outputs.append(nbformat.v4.new_output('stream', name='stdout', text='50%\r100%\n'))
+
+        values = self._get_cell_values(XLSExporter().from_notebook_node(nb)[0])
+        assert values == ['1', '2', '100%']
+        assert values == self._get_cell_values(XLSExporter(merge_streams=False).from_notebook_node(nb)[0])
+
+    def test_text_head_tail_lines(self):
+        """
+        Are long stream outputs collapsed to their head and tail lines, with formulas and URLs written as before?
+        """
+        nb = nbformat.v4.new_notebook()
+        text = '\n'.join('step {}'.format(i) for i in range(1000))
+        nb.cells.append(nbformat.v4.new_code_cell('train()', outputs=[
+            nbformat.v4.new_output('stream', name='stdout', text=text),
+            nbformat.v4.new_output('stream', name='stderr', text='=1+1\nhttps://example.com'),
+        ]))
+
+        values = self._get_cell_values(XLSExporter(text_head_lines=2, text_tail_lines=1).from_notebook_node(nb)[0])
+        assert values == ['step 0', 'step 1', '[... 997 lines omitted ...]', 'step 999', None,
+                      '=1+1', 'https://example.com']
+
+        values = self._get_cell_values(XLSExporter(text_head_lines=3).from_notebook_node(nb)[0])
+        assert values[:4] == ['step 0', 'step 1', 'step 2', '[... 997 lines omitted ...]']
+
+    @staticmethod
+    def _xlsx_parts(output):
+        import zipfile
+        from io import BytesIO
+        z = zipfile.ZipFile(BytesIO(output))
+        return {name: z.read(name) for name in z.namelist() if not name.startswith('docProps')}
+
+    @pytest.mark.parametrize("ipynb_filename",
+                             [
+                                "ExcelTest.ipynb",
+                                "MultipleOutputs.ipynb",
+                                "NestedMarkdown1.ipynb",
+                                "PandasTables.ipynb",
+                             ])
+    @pytest.mark.parametrize("options", [{}, {'max_sheet_rows': 5, 'merge_table_spans': True},
+                                         {'table_sheet_rows': 4, 'max_sheet_rows': 3}])
+    def test_cell_cache(self, ipynb_filename, options, tmpdir):
+        """
+        Does replaying cached cells give the same workbook, without parsing anything again?
+        """
+        filename = self._get_notebook(ipynb_filename)
+        (expected, resources) = XLSExporter(**options).from_filename(filename)
+
+        (output, resources) = XLSExporter(cell_cache_dir=str(tmpdir), **options).from_filename(filename)
+        assert self._xlsx_parts(output) == self._xlsx_parts(expected)
+
+        exporter = XLSExporter(cell_cache_dir=str(tmpdir), **options)
+        (output, resources) = exporter.from_filename(filename)
+        assert self._xlsx_parts(output) == self._xlsx_parts(expected)
+        assert exporter._markdown is None
+
+    def test_cell_cache_changed_cell(self, tmpdir):
+        """
+        Is only the changed cell written again, and are settings part of the key?
+        """
+        nb = nbformat.read(self._get_notebook('NestedMarkdown1.ipynb'), as_version=4)
+        XLSExporter(cell_cache_dir=str(tmpdir)).from_notebook_node(nb)
+
+        nb.cells[0].source += '\n\nOne more paragraph'
+        exporter = XLSExporter(cell_cache_dir=str(tmpdir))
+        exporter.from_notebook_node(nb)
+        assert exporter._markdown_cache.cache_info().misses == 1
+
+        exporter = XLSExporter(cell_cache_dir=str(tmpdir), html_parser='streaming')
+        exporter.from_notebook_node(nb)
+        assert exporter._markdown_cache.cache_info().misses == sum(c.cell_type == 'markdown' for c in nb.cells)
+
+    @pytest.mark.parametrize("render_pool", ["process", "thread"])
+    @pytest.mark.parametrize("ipynb_filename",
+                             [
+                                "ExcelTest4.ipynb",
+                                "MultipleOutputs.ipynb",
+                                "NestedMarkdown1.ipynb",
+                                "PandasTables.ipynb",
+                             ])
+    @pytest.mark.parametrize("options", [{}, {'max_sheet_rows': 5, 'merge_table_spans': True},
+                                         {'table_sheet_rows': 4, 'max_sheet_rows': 3}])
+    def test_render_workers(self, ipynb_filename, render_pool, options):
+        """
+        Do cells rendered in parallel give the same workbook?
+        """
+        filename = self._get_notebook(ipynb_filename)
+        (expected, resources) = XLSExporter(**options).from_filename(filename)
+
+        (output, resources) = XLSExporter(render_workers=2, render_pool=render_pool, **options).from_filename(filename)
+        assert self._xlsx_parts(output) == self._xlsx_parts(expected)
+
+    def test_stats(self, tmpdir):
+        """
+        Are timings and counts returned in nb2xls_stats, and is a profile saved if asked for?
+        """
+        profile_file = str(tmpdir.join('export.prof'))
+        exporter = XLSExporter(profile_file=profile_file)
+        (output, resources) = exporter.from_filename(self._get_notebook('ExcelTest4.ipynb'))
+
+        stats = resources['nb2xls_stats']
+        assert set(stats['seconds']) == {'preprocess', 'cells', 'close', 'total'}
+        assert [cell['cell'] for cell in stats['cells']] == list(range(1, len(stats['cells'])+1))
+        assert stats['rows'] == sum(cell['rows'] for cell in stats['cells']) > 0
+        assert stats['mimetypes']['image/png']['count'] == 1
+        assert stats['images']['bytes'] > 0
+        assert stats['sheets'] == 1 and stats['formats'] > 0
+
+        import pstats
+        assert pstats.Stats(profile_file).total_calls > 0
+
+    def test_export_async(self):
+        """
+        Does export_async stream the same workbook to an async writer in chunks?
+        """
+        import asyncio
+
+        filename = self._get_notebook('ExcelTest4.ipynb')
+        nb = nbformat.read(filename, as_version=4)
+        (expected, resources) = XLSExporter().from_notebook_node(nb)
+
+        class Writer(object):
+            def __init__(self):
+                self.chunks = []
+
+            async def write(self, chunk):
+                self.chunks.append(chunk)
+
+        writer = Writer()
+        resources = asyncio.run(XLSExporter().export_async(nb, writer, chunk_size=1000))
+        assert len(writer.chunks) > 1 and max(len(chunk) for chunk in writer.chunks) == 1000
+        assert self._xlsx_parts(b''.join(writer.chunks)) == self._xlsx_parts(expected)
+        assert resources['nb2xls_stats']['sheets'] == 1
+
+    def test_export_async_cancel(self):
+        """
+        Does cancelling export_async stop the export at the next cell, without writing anything?
+        """
+        import asyncio
+        import threading
+        from io import BytesIO
+
+        started, proceed = threading.Event(), threading.Event()
+
+        class BlockingExporter(XLSExporter):
+            def _write_cell(self, cell):
+                started.set()
+                proceed.wait(10)
+                super(BlockingExporter, self)._write_cell(cell)
+
+        nb = nbformat.read(self._get_notebook('ExcelTest4.ipynb'), as_version=4)
+        exporter = BlockingExporter()
+
+        async def cancel_export():
+            task = asyncio.ensure_future(exporter.export_async(nb, BytesIO()))
+            await asyncio.get_running_loop().run_in_executor(None, started.wait, 10)
+            task.cancel()
+            await asyncio.sleep(0)
+            proceed.set()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            assert [cell['cell'] for cell in exporter.stats.cells] == [1]
+
+            # The exporter is free for the next export
+            output = BytesIO()
+            await exporter.export_async(nb, output)
+            return output.getvalue()
+
+        assert len(asyncio.run(cancel_export())) > 0
+
+    def test_export_async_cancel_parallel(self):
+        """
+        With render_workers, does cancelling export_async stop without waiting for the cells still queued?
+        """
+        import asyncio
+        from io import BytesIO
+
+        nb = nbformat.v4.new_notebook()
+        for n in range(16):
+            svg = '<svg xmlns="http://www.w3.org/2000/svg" width="{0}" height="{0}"></svg>'.format(n+1)
+            nb.cells.append(nbformat.v4.new_code_cell('show()', outputs=[
+                nbformat.v4.new_output('display_data', data={'image/svg+xml': svg}),
+            ]))
+        exporter = XLSExporter(svg_rasterizer='test_nb2xls.slow_rasterize', render_workers=2, render_pool='thread')
+        del slow_rasterized[:]
+
+        async def cancel_export():
+            task = asyncio.ensure_future(exporter.export_async(nb, BytesIO()))
+            while not slow_rasterized:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancel_export())
+        # Only the cells being rendered or queued when the export was cancelled, not all 16
+        assert len(slow_rasterized) <= 2*4 + 2
+
+
+slow_rasterized = []
+
+
+def slow_rasterize(svg):
+    """
+    svg_rasterizer taking long enough for an export to be cancelled part way
+    """
+    import time
+    from test_images import fake_rasterize
+    slow_rasterized.append(svg)
+    time.sleep(0.1)
+    return fake_rasterize(svg)
@@ -0,0 +1,108 @@
+from io import BytesIO
+
+import nbformat
+import pytest
+import xlsxwriter
+from traitlets import TraitError
+
+from nb2xls.exporter import XLSExporter
+from nb2xls.sheets import unique_sheet_name, top_heading, MAX_SHEET_ROWS
+
+openpyxl = pytest.importorskip('openpyxl')
+
+
+def _sheets(output):
+    workbook = openpyxl.load_workbook(BytesIO(output))
+    return {sheet.title: [row[:2] for row in sheet.iter_rows(values_only=True)] for sheet in workbook.worksheets}
+
+
+def test_unique_sheet_name():
+    workbook = xlsxwriter.Workbook(BytesIO())
+    workbook.add_worksheet('Results')
+    assert unique_sheet_name('Results: [final]?', workbook) == 'Results final'
+    assert unique_sheet_name('results', workbook) == 'results (2)'
+    workbook.add_worksheet('Results (2)')
+    assert unique_sheet_name('Results (2)', workbook) == 'Results (3)'
+    assert len(unique_sheet_name('x' * 40, workbook)) == 31
+    assert unique_sheet_name("'/'", workbook) == 'Sheet'
+
+
+def test_top_heading():
+    assert top_heading('# The **Results** #\n\nText') == 'The Results'
+    assert top_heading('\nResults\n=======\n') == 'Results'
+    assert top_heading('## Subsection') is None
+    assert top_heading('#hashtag') is None
+    assert top_heading('Text') is None
+
+
+def _layout_notebook():
+    nb = nbformat.v4.new_notebook()
+    nb.cells.append(nbformat.v4.new_markdown_cell('Preamble'))
+    nb.cells.append(nbformat.v4.new_markdown_cell('# Intro'))
+    nb.cells.append(nbformat.v4.new_code_cell('print(1)', outputs=[
+        nbformat.v4.new_output('stream', name='stdout', text='1')]))
+    nb.cells.append(nbformat.v4.new_markdown_cell('# Results\n\n## Detail'))
+    return nb
+
+
+def test_sheet_layout_heading():
+    (output, resources) = XLSExporter(sheet_layout='heading').from_notebook_node(_layout_notebook())
+    sheets = _sheets(output)
+    assert list(sheets) == ['Sheet1', 'Intro', 'Results']
+    assert sheets['Intro'] == [('2', 'Intro'), (None, None), ('3', '1')]
+    assert sheets['Results'][0] == ('4', 'Results')
+
+
+def test_sheet_layout_cell():
+    (output, resources) = XLSExporter(sheet_layout='cell').from_notebook_node(_layout_notebook())
+    assert list(_sheets(output)) == ['Cell 1', 'Cell 2', 'Cell 3', 'Cell 4']
+
+
+def _table_notebook(rows):
+    html = '<table>' + ''.join('<tr><td>{}</td></tr>'.format(i) for i in range(rows)) + '</table>'
+    nb = nbformat.v4.new_notebook()
+    nb.cells.append(nbformat.v4.new_code_cell('table', outputs=[
+        nbformat.v4.new_output('display_data', data={'text/html': html})]))
+    nb.cells.append(nbformat.v4.new_code_cell('small', outputs=[
+        nbformat.v4.new_output('display_data', data={'text/html': '<table><tr><td>7</td></tr></table>'})]))
+    return nb
+
+
+@pytest.mark.parametrize("options", [{}, {'render_workers': 2, 'render_pool': 'thread'}, {'cell_cache_dir': True}])
+def test_table_sheet_rows(options, tmpdir):
+    if options.get('cell_cache_dir'):
+        options = {'cell_cache_dir': str(tmpdir)}
+
+    for _ in range(2):
+        (output, resources) = XLSExporter(table_sheet_rows=3, **options).from_notebook_node(_table_notebook(5))
+        sheets = _sheets(output)
+        assert list(sheets) == ['Sheet1', 'Table 1']
+        assert sheets['Sheet1'] == [('1', 'Table of 5 rows'), (None, None), ('2', 7)]
+        assert sheets['Table 1'] == [(None, i) for i in range(5)]
+
+        link = openpyxl.load_workbook(BytesIO(output))['Sheet1']['B1'].hyperlink
+        assert link.location == "'Table 1'!A1"
+
+
+@pytest.mark.parametrize("options", [{}, {'render_workers': 2, 'render_pool': 'thread'}, {'cell_cache_dir': True}])
+def test_max_sheet_rows(options, tmpdir):
+    if options.get('cell_cache_dir'):
+        options = {'cell_cache_dir': str(tmpdir)}
+
+    nb = nbformat.v4.new_notebook()
+    nb.cells.append(nbformat.v4.new_code_cell('log', outputs=[
+        nbformat.v4.new_output('stream', name='stdout', text='\n'.join('line {}'.format(i) for i in range(12)))]))
+    nb.cells.append(nbformat.v4.new_markdown_cell('Done'))
+
+    (output, resources) = XLSExporter(max_sheet_rows=5, **options).from_notebook_node(nb)
+    sheets = _sheets(output)
+    assert list(sheets) == ['Sheet1', 'Sheet1 (2)', 'Sheet1 (3)']
+    assert [row[1] for sheet in sheets.values() for row in sheet] == \
+        ['line {}'.format(i) for i in range(12)] + [None, 'Done']
+    assert all(len(sheet) <= 5 for sheet in sheets.values())
+
+
+@pytest.mark.parametrize("rows", [0, -1, MAX_SHEET_ROWS+1])
+def test_max_sheet_rows_invalid(rows):
+    with pytest.raises(TraitError):
+        XLSExporter(max_sheet_rows=rows)
@@ -0,0 +1,211 @@
+import io
+import json
+from datetime import datetime
+
+import nbformat
+import numpy as np
+import openpyxl
+import pandas as pd
+import pytest
+from bs4 import BeautifulSoup
+
+from nb2xls.exporter import XLSExporter
+from nb2xls.tables import is_dataframe_html, parse_dataframe_html, rows_from_soup, convert_column, NA_FORMULA, \
+    infer_column, excel_table_headers, TableCell, place_cells, rows_from_frame
+from nb2xls.sidecar import save_sidecar
+
+
+def _frames():
+    df = pd.DataFrame({'a': [1.5, np.nan, 3], 'b': ['x', 'y & z', '<b>']}, index=['r1', 'r2', 'r3'])
+    multi = pd.DataFrame(np.arange(12).reshape(4, 3),
+                         index=pd.MultiIndex.from_product([['A', 'B'], [1, 2]], names=['outer', 'inner']),
+                         columns=pd.MultiIndex.from_tuples([('x', 'one'), ('x', 'two'), ('y', 'one')]))
+    return [df, multi]
+
+
+@pytest.mark.parametrize("df", _frames())
+def test_dataframe_tokenizer_matches_soup(df):
+    html = df._repr_html_()
+    assert is_dataframe_html(html)
+
+    def cells(rows):
+        return [[(c.value, c.header, c.rowspan, c.colspan) for c in row] for row in rows]
+
+    assert cells(parse_dataframe_html(html)) == cells(rows_from_soup(BeautifulSoup(html, 'html.parser').table))
+
+
+def test_is_dataframe_html():
+    assert not is_dataframe_html('<table><tr><td>1</td></tr></table>')
+    df = _frames()[0]
+    assert not is_dataframe_html(df._repr_html_() + df._repr_html_())
+    assert not is_dataframe_html(df._repr_html_().replace('</table>', '</table>Some more text'))
+
+
+def test_convert_column():
+    assert convert_column(['1', '2.5', 'nan']) == [1.0, 2.5, NA_FORMULA]
+    assert convert_column(['1', 'x', '']) == [1.0, 'x', '']
+
+
+def test_export_dataresource():
+    df = _frames()[0]
+    df.index.name = 'key'
+    resource = {
+        'schema': {'fields': [{'name': 'key'}, {'name': 'a'}, {'name': 'b'}], 'primaryKey': ['key']},
+        'data': [{'key': k, 'a': None if a != a else a, 'b': b} for k, a, b in zip(df.index, df.a, df.b)],
+    }
+    nb = nbformat.v4.new_notebook()
+    nb.cells.append(nbformat.v4.new_code_cell('df', outputs=[
+        nbformat.v4.new_output('execute_result', data={'application/vnd.dataresource+json': resource,
+                                                       'text/html': df._repr_html_()}),
+    ]))
+
+    (output, resources) = XLSExporter().from_notebook_node(nb)
+
+    ws = openpyxl.load_workbook(io.BytesIO(output)).active
+    values = [[c.value for c in row] for row in ws.iter_rows(min_col=2, max_col=4)]
+    assert values == [['key', 'a', 'b'], ['r1', 1.5, 'x'], ['r2', '=NA()', 'y & z'], ['r3', 3, '<b>']]
+
+    # Lists and objects from object columns are written as JSON text
+    df = pd.DataFrame({'a': [[1, 2], [3]], 'b': [{'x': 1}, None]})
+    nb.cells[0].outputs[0].data = {'application/vnd.dataresource+json': json.loads(df.to_json(orient='table')),
+                                   'text/html': df._repr_html_()}
+
+    (output, resources) = XLSExporter().from_notebook_node(nb)
+
+    ws = openpyxl.load_workbook(io.BytesIO(output)).active
+    values = [[c.value for c in row] for row in ws.iter_rows(min_col=2, max_col=4)]
+    assert values == [[None, 'a', 'b'], [0, '[1, 2]', '{"x": 1}'], [1, '[3]', '=NA()']]
+
+
+def test_export_dataresource_dates():
+    df = pd.DataFrame({'day': pd.date_range('2020-01-01', periods=2),
+                       'when': pd.date_range('2020-01-01 10:30', periods=2),
+                       'utc': pd.date_range('2020-01-01', periods=2, tz='UTC')})
+    nb = nbformat.v4.new_notebook()
+    nb.cells.append(nbformat.v4.new_code_cell('df', outputs=[
+        nbformat.v4.new_output('execute_result', data={
+            'application/vnd.dataresource+json': json.loads(df.to_json(orient='table')),
+            'text/html': df._repr_html_()}),
+    ]))
+
+    ws = openpyxl.load_workbook(io.BytesIO(XLSExporter().from_notebook_node(nb)[0])).active
+    assert ws['C2'].value == '2020-01-01T00:00:00.000'
+
+    ws = openpyxl.load_workbook(io.BytesIO(XLSExporter(table_types=True).from_notebook_node(nb)[0])).active
+    assert [[c.value for c in row] for row in ws.iter_rows(min_row=2, min_col=3, max_col=5)] == [
+        [datetime(2020, 1, 1), datetime(2020, 1, 1, 10, 30), datetime(2020, 1, 1)],
+        [datetime(2020, 1, 2), datetime(2020, 1, 2, 10, 30), datetime(2020, 1, 2)],
+    ]
+    assert [ws.cell(2, col).number_format for col in (3, 4, 5)] == ['yyyy-mm-dd', 'yyyy-mm-dd hh:mm:ss', 'yyyy-mm-dd']
+
+
+def test_infer_column():
+    assert infer_column(['1', '2.5', 'nan']) == ([1.0, 2.5, NA_FORMULA], None)
+    assert infer_column(['1,234', '12', 'NaN', '-3,000.50']) == ([1234.0, 12.0, NA_FORMULA, -3000.5], '#,##0.00')
+    assert infer_column(['12%', '3.5%']) == ([0.12, 0.035], '0.0%')
+    assert infer_column(['True', 'False']) == ([True, False], None)
+    assert infer_column(['2020-01-31', 'NaT']) == ([datetime(2020, 1, 31), NA_FORMULA], 'yyyy-mm-dd')
+    assert infer_column(['2020-01-31 12:30:00.123456789']) == \
+        ([datetime(2020, 1, 31, 12, 30, 0, 123456)], 'yyyy-mm-dd hh:mm:ss')
+    assert infer_column(['date', '2020-01-31'], [False, True]) == (['date', datetime(2020, 1, 31)], 'yyyy-mm-dd')
+
+    # Anything that doesn't fit is converted as before
+    assert infer_column(['2020-13-45']) == (['2020-13-45'], None)
+    assert infer_column(['1', 'x', '']) == ([1.0, 'x', ''], None)
+
+
+def test_excel_table_headers():
+    rows = [[TableCell('', True), TableCell('a', True), TableCell('A', True)],
+            [TableCell('r1', True), TableCell('1'), TableCell('2')]]
+    assert excel_table_headers(rows) == ['index', 'a', 'A (2)']
+    assert excel_table_headers(rows[:1]) is None
+    assert excel_table_headers(rows + [[TableCell('r2', True), TableCell('1', colspan=2)]]) is None
+
+
+def test_export_table_types():
+    df = pd.DataFrame({'when': pd.to_datetime(['2020-01-31', '2020-02-29']), 'big': [1234567, 89],
+                       'share': ['12.5%', '3.0%'], 'ok': [True, False],
+                       'note': ['a rather long piece of text for this column', 'x']})
+    nb = nbformat.v4.new_notebook()
+    nb.cells.append(nbformat.v4.new_code_cell('df', outputs=[
+        nbformat.v4.new_output('execute_result', data={'text/html': df.to_html(formatters={'big': '{:,}'.format})}),
+    ]))
+
+    (output, resources) = XLSExporter(table_types=True, excel_tables=True,
+                                      table_column_widths=True).from_notebook_node(nb)
+
+    ws = openpyxl.load_workbook(io.BytesIO(output)).active
+    values = [[c.value for c in row] for row in ws.iter_rows(min_col=2, max_col=7)]
+    assert values == [['index', 'when', 'big', 'share', 'ok', 'note'],
+                      [0, datetime(2020, 1, 31), 1234567, 0.125, True, 'a rather long piece of text for this column'],
+                      [1, datetime(2020, 2, 29), 89, 0.03, False, 'x']]
+    assert ws['C2'].number_format == 'yyyy-mm-dd' and ws['D2'].number_format == '#,##0' and \
+        ws['E2'].number_format == '0.0%'
+
+    assert list(ws.tables) == ['Table1']
+    assert ws.tables['Table1'].ref == 'B1:G3' and ws.tables['Table1'].autoFilter is not None
+
+    assert ws.column_dimensions['G'].width > 40
+    assert 10 < ws.column_dimensions['C'].width < 15
+
+
+def test_place_cells():
+    def cols(rows):
+        return [[(col, cell.value) for col, cell in placed] for placed in place_cells(rows)]
+
+    # A cell spanning rows and columns covers all its columns in the rows below
+    rows = [[TableCell('a', rowspan=2), TableCell('b', rowspan=2, colspan=2), TableCell('c')], [TableCell('d')]]
+    assert cols(rows) == [[(0, 'a'), (1, 'b'), (3, 'c')], [(3, 'd')]]
+
+    # A span in the last column ends where it should, even when the rows below are short
+    rows = [[TableCell('a'), TableCell('b', rowspan=2)], [TableCell('c')], [TableCell('d'), TableCell('e')]]
+    assert cols(rows) == [[(0, 'a'), (1, 'b')], [(0, 'c')], [(0, 'd'), (1, 'e')]]
+
+
+@pytest.mark.parametrize("df", _frames())
+def test_rows_from_frame(df):
+    def cells(rows):
+        # Values from the frame keep their types, pandas shows NaN for missing ones
+        return [[('NaN' if c.value != c.value else str(c.value), c.header, c.rowspan, c.colspan) for c in row]
+                for row in rows]
+
+    assert cells(rows_from_frame(df)) == cells(parse_dataframe_html(df._repr_html_()))
+
+
+def _frame_notebook(df, metadata=None):
+    nb = nbformat.v4.new_notebook()
+    nb.cells.append(nbformat.v4.new_code_cell('df', outputs=[
+        nbformat.v4.new_output('display_data', data={'text/html': df._repr_html_()}, metadata=metadata or {}),
+    ]))
+    return nb
+
+
+def test_export_merged_spans():
+    nb = _frame_notebook(_frames()[1])
+
+    ws = openpyxl.load_workbook(io.BytesIO(XLSExporter().from_notebook_node(nb)[0])).active
+    assert len(ws.merged_cells.ranges) == 0
+
+    ws = openpyxl.load_workbook(io.BytesIO(XLSExporter(merge_table_spans=True).from_notebook_node(nb)[0])).active
+    assert sorted(str(r) for r in ws.merged_cells.ranges) == ['B4:B5', 'B6:B7', 'D1:E1']
+    assert ws['D1'].value == 'x' and ws['B6'].value == 'B'
+
+
+def test_export_sidecar(tmpdir):
+    df = pd.DataFrame({'a': np.arange(100), 'when': pd.date_range('2020-01-01', periods=100)})
+    with pd.option_context('display.max_rows', 10, 'display.min_rows', 4):
+        nb = _frame_notebook(df, save_sidecar(df, str(tmpdir.join('df.pkl'))))
+        nb.cells[0].outputs[0].metadata['nb2xls']['sidecar'] = 'df.pkl'
+
+    def values(exporter):
+        output, resources = exporter.from_notebook_node(nb, {'metadata': {'path': str(tmpdir)}})
+        return [[c.value for c in row] for row in openpyxl.load_workbook(io.BytesIO(output)).active.iter_rows(min_col=2)]
+
+    assert len(values(XLSExporter())) == 1 + 4 + 1
+
+    rows = values(XLSExporter(table_sidecars=True))
+    assert len(rows) == 1 + 100
+    assert rows[0] == [None, 'a', 'when'] and rows[-1] == [99, 99, datetime(2020, 4, 9)]
+
+    tmpdir.join('df.pkl').remove()
+    assert len(values(XLSExporter(table_sidecars=True))) == 1 + 4 + 1